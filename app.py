@@ -1,28 +1,85 @@
-from flask import Flask, render_template, jsonify, request, send_from_directory
+from flask import Flask, Response, abort, render_template, jsonify, request, send_from_directory
 from flask_cors import CORS
-from werkzeug.utils import secure_filename
-from PIL import Image
+from werkzeug.utils import safe_join, secure_filename
+import atexit
+import base64
+import binascii
+import copy
+import gzip
 import json
+import mimetypes
 import os
+import threading
+import time
 import uuid
 import sqlite3
+from contextlib import nullcontext
 from datetime import datetime
+from itertools import repeat
+
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from cargo_snapshot import build_cargo_snapshot
+from change_feed import ChangeFeed, init_change_log
+from config_store import ConfigStore, RevisionConflict, check_layout
+from database import ConnectionPool, load_db_settings
+from image_jobs import ImageJobQueue, QueueFull, make_composite, make_derivatives
+from image_store import (SKU_IMAGE_COLUMNS, ImageStore, content_digest, content_hash, fingerprint,
+                         init_image_schema, thumbnail_name)
+from json_patch import JsonPatchError, apply_patch
+from layout_db import LAYOUT_KEYS, LayoutDB, aisle_points, init_layout_schema
+from layout_validation import DEFAULT_MIN_AISLE_WIDTH, LayoutValidator
+from occupancy import DEFAULT_HEATMAP_RESOLUTION, DEFAULT_HISTOGRAM_BINS, AnalyticsError, OccupancyEngine
+from process_lock import ProcessLock
+from routing import RouteCache, RoutingError, access_points, plan_route
+from scene_tiles import DEFAULT_LOD_DISTANCES, SceneIndex, SceneQueryError
+from sku_bulk import FORMAT_MIMETYPES, BulkFormatError, detect_format, import_skus, iter_export, read_records
+from slotting import DEFAULT_LAYER_LOAD, SlottingError, parse_items, plan_slotting
+from stacking import DEFAULT_CARGO_SIZE, settle_cargo_rows
+from texture_atlas import TextureAtlas, init_atlas_schema
+from upload_gc import GC_GRACE_PERIOD, collect_garbage
+from warehouse_stats import VersionedCache, cargo_measure_rows, init_stats_schema, read_stats, shelf_breakdown
 
 app = Flask(__name__)
 CORS(app)
 
-CONFIG_FILE = 'warehouse_config.json'
-SKU_DB_FILE = 'sku_data.db'
+CONFIG_FILE = os.environ.get('WAREHOUSE_CONFIG_FILE', 'warehouse_config.json')
+SKU_DB_FILE = os.environ.get('WAREHOUSE_DB_FILE', 'sku_data.db')
+
+# 多进程部署（gunicorn -w N，见 gunicorn.conf.py）时开启：配置修改在跨进程锁内立即写回，各进程读取时自动同步
+SHARED_STATE = os.environ.get('WAREHOUSE_SHARED_STATE', '').lower() in ('1', 'true', 'yes')
+
+# 配置修改后延迟写回磁盘的秒数，期间的多次修改合并为一次写入
+CONFIG_FLUSH_DELAY = 1.0
+
+# 数据库连接参数（WAL、缓存、mmap、连接池大小等），可用 WAREHOUSE_DB_* 环境变量覆盖
+DB_SETTINGS = load_db_settings()
 
 SKU_IMAGE_DIR = os.path.join(app.static_folder, 'uploads', 'sku_images')
 SKU_THUMB_DIR = os.path.join(app.static_folder, 'uploads', 'sku_thumbnails')
 
-os.makedirs(SKU_IMAGE_DIR, exist_ok=True)
-os.makedirs(SKU_THUMB_DIR, exist_ok=True)
-
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 
-THUMBNAIL_SIZE = (150, 150)
+# 图片处理进程数（默认按 CPU 数）和排队任务上限，超出上限时上传接口返回 503
+IMAGE_WORKERS = int(os.environ.get('WAREHOUSE_IMAGE_WORKERS', 0)) or None
+IMAGE_QUEUE_LIMIT = int(os.environ.get('WAREHOUSE_IMAGE_QUEUE_LIMIT', 64))
+
+# 上传文件的浏览器缓存时间：内容寻址的文件名随内容变化，可以永久缓存；旧版随机文件名的文件缓存一天
+FINGERPRINTED_MAX_AGE = 365 * 24 * 3600
+UPLOAD_MAX_AGE = 24 * 3600
+
+# 由前端代理发送上传文件：x-sendfile（Apache/lighttpd）或 x-accel-redirect（nginx），默认由 Flask 直接发送
+UPLOAD_SENDFILE = os.environ.get('WAREHOUSE_SENDFILE', '').lower()
+UPLOAD_ACCEL_PREFIX = os.environ.get('WAREHOUSE_ACCEL_PREFIX', '/internal/uploads/')
+app.config['USE_X_SENDFILE'] = UPLOAD_SENDFILE == 'x-sendfile'
+
+# 流式输出货物列表时每批从数据库读取的行数
+CARGO_STREAM_BATCH = 1000
 
 default_config = {
     "global_params": {
@@ -40,11 +97,13 @@ default_config = {
 }
 
 
+db_pool = ConnectionPool(SKU_DB_FILE, DB_SETTINGS)
+atexit.register(db_pool.close_all)
+
+
 def get_db_connection():
-    """获取数据库连接"""
-    conn = sqlite3.connect(SKU_DB_FILE)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """从连接池获取数据库连接，用完调用 close() 归还"""
+    return db_pool.connect()
 
 def init_db():
     """初始化数据库表结构"""
@@ -73,25 +132,140 @@ def init_db():
         )
     ''')
     
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS cargos (
-            id TEXT PRIMARY KEY,
-            sku_id TEXT NOT NULL,
-            x REAL DEFAULT 0,
-            y REAL DEFAULT 0,
-            z REAL DEFAULT 0,
-            rotation REAL DEFAULT 0,
-            created_at TEXT,
-            FOREIGN KEY (sku_id) REFERENCES skus(id)
-        )
-    ''')
+    cursor.execute(CARGOS_TABLE_SQL.format(table='cargos'))
+    migrate_cargo_cascade(cursor)
     
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_sku_code ON skus(sku_code)')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_sku_name ON skus(name)')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_cargo_sku ON cargos(sku_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_cargo_created ON cargos(created_at DESC)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_sku_created ON skus(created_at DESC, id DESC)')
+    
+    fts_enabled = init_sku_search(cursor)
+    init_change_counters(cursor)
+    init_stats_schema(cursor)
+    init_change_log(cursor)
+    init_layout_schema(cursor)
+    init_image_schema(cursor)
+    init_atlas_schema(cursor)
     
     conn.commit()
     conn.close()
+    return fts_enabled
+
+CARGOS_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS {table} (
+        id TEXT PRIMARY KEY,
+        sku_id TEXT NOT NULL,
+        x REAL DEFAULT 0,
+        y REAL DEFAULT 0,
+        z REAL DEFAULT 0,
+        rotation REAL DEFAULT 0,
+        created_at TEXT,
+        FOREIGN KEY (sku_id) REFERENCES skus(id) ON DELETE CASCADE
+    )
+'''
+
+def migrate_cargo_cascade(cursor):
+    """旧库的 cargos 外键没有 ON DELETE CASCADE：删除引用已删除 SKU 的货物后重建表
+
+    重建后旧表上的索引和触发器随之删除，由 init_db 后续步骤重新创建。
+    """
+    cursor.execute('PRAGMA foreign_key_list(cargos)')
+    if all(row['on_delete'] == 'CASCADE' for row in cursor.fetchall()):
+        return
+    
+    cursor.execute('DELETE FROM cargos WHERE sku_id NOT IN (SELECT id FROM skus)')
+    cursor.execute(CARGOS_TABLE_SQL.format(table='cargos_migrated'))
+    cursor.execute('''
+        INSERT INTO cargos_migrated (id, sku_id, x, y, z, rotation, created_at)
+        SELECT id, sku_id, x, y, z, rotation, created_at FROM cargos
+    ''')
+    cursor.execute('DROP TABLE cargos')
+    cursor.execute('ALTER TABLE cargos_migrated RENAME TO cargos')
+
+def init_change_counters(cursor):
+    """为 skus/cargos 表维护修改计数（触发器自增），用作缓存的版本号和 ETag"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS change_counters (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    for table in ('skus', 'cargos'):
+        cursor.execute('INSERT OR IGNORE INTO change_counters (name, value) VALUES (?, 0)', (table,))
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_counter_{event.lower()} AFTER {event} ON {table} BEGIN
+                    UPDATE change_counters SET value = value + 1 WHERE name = '{table}';
+                END
+            ''')
+
+def get_change_counters(cursor):
+    cursor.execute('SELECT name, value FROM change_counters')
+    return {row['name']: row['value'] for row in cursor.fetchall()}
+
+def init_sku_search(cursor):
+    """创建 SKU 名称/编码的 FTS5 全文索引（trigram 分词，支持任意子串匹配），由触发器保持同步
+
+    skus 以 TEXT 为主键，隐式 rowid 在 VACUUM 后可能改变，不能用来关联索引：
+    索引中直接保存 SKU ID，文档编号取自 skus_fts_ids 的 INTEGER PRIMARY KEY，删除和修改时按它定位。
+    旧版本按 rowid 关联 skus 的外部内容索引会被删除重建。
+    当前 SQLite 不支持 FTS5 trigram 时返回 False，搜索退回 LIKE 扫描。
+    """
+    cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'skus_fts'")
+    row = cursor.fetchone()
+    rebuild = row is None or 'content=' in row[0]
+    if rebuild:
+        for trigger in ('skus_fts_insert', 'skus_fts_delete', 'skus_fts_update'):
+            cursor.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+        cursor.execute('DROP TABLE IF EXISTS skus_fts')
+        cursor.execute('DROP TABLE IF EXISTS skus_fts_ids')
+    
+    try:
+        cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS skus_fts USING fts5(
+                id UNINDEXED, name, sku_code, tokenize='trigram'
+            )
+        ''')
+    except sqlite3.OperationalError as e:
+        print(f"FTS5 全文索引不可用，SKU 搜索将使用 LIKE: {e}")
+        return False
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS skus_fts_ids (
+            seq INTEGER PRIMARY KEY,
+            id TEXT NOT NULL UNIQUE
+        )
+    ''')
+    
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS skus_fts_insert AFTER INSERT ON skus BEGIN
+            INSERT INTO skus_fts_ids (id) VALUES (new.id);
+            INSERT INTO skus_fts (rowid, id, name, sku_code)
+            VALUES ((SELECT seq FROM skus_fts_ids WHERE id = new.id), new.id, new.name, new.sku_code);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS skus_fts_delete AFTER DELETE ON skus BEGIN
+            DELETE FROM skus_fts WHERE rowid = (SELECT seq FROM skus_fts_ids WHERE id = old.id);
+            DELETE FROM skus_fts_ids WHERE id = old.id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS skus_fts_update AFTER UPDATE OF id, name, sku_code ON skus BEGIN
+            UPDATE skus_fts_ids SET id = new.id WHERE id = old.id;
+            UPDATE skus_fts SET id = new.id, name = new.name, sku_code = new.sku_code
+            WHERE rowid = (SELECT seq FROM skus_fts_ids WHERE id = new.id);
+        END
+    ''')
+    
+    if rebuild:
+        cursor.execute('INSERT INTO skus_fts_ids (id) SELECT id FROM skus')
+        cursor.execute('''
+            INSERT INTO skus_fts (rowid, id, name, sku_code)
+            SELECT m.seq, s.id, s.name, s.sku_code FROM skus s JOIN skus_fts_ids m ON m.id = s.id
+        ''')
+    return True
 
 def sku_row_to_dict(row):
     """将数据库行转换为字典"""
@@ -123,177 +297,711 @@ def sku_row_to_dict(row):
         "created_at": row['created_at']
     }
 
-init_db()
+def with_image_status(skus):
+    """为 SKU 字典列表补充缩略图的生成状态 image_status：ready / pending / failed，
+    文件不存在且没有任务记录时为 missing，没有缩略图时为 ready。
+
+    内容寻址的派生图以 image_files 中的记录为准（同名文件可能是之前生成的），不检查文件；
+    没有记录的（合成缩略图、旧版文件名）看本进程的任务，再看文件是否存在。
+    整页只查询一次数据库，只用于 SKU 列表和单个 SKU 接口，货物流和快照中不包含该字段。
+    """
+    thumbnails = {sku['thumbnail'] for sku in skus if sku['thumbnail']}
+    statuses = image_store.derivative_statuses(thumbnails)
+    for thumbnail in thumbnails - statuses.keys():
+        status = image_jobs.status_for(thumbnail)
+        if status is None:
+            status = 'ready' if os.path.exists(os.path.join(SKU_THUMB_DIR, thumbnail)) else 'missing'
+        statuses[thumbnail] = status
+    for sku in skus:
+        sku['image_status'] = statuses.get(sku['thumbnail'], 'ready')
+    return skus
+
+# 由 create_app 在初始化数据库时设置
+SKU_FTS_ENABLED = False
+app_ready = False
+init_lock = threading.Lock()
+
+layout_db = LayoutDB(get_db_connection)
+config_store = ConfigStore(CONFIG_FILE, default_config, flush_delay=CONFIG_FLUSH_DELAY, layout=layout_db,
+                           shared=SHARED_STATE)
+atexit.register(config_store.close)
+
+image_jobs = ImageJobQueue(max_workers=IMAGE_WORKERS, max_pending=IMAGE_QUEUE_LIMIT)
+atexit.register(image_jobs.shutdown)
+
+image_store = ImageStore(get_db_connection, SKU_IMAGE_DIR, SKU_THUMB_DIR)
+texture_atlas = TextureAtlas(get_db_connection, image_jobs, SKU_IMAGE_DIR, SKU_THUMB_DIR, '/static/uploads/sku_thumbnails/')
+
+# 每个进程同时保持的 SSE 连接数上限，超出时返回 503，客户端改用 /api/changes 轮询；0 表示不限制
+SSE_MAX_CONNECTIONS = int(os.environ.get('WAREHOUSE_SSE_MAX_CONNECTIONS', 0)) or None
+
+change_feed = ChangeFeed(get_db_connection, max_streams=SSE_MAX_CONNECTIONS)
+atexit.register(change_feed.close)
 
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def load_config():
-    if os.path.exists(CONFIG_FILE):
+def remove_legacy_sku_files(row):
+    """删除旧版随机文件名的图片和缩略图（内容寻址的图片按引用计数释放）"""
+    if not row['image'] or content_digest(row['image']):
+        return
+    for directory, filename in ((SKU_IMAGE_DIR, row['image']), (SKU_THUMB_DIR, row['thumbnail'])):
+        path = os.path.join(directory, filename) if filename else None
+        if path and os.path.exists(path):
+            os.remove(path)
+
+def submit_derivatives(filename, digest):
+    """为新图片提交派生图生成任务，返回任务信息；已有排队中的任务时直接返回该任务"""
+    job = image_jobs.job_for(thumbnail_name(digest))
+    if job is not None and job['status'] == 'pending':
+        return job
+    derivatives = image_store.derivative_paths(digest)
+
+    def record(finished):
+        image_store.mark_derivatives(digest, 'ready' if finished['status'] == 'done' else 'failed',
+                                     finished['id'], finished['error'])
+
+    job = image_jobs.submit('derivatives', make_derivatives, os.path.join(SKU_IMAGE_DIR, filename),
+                            derivatives, outputs=[os.path.basename(path) for path, _ in derivatives],
+                            on_finish=record)
+    image_store.mark_derivatives(digest, 'pending', job['id'])
+    return job
+
+def resume_derivatives(pending, retry_delay=1.0):
+    """在后台线程中重新提交上次退出时未完成的派生图任务，队列满时等待后重试"""
+    def resume():
+        for filename, digest in pending:
+            while True:
+                try:
+                    submit_derivatives(filename, digest)
+                    break
+                except QueueFull:
+                    time.sleep(retry_delay)
+    if pending:
+        threading.Thread(target=resume, name='resume-derivatives', daemon=True).start()
+
+def queue_full_response(e):
+    response = jsonify({"error": str(e)})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+def create_app():
+    """应用工厂：创建上传目录、初始化数据库并加载配置，返回 app
+
+    导入模块不再有副作用，开发服务器和 gunicorn（app:create_app()）都通过它启动；
+    重复调用只初始化一次。多个 worker 同时启动时由跨进程锁保证初始化依次进行。
+    """
+    global SKU_FTS_ENABLED, app_ready
+    with init_lock:
+        if app_ready:
+            return app
+        os.makedirs(SKU_IMAGE_DIR, exist_ok=True)
+        os.makedirs(SKU_THUMB_DIR, exist_ok=True)
+        lock = ProcessLock(SKU_DB_FILE + '.init.lock') if SHARED_STATE else nullcontext()
+        with lock:
+            SKU_FTS_ENABLED = init_db()
+            # 首次加载配置时可能需要把旧文件中的布局迁移到数据库，在启动阶段完成
+            with config_store.read():
+                pass
+            config_store.flush()
+            pending_derivatives = image_store.resumable_derivatives()
+        resume_derivatives(pending_derivatives)
+        app_ready = True
+    return app
+
+@app.before_request
+def ensure_initialized():
+    # 直接以 app:app 或 flask run 启动时没有调用工厂，在第一个请求前完成初始化
+    if not app_ready and request.endpoint != 'health_check':
+        create_app()
+
+@app.route('/healthz')
+def health_check():
+    """存活检查：进程能够处理请求即返回 200"""
+    response = jsonify({"status": "ok"})
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@app.route('/readyz')
+def readiness_check():
+    """就绪检查：已完成初始化、数据库可访问且配置可读时返回 200，否则返回 503"""
+    checks = {"initialized": app_ready}
+    try:
+        conn = get_db_connection()
         try:
-            with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except (json.JSONDecodeError, UnicodeDecodeError):
-            return default_config.copy()
-    return default_config.copy()
-
-def save_config(config):
-    with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-        json.dump(config, f, ensure_ascii=False, indent=2)
-
-def create_thumbnail(image_path, thumb_path):
-    """创建缩略图"""
-    try:
-        with Image.open(image_path) as img:
-            img.thumbnail(THUMBNAIL_SIZE, Image.Resampling.LANCZOS)
-            if img.mode in ('RGBA', 'LA'):
-                background = Image.new('RGB', img.size, (255, 255, 255))
-                background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
-                img = background
-            img.save(thumb_path, 'JPEG', quality=85)
-            return True
-    except Exception as e:
-        print(f"创建缩略图失败: {e}")
-        return False
+            conn.execute('SELECT 1 FROM warehouse_stats LIMIT 1').fetchall()
+        finally:
+            conn.close()
+        checks["database"] = True
+    except sqlite3.Error as e:
+        checks["database"] = False
+        checks["database_error"] = str(e)
+    try:
+        checks["config_revision"] = config_store.revision
+    except (OSError, ValueError, sqlite3.Error) as e:
+        checks["config_error"] = str(e)
+
+    ready = app_ready and checks["database"] and "config_error" not in checks
+    response = jsonify({"status": "ready" if ready else "unavailable", **checks})
+    response.headers['Cache-Control'] = 'no-store'
+    return response, 200 if ready else 503
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
 
+def revision_conflict_response(e):
+    """revision 过期时返回 409 和服务端当前 revision"""
+    return jsonify({"error": "配置已被其他客户端修改", "revision": e.current_revision}), 409
+
+
 @app.route('/api/config', methods=['GET', 'POST'])
 def manage_config():
     if request.method == 'POST':
-        data = request.json
-        config = load_config()
-        config.update(data)
-        save_config(config)
-        return jsonify({"status": "success"})
+        data = request.get_json(silent=True)
+        try:
+            check_layout(data)
+        except ValueError as e:
+            return jsonify({"error": f"配置格式错误: {e}"}), 400
+        expected_revision = data.pop('revision', None)
+        try:
+            with config_store.write(expected_revision, reindex='shelves' in data) as config:
+                config.update(data)
+                revision = config['revision']
+        except RevisionConflict as e:
+            return revision_conflict_response(e)
+        return jsonify({"status": "success", "revision": revision})
+    
+    with config_store.read() as config:
+        return jsonify(config)
+
+def patch_touches(operations, key):
+    """判断补丁是否涉及配置的某个顶层字段"""
+    if not isinstance(operations, list):
+        return False
+    return any(isinstance(op, dict) and str(op.get(field, '')).split('/')[:2] == ['', key]
+               for op in operations for field in ('path', 'from'))
+
+@app.route('/api/config', methods=['PATCH'])
+def patch_config():
+    """增量更新配置（RFC 6902 JSON Patch），携带 revision 做乐观并发控制"""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "请求体必须是 JSON 对象"}), 400
+    operations = data.get('patch', [])
+    expected_revision = data.get('revision')
+    
+    if patch_touches(operations, 'revision'):
+        return jsonify({"error": "revision 由服务端维护，不能通过补丁修改"}), 400
     
-    config = load_config()
-    return jsonify(config)
+    try:
+        with config_store.write(expected_revision, reindex=patch_touches(operations, 'shelves')) as config:
+            apply_patch(config, operations, validate=check_layout)
+            revision = config['revision']
+    except RevisionConflict as e:
+        return revision_conflict_response(e)
+    except JsonPatchError as e:
+        return jsonify({"error": f"补丁无法应用: {e}"}), 400
+    
+    return jsonify({"status": "success", "revision": revision})
 
 @app.route('/api/config/global', methods=['POST'])
 def update_global_config():
     data = request.json
-    config = load_config()
-    
-    if 'global_params' not in config:
-        config['global_params'] = default_config['global_params'].copy()
-    
-    config['global_params'].update(data)
-    save_config(config)
-    return jsonify({"status": "success"})
+    with config_store.write(reindex=False) as config:
+        if 'global_params' not in config:
+            config['global_params'] = default_config['global_params'].copy()
+        
+        config['global_params'].update(data)
+        revision = config['revision']
+    return jsonify({"status": "success", "revision": revision})
 
 
 @app.route('/api/shelves', methods=['GET', 'POST'])
 def manage_shelves():
-    config = load_config()
     if request.method == 'POST':
-        shelf_data = request.json
-        config['shelves'].append(shelf_data)
-        save_config(config)
-        return jsonify({"status": "success", "id": len(config['shelves']) - 1})
-    
-    return jsonify(config['shelves'])
+        shelf_data = request.get_json(silent=True)
+        if not isinstance(shelf_data, dict):
+            return jsonify({"error": "货架数据必须是 JSON 对象"}), 400
+        try:
+            with config_store.write_shelves() as shelves:
+                shelf_id = shelves.add(shelf_data)
+                revision = config_store.revision
+        except KeyError:
+            return jsonify({"error": f"货架ID已存在: {shelf_data.get('id')}"}), 409
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        return jsonify({"status": "success", "id": shelf_id, "revision": revision})
+    
+    with config_store.read_shelves() as shelves:
+        return jsonify(list(shelves))
 
-@app.route('/api/shelves/<int:shelf_id>', methods=['PUT', 'DELETE'])
+@app.route('/api/shelves/<shelf_id>', methods=['GET', 'PUT', 'DELETE'])
 def manage_shelf(shelf_id):
-    config = load_config()
-    if shelf_id < 0 or shelf_id >= len(config['shelves']):
-        return jsonify({"error": "Invalid shelf ID"}), 404
-    
-    if request.method == 'PUT':
-        update_data = request.json
-        config['shelves'][shelf_id].update(update_data)
-        save_config(config)
-        return jsonify({"status": "success"})
+    with config_store.read_shelves() as shelves:
+        if shelf_id not in shelves:
+            return jsonify({"error": "Invalid shelf ID"}), 404
+        
+        if request.method == 'GET':
+            return jsonify(shelves.get(shelf_id))
+        
+        if request.method == 'PUT':
+            update_data = request.get_json(silent=True)
+            if not isinstance(update_data, dict):
+                return jsonify({"error": "货架数据必须是 JSON 对象"}), 400
+            with config_store.write_shelves() as shelves:
+                shelves.update(shelf_id, update_data)
+                revision = config_store.revision
+            return jsonify({"status": "success", "revision": revision})
+        
+        elif request.method == 'DELETE':
+            with config_store.write_shelves() as shelves:
+                shelves.delete(shelf_id)
+                revision = config_store.revision
+            return jsonify({"status": "success", "revision": revision})
+
+@app.route('/api/shelves/batch', methods=['POST'])
+def batch_shelves():
+    """批量新增/更新/删除货架，在一次修改中完成
+
+    请求体: {"revision": 可选, "upsert": [货架数据...], "delete": [货架ID...]}
+    upsert 中带有已存在 ID 的货架合并更新，其余作为新货架添加。
+    """
+    data = request.json or {}
+    upserts = data.get('upsert', [])
+    deletes = data.get('delete', [])
+    
+    if not isinstance(upserts, list) or not isinstance(deletes, list):
+        return jsonify({"error": "upsert 和 delete 必须是数组"}), 400
+    for shelf_data in upserts:
+        if not isinstance(shelf_data, dict):
+            return jsonify({"error": "upsert 中的每一项必须是对象"}), 400
+        if 'id' in shelf_data and not isinstance(shelf_data['id'], str):
+            return jsonify({"error": f"货架ID必须是字符串: {shelf_data['id']!r}"}), 400
+    for shelf_id in deletes:
+        if not isinstance(shelf_id, str):
+            return jsonify({"error": f"货架ID必须是字符串: {shelf_id!r}"}), 400
     
-    elif request.method == 'DELETE':
-        del config['shelves'][shelf_id]
-        save_config(config)
-        return jsonify({"status": "success"})
+    try:
+        with config_store.write_shelves(data.get('revision')) as shelves:
+            deleted_count = sum(1 for shelf_id in deletes if shelves.delete(shelf_id))
+            ids = []
+            for shelf_data in upserts:
+                shelf_id = shelf_data.get('id')
+                if shelf_id and shelves.update(shelf_id, shelf_data):
+                    ids.append(shelf_id)
+                else:
+                    ids.append(shelves.add(shelf_data))
+            revision = config_store.revision
+    except RevisionConflict as e:
+        return revision_conflict_response(e)
+    
+    return jsonify({"status": "success", "ids": ids, "deleted_count": deleted_count, "revision": revision})
 
 
-@app.route('/api/statistics')
-def get_statistics():
-    config = load_config()
+@app.route('/api/layout/query', methods=['GET'])
+def query_layout():
+    """按矩形区域查询布局对象（R*Tree 空间索引）
+
+    参数: min_x, max_x, min_z, max_z 区域边界；types 逗号分隔的 shelves/parts/aisles，默认全部
+    """
+    try:
+        bounds = [float(request.args[key]) for key in ('min_x', 'max_x', 'min_z', 'max_z')]
+    except (KeyError, ValueError):
+        return jsonify({"error": "需要数值参数 min_x, max_x, min_z, max_z"}), 400
     
-    if 'global_params' not in config:
-        config['global_params'] = default_config['global_params'].copy()
+    kinds = [kind for kind in request.args.get('types', ','.join(LAYOUT_KEYS)).split(',') if kind]
+    unknown = [kind for kind in kinds if kind not in LAYOUT_KEYS]
+    if unknown:
+        return jsonify({"error": f"未知的对象类型: {', '.join(unknown)}"}), 400
     
-    global_params = config['global_params']
-    for key in ['area_count', 'channel_count', 'layer_count', 'cell_count']:
-        if key not in global_params:
-            global_params[key] = default_config['global_params'][key]
+    config_store.flush()
+    return jsonify(layout_db.query_region(*bounds, kinds=kinds))
+
+layout_validator = LayoutValidator()
+
+@app.route('/api/layout/validate', methods=['GET', 'POST'])
+def validate_layout():
+    """布局重叠与库道净宽校验（见 layout_validation.py）
+
+    GET 校验当前布局，只重新检查上一次校验之后变化的对象，参数 full=1 时全量检查。
+    POST 校验尚未保存的布局：请求体可包含 shelves/parts/aisles，缺省的部分取当前布局，
+    只检查与已校验布局不同的对象，结果不会保存。
+    """
+    proposed = {}
+    if request.method == 'POST':
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({"error": "请求体必须是 JSON 对象"}), 400
+        proposed = {kind: data[kind] for kind in LAYOUT_KEYS if kind in data}
+        if not all(isinstance(items, list) for items in proposed.values()):
+            return jsonify({"error": "shelves/parts/aisles 必须是数组"}), 400
+
+    with config_store.read() as config:
+        global_params = {**default_config['global_params'], **config.get('global_params', {})}
+        try:
+            min_aisle_width = float(global_params.get('min_aisle_width') or DEFAULT_MIN_AISLE_WIDTH)
+        except (TypeError, ValueError):
+            min_aisle_width = DEFAULT_MIN_AISLE_WIDTH
+        layout = {kind: proposed.get(kind, config.get(kind) or []) for kind in LAYOUT_KEYS}
+        result = layout_validator.validate(layout, min_aisle_width,
+                                           full=request.args.get('full') in ('1', 'true'),
+                                           commit=request.method == 'GET')
+        result['revision'] = config.get('revision', 0)
+    return jsonify(result)
+
+# 场景索引按 (配置 revision, 货物修改计数, SKU 修改计数) 缓存
+scene_index_cache = VersionedCache()
+
+def compute_scene_index():
+    with config_store.read() as config:
+        layout = copy.deepcopy({kind: config.get(kind) or [] for kind in LAYOUT_KEYS})
+        global_params = {**default_config['global_params'], **config.get('global_params', {})}
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM skus WHERE id IN (SELECT DISTINCT sku_id FROM cargos)')
+        skus = {row['id']: sku_row_to_dict(row) for row in cursor.fetchall()}
+        cursor.execute('''
+            SELECT c.id, c.sku_id, c.x, c.y, c.z, c.rotation, s.length, s.width, s.height
+            FROM cargos c LEFT JOIN skus s ON c.sku_id = s.id
+        ''')
+        rows = cursor.fetchall()
+    finally:
+        conn.close()
     
-    total_cells = global_params['area_count'] * global_params['cell_count']
-    occupied_cells = sum(1 for shelf in config.get('shelves', []) for _ in shelf.get('cells', []))
+    cargos = {key: [row[key] for row in rows] for key in ('id', 'sku_id')}
+    cargos.update({key: [row[key] or 0 for row in rows] for key in ('x', 'y', 'z', 'rotation')})
+    cargos.update({key: [row[key] or DEFAULT_CARGO_SIZE[key] for row in rows] for key in ('length', 'width', 'height')})
+    return SceneIndex(layout, cargos, skus, int(global_params['layer_count']), int(global_params['cell_count']))
+
+def parse_scene_query(data):
+    """把请求参数规范化为 SceneIndex.query 的参数"""
+    query = {"detail": data.get('detail') or 'full'}
+    try:
+        if data.get('bbox') is not None:
+            query['bbox'] = tuple(float(data['bbox'][key]) for key in ('min_x', 'max_x', 'min_z', 'max_z'))
+        if data.get('frustum') is not None:
+            planes = np.array(data['frustum'], dtype=float)
+            if planes.ndim != 2 or planes.shape[1] != 4:
+                raise SceneQueryError("frustum 必须是 [[nx, ny, nz, d]...] 数组")
+            query['planes'] = planes
+        if data.get('camera') is not None:
+            query['camera'] = tuple(float(data['camera'][key]) for key in ('x', 'y', 'z'))
+        if data.get('lod_distances') is not None:
+            near, far = (float(value) for value in data['lod_distances'])
+            query['lod_distances'] = (near, far)
+    except (KeyError, TypeError, ValueError) as e:
+        raise SceneQueryError(f"参数无效: {e}") from e
+    return query
+
+@app.route('/api/scene', methods=['GET', 'POST'])
+def query_scene():
+    """按视野与细节级别查询场景（见 scene_tiles.py）
+
+    GET 参数: min_x, max_x, min_z, max_z 查询范围；camera_x, camera_y, camera_z 相机位置；
+    detail 最高细节级别 tiles/cells/full（默认 full）；near, far 细节距离。
+    POST 请求体: {"bbox": {...}, "frustum": [[nx, ny, nz, d]...], "camera": {"x", "y", "z"},
+                 "detail": ..., "lod_distances": [near, far]}，各项均可省略。
+    """
+    if request.method == 'POST':
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({"error": "请求体必须是 JSON 对象"}), 400
+    else:
+        args = request.args
+        data = {"detail": args.get('detail')}
+        if any(key in args for key in ('min_x', 'max_x', 'min_z', 'max_z')):
+            data['bbox'] = {key: args.get(key) for key in ('min_x', 'max_x', 'min_z', 'max_z')}
+        if any(key in args for key in ('camera_x', 'camera_y', 'camera_z')):
+            data['camera'] = {key: args.get(f'camera_{key}') for key in ('x', 'y', 'z')}
+        if 'near' in args or 'far' in args:
+            data['lod_distances'] = [args.get('near', DEFAULT_LOD_DISTANCES[0]), args.get('far', DEFAULT_LOD_DISTANCES[1])]
+    
+    try:
+        query = parse_scene_query(data)
+    except SceneQueryError as e:
+        return jsonify({"error": str(e)}), 400
     
+    revision = config_store.revision
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT COUNT(*) as count FROM skus')
-    sku_count = cursor.fetchone()['count']
-    conn.close()
+    try:
+        counters = get_change_counters(conn.cursor())
+    finally:
+        conn.close()
+    version = (revision, counters.get('cargos', 0), counters.get('skus', 0))
+    index = scene_index_cache.get(version, compute_scene_index)
     
-    return jsonify({
+    try:
+        result = index.query(**query)
+    except SceneQueryError as e:
+        return jsonify({"error": str(e)}), 400
+    result['version'] = '-'.join(map(str, version))
+    return jsonify(result)
+
+
+# 货位统计按配置 revision 缓存，按货架汇总按 (revision, SKU/货物修改计数) 缓存
+cell_stats_cache = VersionedCache()
+shelf_stats_cache = VersionedCache()
+
+def count_cells(config):
+    global_params = {**default_config['global_params'], **config.get('global_params', {})}
+    total_cells = global_params['area_count'] * global_params['cell_count']
+    occupied_cells = sum(len(shelf.get('cells', [])) for shelf in config.get('shelves', []))
+    return {
         "total_cells": total_cells,
         "occupied_cells": occupied_cells,
-        "free_cells": total_cells - occupied_cells,
-        "sku_count": sku_count
-    })
+        "free_cells": total_cells - occupied_cells
+    }
+
+def compute_shelf_stats():
+    with config_store.read() as config:
+        shelves = copy.deepcopy(config.get('shelves', []))
+    conn = get_db_connection()
+    try:
+        rows = cargo_measure_rows(conn.cursor())
+    finally:
+        conn.close()
+    return shelf_breakdown(rows, shelves)
+
+@app.route('/api/statistics')
+def get_statistics():
+    """仓库统计，支持 If-None-Match
+
+    SKU/货物数量、货物总体积和总重量由触发器实时维护，货位数和按货架汇总按版本缓存，
+    数据没有变化时轮询只需读取几个计数。
+    参数: detail=shelves 时附带按货架汇总的货物数量、体积和重量
+    """
+    detail = request.args.get('detail') == 'shelves'
+    with config_store.read() as config:
+        revision = config.get('revision', 0)
+        cells = cell_stats_cache.get(revision, lambda: count_cells(config))
+    
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        # 先读修改计数再读统计值：两者之间有写入时统计值只会比 ETag 新
+        counters = get_change_counters(cursor)
+        totals = read_stats(cursor)
+    finally:
+        conn.close()
+    
+    version = (revision, counters.get('skus', 0), counters.get('cargos', 0))
+    etag = f"stats-{'shelves-' if detail else ''}{'-'.join(map(str, version))}"
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    
+    stats = {**cells, **totals}
+    if detail:
+        stats.update(shelf_stats_cache.get(version, compute_shelf_stats))
+    
+    response = jsonify(stats)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+# 货位占用分析：货物、SKU 的列式缓存随变更日志增量更新
+occupancy_engine = OccupancyEngine(get_db_connection)
+
+def load_occupancy_layout():
+    with config_store.read() as config:
+        global_params = {**default_config['global_params'], **config.get('global_params', {})}
+        return (config.get('revision', 0), copy.deepcopy(list(config.get('shelves', []))),
+                int(global_params['layer_count']), int(global_params['cell_count']),
+                float(global_params.get('layer_load_limit') or DEFAULT_LAYER_LOAD))
+
+def analytics_response(compute):
+    """同步占用分析缓存后计算结果，ETag 为 (配置 revision, 变更日志 revision)"""
+    revision, log_revision = occupancy_engine.sync(config_store.revision, load_occupancy_layout)
+    etag = f"analytics-{revision}-{log_revision}"
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    
+    try:
+        result = compute()
+    except AnalyticsError as e:
+        return jsonify({"error": str(e)}), 400
+    response = jsonify(result)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/api/analytics/occupancy', methods=['GET'])
+def get_occupancy():
+    """按货物实际位置统计的格口占用、体积占用率和每层承重
+
+    参数: detail=shelves/layers/cells 时附带按货架（及层、格口）的明细
+    """
+    return analytics_response(lambda: occupancy_engine.occupancy(request.args.get('detail')))
+
+@app.route('/api/analytics/heatmap', methods=['GET'])
+def get_heatmap():
+    """地面网格热力图
+
+    参数: metric 为 count/volume/weight/fill/velocity（默认 count）；resolution 网格边长（米）；
+    sku_id 只统计该 SKU 的货物
+    """
+    try:
+        resolution = float(request.args.get('resolution', DEFAULT_HEATMAP_RESOLUTION))
+    except ValueError:
+        return jsonify({"error": "resolution 必须是数值"}), 400
+    return analytics_response(lambda: occupancy_engine.heatmap(request.args.get('metric', 'count'), resolution,
+                                                               request.args.get('sku_id')))
+
+@app.route('/api/analytics/histogram', methods=['GET'])
+def get_capacity_histogram():
+    """剩余容量直方图：格口占用率、格口剩余容积、每层承重比例，参数 bins 为分档数"""
+    try:
+        bins = int(request.args.get('bins', DEFAULT_HISTOGRAM_BINS))
+    except ValueError:
+        return jsonify({"error": "bins 必须是整数"}), 400
+    return analytics_response(lambda: occupancy_engine.histogram(bins))
+
+@app.route('/api/analytics/sku-velocity', methods=['GET'])
+def get_sku_velocity():
+    """按周转次数排序的 SKU，参数 limit 为返回条数（默认 50）"""
+    try:
+        limit = max(int(request.args.get('limit', 50)), 0)
+    except ValueError:
+        return jsonify({"error": "limit 必须是整数"}), 400
+    return analytics_response(lambda: occupancy_engine.sku_velocity(limit))
+
+
+def parse_since(value):
+    try:
+        return max(int(value), 0) if value not in (None, '') else None
+    except ValueError:
+        return None
+
+@app.route('/api/changes/stream')
+def stream_changes():
+    """以 SSE 推送 SKU、货物、货架、零件、库道及配置的变更
+
+    参数: since 从该 revision 之后开始推送；未指定时使用 Last-Event-ID 请求头（断线重连），
+    都没有时只推送之后的新变更。无法补发时推送 reset 事件，客户端应重新全量加载。
+    本进程的 SSE 连接数已达上限时返回 503，客户端应改用 /api/changes 轮询。
+    """
+    if not change_feed.acquire_stream():
+        response = jsonify({"error": "变更推送连接数已达上限，请使用 /api/changes 轮询"})
+        response.headers['Retry-After'] = '30'
+        return response, 503
+    since = parse_since(request.args.get('since'))
+    if since is None:
+        since = parse_since(request.headers.get('Last-Event-ID'))
+    response = Response(change_feed.stream(since), mimetype='text/event-stream')
+    # 连接结束（包括客户端断开）时服务器关闭响应，释放名额
+    response.call_on_close(change_feed.release_stream)
+    response.headers['Cache-Control'] = 'no-cache'
+    # 禁止 nginx 缓冲，事件立即送达客户端
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/api/changes')
+def get_changes():
+    """不支持 SSE 时的轮询接口：返回 since 之后的变更，reset 为 true 时应重新全量加载"""
+    since = parse_since(request.args.get('since'))
+    latest = change_feed.latest
+    events = change_feed.changes_since(latest if since is None else since)
+    reset = events is None
+    body = ','.join(data for _, data in events or [])
+    return Response(f'{{"revision": {latest if reset or not events else events[-1][0]}, '
+                    f'"reset": {json.dumps(reset)}, "changes": [{body}]}}',
+                    mimetype='application/json')
 
 
 @app.route('/api/export', methods=['POST'])
 def export_config():
-    config = load_config()
-    return jsonify(config)
+    with config_store.read() as config:
+        return jsonify(config)
 
 @app.route('/api/import', methods=['POST'])
 def import_config():
-    data = request.json
-    save_config(data)
-    return jsonify({"status": "success"})
+    data = request.get_json(silent=True)
+    try:
+        config_store.replace(data)
+    except ValueError as e:
+        return jsonify({"error": f"配置格式错误: {e}"}), 400
+    return jsonify({"status": "success", "revision": config_store.revision})
 
 
+# trigram 分词至少需要 3 个字符，更短的搜索词退回 LIKE
+SKU_FTS_MIN_TERM = 3
+
+def encode_sku_cursor(row):
+    """把 (created_at, id) 编码为不透明的分页游标"""
+    raw = json.dumps([row['created_at'], row['id']], ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+def decode_sku_cursor(cursor_value):
+    try:
+        created_at, sku_id = json.loads(base64.urlsafe_b64decode(cursor_value.encode('ascii')))
+    except (ValueError, TypeError, binascii.Error):
+        return None
+    return created_at, sku_id
+
+def sku_search_filter(search):
+    """返回搜索条件的 SQL 片段和参数"""
+    if SKU_FTS_ENABLED and len(search) >= SKU_FTS_MIN_TERM:
+        phrase = '"' + search.replace('"', '""') + '"'
+        return 'id IN (SELECT id FROM skus_fts WHERE skus_fts MATCH ?)', [phrase]
+    return '(name LIKE ? OR sku_code LIKE ?)', [f'%{search}%', f'%{search}%']
+
 @app.route('/api/skus', methods=['GET'])
 def get_skus():
-    """获取所有SKU列表，支持分页和搜索"""
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 100, type=int)
-    search = request.args.get('search', '', type=str)
+    """获取SKU列表，支持全文搜索和游标分页
+
+    参数: per_page 每页数量；search 按名称/编码搜索；cursor 上一页返回的 next_cursor
+    返回: {"items": [...], "total": 总数, "next_cursor": 下一页游标，没有更多时为 null}
+    """
+    per_page = max(1, min(request.args.get('per_page', 100, type=int), 1000))
+    search = request.args.get('search', '', type=str).strip()
+    cursor_value = request.args.get('cursor', '', type=str)
+    
+    filters, params = [], []
+    if search:
+        clause, clause_params = sku_search_filter(search)
+        filters.append(clause)
+        params.extend(clause_params)
+    where = f"WHERE {' AND '.join(filters)}" if filters else ''
     
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    if search:
-        cursor.execute('''
-            SELECT * FROM skus 
-            WHERE name LIKE ? OR sku_code LIKE ?
-            ORDER BY created_at DESC
-            LIMIT ? OFFSET ?
-        ''', (f'%{search}%', f'%{search}%', per_page, (page - 1) * per_page))
-    else:
-        cursor.execute('''
-            SELECT * FROM skus 
-            ORDER BY created_at DESC
-            LIMIT ? OFFSET ?
-        ''', (per_page, (page - 1) * per_page))
-    
-    rows = cursor.fetchall()
-    skus = [sku_row_to_dict(row) for row in rows]
-    
-    if search:
-        cursor.execute('SELECT COUNT(*) as count FROM skus WHERE name LIKE ? OR sku_code LIKE ?',
-                       (f'%{search}%', f'%{search}%'))
-    else:
-        cursor.execute('SELECT COUNT(*) as count FROM skus')
+    cursor.execute(f'SELECT COUNT(*) as count FROM skus {where}', params)
     total = cursor.fetchone()['count']
     
+    if cursor_value:
+        position = decode_sku_cursor(cursor_value)
+        if position is None:
+            conn.close()
+            return jsonify({"error": "无效的分页游标"}), 400
+        filters.append('(created_at, id) < (?, ?)')
+        params.extend(position)
+        where = f"WHERE {' AND '.join(filters)}"
+    
+    cursor.execute(f'''
+        SELECT * FROM skus
+        {where}
+        ORDER BY created_at DESC, id DESC
+        LIMIT ?
+    ''', params + [per_page + 1])
+    rows = cursor.fetchall()
     conn.close()
     
-    return jsonify(skus)
+    next_cursor = encode_sku_cursor(rows[per_page - 1]) if len(rows) > per_page else None
+    
+    return jsonify({
+        "items": with_image_status([sku_row_to_dict(row) for row in rows[:per_page]]),
+        "total": total,
+        "next_cursor": next_cursor
+    })
 
 @app.route('/api/skus/count', methods=['GET'])
 def get_sku_count():
@@ -348,7 +1056,7 @@ def create_sku():
         conn.commit()
         
         cursor.execute('SELECT * FROM skus WHERE id = ?', (sku_id,))
-        new_sku = sku_row_to_dict(cursor.fetchone())
+        new_sku = with_image_status([sku_row_to_dict(cursor.fetchone())])[0]
         conn.close()
         
         return jsonify({"status": "success", "sku": new_sku})
@@ -370,7 +1078,7 @@ def get_sku(sku_id):
     conn.close()
     
     if row:
-        return jsonify(sku_row_to_dict(row))
+        return jsonify(with_image_status([sku_row_to_dict(row)])[0])
     return jsonify({"error": "SKU not found"}), 404
 
 @app.route('/api/skus/<sku_id>', methods=['PUT'])
@@ -431,10 +1139,13 @@ def update_sku(sku_id):
             now,
             sku_id
         ))
+        # 被替换下来的内容寻址图片如果已无引用，一并释放
+        released = image_store.release(cursor, [existing[column] for column in SKU_IMAGE_COLUMNS])
         conn.commit()
+        image_store.remove_files(released)
         
         cursor.execute('SELECT * FROM skus WHERE id = ?', (sku_id,))
-        updated_sku = sku_row_to_dict(cursor.fetchone())
+        updated_sku = with_image_status([sku_row_to_dict(cursor.fetchone())])[0]
         conn.close()
         
         return jsonify({"status": "success", "sku": updated_sku})
@@ -452,31 +1163,26 @@ def delete_sku(sku_id):
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    cursor.execute('SELECT image, thumbnail FROM skus WHERE id = ?', (sku_id,))
+    cursor.execute('SELECT * FROM skus WHERE id = ?', (sku_id,))
     row = cursor.fetchone()
     
     if not row:
         conn.close()
         return jsonify({"error": "SKU not found"}), 404
     
-    if row['image']:
-        image_path = os.path.join(SKU_IMAGE_DIR, row['image'])
-        if os.path.exists(image_path):
-            os.remove(image_path)
-    if row['thumbnail']:
-        thumb_path = os.path.join(SKU_THUMB_DIR, row['thumbnail'])
-        if os.path.exists(thumb_path):
-            os.remove(thumb_path)
-    
     cursor.execute('DELETE FROM skus WHERE id = ?', (sku_id,))
+    released = image_store.release(cursor, [row[column] for column in SKU_IMAGE_COLUMNS])
     conn.commit()
     conn.close()
     
+    remove_legacy_sku_files(row)
+    image_store.remove_files(released)
+    
     return jsonify({"status": "success"})
 
 @app.route('/api/skus/upload-image', methods=['POST'])
 def upload_sku_image():
-    """上传SKU图片并创建缩略图"""
+    """上传SKU图片（按内容去重），缩略图等派生图在后台生成（可通过 job_id 或 SKU 的 image_status 查询进度）"""
     if 'file' not in request.files:
         return jsonify({"error": "No file part"}), 400
     
@@ -486,30 +1192,33 @@ def upload_sku_image():
     
     if file and allowed_file(file.filename):
         ext = file.filename.rsplit('.', 1)[1].lower()
-        unique_id = str(uuid.uuid4())[:8]
-        filename = f"sku_{unique_id}.{ext}"
-        thumb_filename = f"sku_{unique_id}_thumb.jpg"
+        filename, digest, needs_derivatives = image_store.store(file.read(), ext)
+        thumb_filename = thumbnail_name(digest)
         
-        image_path = os.path.join(SKU_IMAGE_DIR, filename)
-        file.save(image_path)
-        
-        thumb_path = os.path.join(SKU_THUMB_DIR, thumb_filename)
-        create_thumbnail(image_path, thumb_path)
+        job = None
+        if needs_derivatives:
+            try:
+                job = submit_derivatives(filename, digest)
+            except QueueFull as e:
+                return queue_full_response(e)
         
         return jsonify({
             "status": "success",
             "image": filename,
             "thumbnail": thumb_filename,
             "image_url": f"/static/uploads/sku_images/{filename}",
-            "thumbnail_url": f"/static/uploads/sku_thumbnails/{thumb_filename}"
+            "thumbnail_url": f"/static/uploads/sku_thumbnails/{thumb_filename}",
+            "job_id": job['id'] if job else None,
+            "job_status": job['status'] if job else 'done'
         })
     
     return jsonify({"error": "Invalid file type"}), 400
 
 @app.route('/api/skus/upload-textures', methods=['POST'])
 def upload_sku_textures():
-    """上传SKU多面贴图（上下前后左右6个面）"""
+    """上传SKU多面贴图（上下前后左右6个面，按内容去重），派生图和合成缩略图在后台生成"""
     textures = {}
+    new_images = {}
     face_names = ['top', 'bottom', 'front', 'back', 'left', 'right']
     
     for face in face_names:
@@ -518,151 +1227,330 @@ def upload_sku_textures():
             file = request.files[file_key]
             if file and file.filename and allowed_file(file.filename):
                 ext = file.filename.rsplit('.', 1)[1].lower()
-                unique_id = str(uuid.uuid4())[:8]
-                filename = f"sku_tex_{face}_{unique_id}.{ext}"
-                
-                file_path = os.path.join(SKU_IMAGE_DIR, filename)
-                file.save(file_path)
+                filename, digest, needs_derivatives = image_store.store(file.read(), ext)
                 textures[f'texture_{face}'] = filename
+                if needs_derivatives:
+                    new_images[filename] = digest
     
     if not textures:
         return jsonify({"error": "No valid texture files uploaded"}), 400
     
-    composite_thumb = None
+    # 合成图同样按内容命名：相同的贴图组合只合成一次
+    composite_key = ';'.join(f'{key}={textures[key]}' for key in sorted(textures))
+    composite_thumb = f"sku_composite_{content_hash(composite_key.encode('utf-8'))}.jpg"
+    composite_path = os.path.join(SKU_THUMB_DIR, composite_thumb)
+    
+    jobs = []
     try:
-        composite_thumb = create_composite_thumbnail(textures)
-    except Exception as e:
-        print(f"合成缩略图失败: {e}")
+        for filename, digest in new_images.items():
+            jobs.append(submit_derivatives(filename, digest))
+        if not os.path.exists(composite_path):
+            texture_paths = {key: os.path.join(SKU_IMAGE_DIR, filename) for key, filename in textures.items()}
+            jobs.append(image_jobs.submit('composite', make_composite, texture_paths, composite_path,
+                                          outputs=[composite_thumb]))
+    except QueueFull as e:
+        return queue_full_response(e)
     
     return jsonify({
         "status": "success",
         "textures": textures,
-        "composite_thumbnail": composite_thumb
+        "composite_thumbnail": composite_thumb,
+        "job_id": jobs[-1]['id'] if jobs else None,
+        "job_ids": [job['id'] for job in jobs],
+        "job_status": 'pending' if jobs else 'done'
     })
 
-def create_composite_thumbnail(textures):
-    """将多面贴图合成为一张缩略图（展开图）"""
-    from PIL import Image
-    
-    cell_size = 100
+@app.route('/api/textures/atlas', methods=['GET'])
+def get_texture_atlas():
+    """SKU 面贴图图集的 UV 查找表，SKU 有变化时增量更新图集（图集页在后台绘制，complete 为假时稍后再取）"""
+    conn = get_db_connection()
+    version = get_change_counters(conn.cursor()).get('skus', 0)
+    conn.close()
     
-    layout_width = cell_size * 4
-    layout_height = cell_size * 3
+    etag, lookup = texture_atlas.lookup(version)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
     
-    composite = Image.new('RGB', (layout_width, layout_height), color=(240, 240, 240))
+    response = jsonify(lookup)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/api/admin/uploads/gc', methods=['POST'])
+def collect_upload_garbage():
+    """回收未被任何 SKU 引用的上传文件，返回扫描和回收的文件数、字节数
+
+    请求体: {"dry_run": false, "grace_period": 秒}，只删除修改时间早于宽限期的文件。
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        grace_period = int(data.get('grace_period', GC_GRACE_PERIOD))
+    except (TypeError, ValueError):
+        return jsonify({"error": "grace_period 必须是整数"}), 400
+    if grace_period < 0:
+        return jsonify({"error": "grace_period 不能为负数"}), 400
     
-    positions = {
-        'texture_top': (cell_size, 0),
-        'texture_left': (0, cell_size),
-        'texture_front': (cell_size, cell_size),
-        'texture_right': (cell_size * 2, cell_size),
-        'texture_back': (cell_size * 3, cell_size),
-        'texture_bottom': (cell_size, cell_size * 2)
-    }
+    conn = get_db_connection()
+    try:
+        report = collect_garbage(conn, [SKU_IMAGE_DIR, SKU_THUMB_DIR],
+                                 grace_period=grace_period, dry_run=bool(data.get('dry_run')))
+    finally:
+        conn.close()
     
-    for texture_key, pos in positions.items():
-        if texture_key in textures:
-            img_path = os.path.join(SKU_IMAGE_DIR, textures[texture_key])
-            if os.path.exists(img_path):
-                try:
-                    img = Image.open(img_path)
-                    img = img.convert('RGB')
-                    img.thumbnail((cell_size, cell_size))
-                    
-                    offset_x = (cell_size - img.width) // 2
-                    offset_y = (cell_size - img.height) // 2
-                    composite.paste(img, (pos[0] + offset_x, pos[1] + offset_y))
-                except Exception as e:
-                    print(f"处理贴图失败 {texture_key}: {e}")
-    
-    unique_id = str(uuid.uuid4())[:8]
-    composite_filename = f"sku_composite_{unique_id}.jpg"
-    composite_path = os.path.join(SKU_THUMB_DIR, composite_filename)
-    composite.save(composite_path, 'JPEG', quality=85)
-    
-    return composite_filename
+    return jsonify({"status": "success", **report})
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_image_job(job_id):
+    """查询图片处理任务状态：pending / done / failed（派生图任务可在任一进程中查询）"""
+    job = image_jobs.get(job_id) or image_store.derivative_job(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+def remove_sku_files_later(rows, released):
+    """在后台线程中删除已删除 SKU 的文件，不占用请求时间（中途退出遗留的文件由 upload_gc 回收）"""
+    def remove():
+        for row in rows:
+            remove_legacy_sku_files(row)
+        image_store.remove_files(released)
+    
+    threading.Thread(target=remove, name='sku-file-removal', daemon=True).start()
 
 @app.route('/api/skus/batch-delete', methods=['POST'])
 def batch_delete_skus():
-    """批量删除SKU"""
-    data = request.json
+    """批量删除SKU：ID 写入临时表后在一个事务中按集合删除，关联的货物由外键级联删除"""
+    data = request.json or {}
     sku_ids = data.get('ids', [])
     
     if not sku_ids:
         return jsonify({"error": "No SKU IDs provided"}), 400
+    if not isinstance(sku_ids, list):
+        return jsonify({"error": "ids 必须是数组"}), 400
     
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    deleted_count = 0
-    for sku_id in sku_ids:
-        cursor.execute('SELECT image, thumbnail FROM skus WHERE id = ?', (sku_id,))
-        row = cursor.fetchone()
+    try:
+        cursor.execute('CREATE TEMP TABLE IF NOT EXISTS batch_sku_ids (id TEXT PRIMARY KEY)')
+        cursor.execute('DELETE FROM temp.batch_sku_ids')
+        cursor.executemany('INSERT OR IGNORE INTO temp.batch_sku_ids (id) VALUES (?)',
+                           [(str(sku_id),) for sku_id in sku_ids])
         
-        if row:
-            if row['image']:
-                image_path = os.path.join(SKU_IMAGE_DIR, row['image'])
-                if os.path.exists(image_path):
-                    os.remove(image_path)
-            if row['thumbnail']:
-                thumb_path = os.path.join(SKU_THUMB_DIR, row['thumbnail'])
-                if os.path.exists(thumb_path):
-                    os.remove(thumb_path)
-            
-            cursor.execute('DELETE FROM skus WHERE id = ?', (sku_id,))
-            deleted_count += 1
+        cursor.execute(f'''
+            SELECT thumbnail, {', '.join(SKU_IMAGE_COLUMNS)} FROM skus
+            WHERE id IN (SELECT id FROM temp.batch_sku_ids)
+        ''')
+        deleted_rows = cursor.fetchall()
+        cursor.execute('SELECT COUNT(*) AS count FROM cargos WHERE sku_id IN (SELECT id FROM temp.batch_sku_ids)')
+        cargo_count = cursor.fetchone()['count']
+        
+        cursor.execute('DELETE FROM skus WHERE id IN (SELECT id FROM temp.batch_sku_ids)')
+        released = image_store.release(cursor, [row[column] for row in deleted_rows for column in SKU_IMAGE_COLUMNS])
+        cursor.execute('DELETE FROM temp.batch_sku_ids')
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        conn.close()
+        return jsonify({"error": str(e)}), 500
     
-    conn.commit()
     conn.close()
+    remove_sku_files_later(deleted_rows, released)
     
-    return jsonify({"status": "success", "deleted_count": deleted_count})
+    return jsonify({"status": "success", "deleted_count": len(deleted_rows), "deleted_cargo_count": cargo_count})
 
+@app.route('/api/skus/import', methods=['POST'])
+def bulk_import_skus():
+    """批量导入SKU（CSV / NDJSON / Parquet），按 sku_code 新增或更新
+
+    请求体为文件内容，或 multipart 表单中的 file 字段；
+    参数: format 文件格式，默认按文件扩展名或 Content-Type 判断；dry_run=1 只校验不写入
+    """
+    upload = request.files.get('file')
+    if upload is not None:
+        stream, filename, content_type = upload.stream, upload.filename, upload.mimetype
+    else:
+        stream, filename, content_type = request.stream, '', request.mimetype
+    dry_run = request.args.get('dry_run', '').lower() in ('1', 'true', 'yes')
+
+    try:
+        fmt = detect_format(request.args.get('format'), filename, content_type)
+    except BulkFormatError as e:
+        return jsonify({"error": str(e)}), 400
+
+    conn = get_db_connection()
+    try:
+        report = import_skus(conn, read_records(stream, fmt), dry_run=dry_run)
+    finally:
+        conn.close()
+
+    if 'error' in report:
+        return jsonify(report), 400
+    return jsonify({"status": "success", **report})
+
+@app.route('/api/skus/export', methods=['GET'])
+def bulk_export_skus():
+    """流式导出全部SKU，format 为 csv（默认）/ ndjson / parquet，导出的文件可直接用于导入"""
+    try:
+        fmt = detect_format(request.args.get('format', 'csv'))
+    except BulkFormatError as e:
+        return jsonify({"error": str(e)}), 400
+
+    def generate():
+        conn = get_db_connection()
+        try:
+            yield from iter_export(conn, fmt)
+        finally:
+            conn.close()
+
+    response = Response(generate(), mimetype=FORMAT_MIMETYPES[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename=skus.{fmt}'
+    return response
+
+
+def cargo_row_to_dict(row):
+    """将货物行（不含SKU信息）转换为字典"""
+    return {
+        "id": row['id'],
+        "sku_id": row['sku_id'],
+        "x": row['x'],
+        "y": row['y'],
+        "z": row['z'],
+        "rotation": row['rotation'],
+        "created_at": row['created_at']
+    }
+
+def iter_rows(cursor, batch_size=CARGO_STREAM_BATCH):
+    """分批读取查询结果，避免一次性 fetchall"""
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield rows
+
+def generate_cargos_json():
+    """逐批生成与旧版相同的 JSON 数组：每个货物内嵌其 SKU 信息"""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT c.id, c.sku_id, c.x, c.y, c.z, c.rotation, c.created_at,
+                   s.name, s.sku_code, s.length, s.width, s.height, s.weight, s.thumbnail,
+                   s.texture_top, s.texture_bottom, s.texture_front, s.texture_back, s.texture_left, s.texture_right
+            FROM cargos c
+            LEFT JOIN skus s ON c.sku_id = s.id
+            ORDER BY c.created_at DESC
+        ''')
+        
+        separator = '['
+        for rows in iter_rows(cursor):
+            chunk = []
+            for row in rows:
+                cargo = cargo_row_to_dict(row)
+                cargo["sku"] = {
+                    "name": row['name'],
+                    "sku_code": row['sku_code'],
+                    "length": row['length'],
+                    "width": row['width'],
+                    "height": row['height'],
+                    "weight": row['weight'],
+                    "thumbnail": row['thumbnail'] or '',
+                    "texture_top": row['texture_top'] or '',
+                    "texture_bottom": row['texture_bottom'] or '',
+                    "texture_front": row['texture_front'] or '',
+                    "texture_back": row['texture_back'] or '',
+                    "texture_left": row['texture_left'] or '',
+                    "texture_right": row['texture_right'] or ''
+                }
+                chunk.append(separator + json.dumps(cargo, ensure_ascii=False))
+                separator = ','
+            yield ''.join(chunk)
+        yield '[]' if separator == '[' else ']'
+    finally:
+        conn.close()
+
+def generate_cargos_ndjson():
+    """逐批生成规范化的 NDJSON：先输出被引用的 SKU，每个只输出一次，再输出只带 sku_id 的货物"""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM skus WHERE id IN (SELECT DISTINCT sku_id FROM cargos)')
+        for rows in iter_rows(cursor):
+            yield ''.join(json.dumps({"type": "sku", **sku_row_to_dict(row)}, ensure_ascii=False) + '\n'
+                          for row in rows)
+        
+        cursor.execute('''
+            SELECT id, sku_id, x, y, z, rotation, created_at FROM cargos
+            ORDER BY created_at DESC
+        ''')
+        for rows in iter_rows(cursor):
+            yield ''.join(json.dumps({"type": "cargo", **cargo_row_to_dict(row)}, ensure_ascii=False) + '\n'
+                          for row in rows)
+    finally:
+        conn.close()
 
 @app.route('/api/cargos', methods=['GET'])
 def get_cargos():
-    """获取所有货物列表（包含SKU信息）"""
+    """获取所有货物列表（流式输出）
+
+    默认返回内嵌SKU信息的 JSON 数组；format=ndjson 时返回规范化的 NDJSON，
+    每行一条记录，SKU 记录（type=sku）只出现一次，货物记录（type=cargo）通过 sku_id 引用。
+    """
+    if request.args.get('format') == 'ndjson':
+        return Response(generate_cargos_ndjson(), mimetype='application/x-ndjson')
+    return Response(generate_cargos_json(), mimetype='application/json')
+
+# 最近一次生成的货物快照：{"etag": ..., 编码方式: 压缩后的字节}
+cargo_snapshot_cache = {}
+cargo_snapshot_lock = threading.Lock()
+
+def choose_snapshot_encoding():
+    """根据 Accept-Encoding 选择压缩方式，优先 zstd"""
+    accepted = {value.split(';')[0].strip() for value in request.headers.get('Accept-Encoding', '').split(',')}
+    if zstandard is not None and 'zstd' in accepted:
+        return 'zstd'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return 'identity'
+
+@app.route('/api/cargos/snapshot', methods=['GET'])
+def get_cargo_snapshot():
+    """获取所有货物的二进制列式快照（格式见 cargo_snapshot.py），支持 ETag 和 gzip/zstd 压缩"""
     conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT c.id, c.sku_id, c.x, c.y, c.z, c.rotation, c.created_at,
-               s.name, s.sku_code, s.length, s.width, s.height, s.weight, s.thumbnail,
-               s.texture_top, s.texture_bottom, s.texture_front, s.texture_back, s.texture_left, s.texture_right
-        FROM cargos c
-        LEFT JOIN skus s ON c.sku_id = s.id
-        ORDER BY c.created_at DESC
-    ''')
-    
-    rows = cursor.fetchall()
-    cargos = []
-    for row in rows:
-        cargos.append({
-            "id": row['id'],
-            "sku_id": row['sku_id'],
-            "x": row['x'],
-            "y": row['y'],
-            "z": row['z'],
-            "rotation": row['rotation'],
-            "created_at": row['created_at'],
-            "sku": {
-                "name": row['name'],
-                "sku_code": row['sku_code'],
-                "length": row['length'],
-                "width": row['width'],
-                "height": row['height'],
-                "weight": row['weight'],
-                "thumbnail": row['thumbnail'] or '',
-                "texture_top": row['texture_top'] or '',
-                "texture_bottom": row['texture_bottom'] or '',
-                "texture_front": row['texture_front'] or '',
-                "texture_back": row['texture_back'] or '',
-                "texture_left": row['texture_left'] or '',
-                "texture_right": row['texture_right'] or ''
-            }
-        })
+    try:
+        counters = get_change_counters(conn.cursor())
+        etag = f"cargos-{counters.get('cargos', 0)}-skus-{counters.get('skus', 0)}"
+        
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+        
+        encoding = choose_snapshot_encoding()
+        with cargo_snapshot_lock:
+            if cargo_snapshot_cache.get('etag') != etag:
+                cargo_snapshot_cache.clear()
+                cargo_snapshot_cache['etag'] = etag
+                cargo_snapshot_cache['identity'] = build_cargo_snapshot(conn, sku_row_to_dict)
+            
+            if encoding not in cargo_snapshot_cache:
+                raw = cargo_snapshot_cache['identity']
+                if encoding == 'zstd':
+                    cargo_snapshot_cache[encoding] = zstandard.ZstdCompressor(level=3).compress(raw)
+                else:
+                    cargo_snapshot_cache[encoding] = gzip.compress(raw, compresslevel=6)
+            body = cargo_snapshot_cache[encoding]
+    finally:
+        conn.close()
     
-    conn.close()
-    return jsonify(cargos)
+    response = Response(body, mimetype='application/octet-stream')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['Vary'] = 'Accept-Encoding'
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    return response
 
 @app.route('/api/cargos', methods=['POST'])
 def create_cargo():
@@ -693,10 +1581,326 @@ def create_cargo():
         
         return jsonify({"status": "success", "id": cargo_id})
     
+    except sqlite3.IntegrityError as e:
+        conn.close()
+        return jsonify({"error": f"SKU不存在: {data.get('sku_id')}"}), 400
     except Exception as e:
         conn.close()
         return jsonify({"error": str(e)}), 500
 
+def settle_cargos(cursor):
+    """按当前货架布局计算所有货物的落定高度并写回，返回 [{id, y}]（只包含发生移动的货物）"""
+    with config_store.read() as config:
+        shelves = list(config.get('shelves', []))
+        layer_count = int(config.get('global_params', {}).get('layer_count')
+                          or default_config['global_params']['layer_count'])
+    
+    cursor.execute('''
+        SELECT c.id, c.x, c.y, c.z, s.width, s.length, s.height
+        FROM cargos c LEFT JOIN skus s ON c.sku_id = s.id
+    ''')
+    moved = settle_cargo_rows(cursor.fetchall(), shelves, layer_count)
+    cursor.executemany('UPDATE cargos SET y = ? WHERE id = ?', [(y, cargo_id) for cargo_id, y in moved])
+    return [{"id": cargo_id, "y": y} for cargo_id, y in moved]
+
+@app.route('/api/cargos/settle', methods=['POST'])
+def settle_all_cargos():
+    """在服务端对所有货物做重力落定（级联下落），dry_run 为真时只返回结果不写回"""
+    data = request.get_json(silent=True) or {}
+    
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        moved = settle_cargos(cursor)
+        if data.get('dry_run'):
+            conn.rollback()
+        else:
+            conn.commit()
+    except Exception as e:
+        conn.rollback()
+        conn.close()
+        return jsonify({"error": str(e)}), 500
+    
+    conn.close()
+    return jsonify({"status": "success", "moved": moved})
+
+# 货位分配时每批查询的 SKU 数，避免超出 SQLite 的参数个数上限
+SLOT_LOOKUP_BATCH = 500
+
+@app.route('/api/cargos/slot', methods=['POST'])
+def slot_cargos():
+    """自动货位分配：把一批 SKU 按数量摆放到货架的空闲格口中（算法见 slotting.py）
+
+    请求体: {"items": [{sku_id, quantity}...], "shelf_ids": [...]?, "layer_load_limit": 千克?, "dry_run": false}
+    shelf_ids 限定可用的货架；layer_load_limit 为每层承重，默认取 global_params.layer_load_limit。
+    返回 placements（可直接作为 /api/cargos/batch 的 create）及每个 SKU 的请求/已放置数量；
+    dry_run 为假时在同一事务中创建货物并返回其ID。
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        items = parse_items(data.get('items'))
+        shelf_ids = data.get('shelf_ids')
+        if shelf_ids is not None and not (isinstance(shelf_ids, list) and all(isinstance(i, str) for i in shelf_ids)):
+            raise SlottingError("shelf_ids 必须是货架ID数组")
+    except SlottingError as e:
+        return jsonify({"error": str(e)}), 400
+
+    allowed = set(shelf_ids) if shelf_ids is not None else None
+    with config_store.read() as config:
+        shelves = [shelf for shelf in config.get('shelves', [])
+                   if allowed is None or shelf.get('id') in allowed]
+        global_params = {**default_config['global_params'], **config.get('global_params', {})}
+    try:
+        layer_count = int(global_params['layer_count'])
+        cell_count = int(global_params['cell_count'])
+        layer_load = float(data.get('layer_load_limit') or global_params.get('layer_load_limit') or DEFAULT_LAYER_LOAD)
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": f"参数无效: {e}"}), 400
+
+    dry_run = bool(data.get('dry_run'))
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        if not dry_run:
+            # 从读取已有货物到写入新货物期间不允许其他写入，避免两次分配用到同一个格口
+            cursor.execute('BEGIN IMMEDIATE')
+
+        sku_ids = sorted({sku_id for sku_id, _ in items})
+        skus = {}
+        for start in range(0, len(sku_ids), SLOT_LOOKUP_BATCH):
+            chunk = sku_ids[start:start + SLOT_LOOKUP_BATCH]
+            cursor.execute(f"SELECT id, length, width, height, weight FROM skus WHERE id IN ({', '.join('?' * len(chunk))})",
+                           chunk)
+            skus.update((row['id'], dict(row)) for row in cursor.fetchall())
+        missing = [sku_id for sku_id in sku_ids if sku_id not in skus]
+        if missing:
+            conn.rollback()
+            return jsonify({"error": "SKU不存在", "missing": missing}), 400
+
+        cursor.execute('SELECT c.x, c.y, c.z, s.weight FROM cargos c LEFT JOIN skus s ON s.id = c.sku_id')
+        existing = np.nan_to_num(np.array([tuple(row) for row in cursor.fetchall()], dtype=float).reshape(-1, 4))
+        placements, summary = plan_slotting(items, skus, shelves, layer_count, cell_count,
+                                            cargos=tuple(existing.T), layer_load=layer_load)
+
+        count = len(placements['sku_id'])
+        x, y, z, rotation = (placements[key].tolist() for key in ('x', 'y', 'z', 'rotation'))
+        ids = []
+        if not dry_run and count:
+            now = datetime.now().isoformat()
+            ids = [new_cargo_id() for _ in range(count)]
+            cursor.executemany('INSERT INTO cargos (id, sku_id, x, y, z, rotation, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                               zip(ids, placements['sku_id'], x, y, z, rotation, repeat(now)))
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        return jsonify({"error": str(e)}), 500
+    finally:
+        conn.close()
+
+    shelf_index, layer, cell = (placements[key].astype(int).tolist() for key in ('shelf', 'layer', 'cell'))
+    return jsonify({
+        "status": "success",
+        "dry_run": dry_run,
+        "placed": count,
+        "unplaced": sum(entry['requested'] - entry['placed'] for entry in summary),
+        "summary": summary,
+        "placements": [{
+            "sku_id": placements['sku_id'][i], "x": x[i], "y": y[i], "z": z[i], "rotation": rotation[i],
+            "shelf_id": shelves[shelf_index[i]].get('id'), "layer": layer[i], "cell": cell[i],
+        } for i in range(count)],
+        "ids": ids,
+    })
+
+# 拣货路径：库道图按库道内容缓存，单张拣货单的拣货点数上限
+route_cache = RouteCache()
+MAX_ORDER_PICKS = 2000
+
+def current_aisle_graph():
+    with config_store.read() as config:
+        revision = config.get('revision', 0)
+        aisles = config.get('aisles') or []
+        graph = route_cache.get(revision, aisles)
+        shelves = list(config.get('shelves', []))
+    return graph, shelves, aisles
+
+@app.route('/api/routing/graph', methods=['GET'])
+def get_aisle_graph():
+    """库道图概况：节点数、边数、是否已预先计算全部节点间的距离"""
+    graph, _, _ = current_aisle_graph()
+    return jsonify({
+        "nodes": graph.node_count,
+        "edges": graph.edge_count,
+        "all_pairs": graph.all_pairs is not None,
+    })
+
+@app.route('/api/routing/pick-routes', methods=['POST'])
+def plan_pick_routes():
+    """为一批拣货单规划拣货顺序并计算行走距离（算法见 routing.py）
+
+    请求体: {"orders": [{"id": ..., "picks": [货物ID 或 {"x", "z"}...]}...],
+             "depot": {"x", "z"}?, "return_to_depot": true}
+    depot 缺省为第一条库道的起点。返回每张拣货单的访问顺序 sequence（picks 中的下标）、
+    总距离 distance、最近邻初始方案的距离 initial_distance，以及经由库道无法到达的拣货点 unreachable。
+    """
+    data = request.get_json(silent=True) or {}
+    orders = data.get('orders')
+    if not isinstance(orders, list) or not all(isinstance(order, dict) and isinstance(order.get('picks'), list)
+                                               for order in orders):
+        return jsonify({"error": "orders 必须是 [{id, picks: [...]}] 数组"}), 400
+    if any(len(order['picks']) > MAX_ORDER_PICKS for order in orders):
+        return jsonify({"error": f"单张拣货单最多 {MAX_ORDER_PICKS} 个拣货点"}), 400
+
+    graph, shelves, aisles = current_aisle_graph()
+    depot = data.get('depot')
+    try:
+        if depot is None:
+            first = next((aisle_points(aisle) for aisle in aisles if isinstance(aisle, dict) and aisle_points(aisle)), None)
+            if first is None:
+                raise RoutingError("没有可用的库道")
+            depot = first[0]
+        else:
+            depot = (float(depot['x']), float(depot['z']))
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({"error": f"depot 无效: {e}"}), 400
+    except RoutingError as e:
+        return jsonify({"error": str(e)}), 409
+
+    cargo_ids = sorted({pick for order in orders for pick in order['picks'] if isinstance(pick, str)})
+    positions = {}
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        for start in range(0, len(cargo_ids), SLOT_LOOKUP_BATCH):
+            chunk = cargo_ids[start:start + SLOT_LOOKUP_BATCH]
+            cursor.execute(f"SELECT id, x, z FROM cargos WHERE id IN ({', '.join('?' * len(chunk))})", chunk)
+            positions.update((row['id'], (row['x'] or 0, row['z'] or 0)) for row in cursor.fetchall())
+    finally:
+        conn.close()
+
+    results = []
+    try:
+        for order in orders:
+            points, index, invalid = [], [], []
+            for i, pick in enumerate(order['picks']):
+                if isinstance(pick, str) and pick in positions:
+                    points.append(positions[pick])
+                elif isinstance(pick, dict) and 'x' in pick and 'z' in pick:
+                    points.append((float(pick['x']), float(pick['z'])))
+                else:
+                    invalid.append(i)
+                    continue
+                index.append(i)
+
+            matrix = graph.point_distances(np.vstack([[depot], access_points(points, shelves)]))
+            reachable = np.isfinite(matrix[0])
+            unreachable = [index[i - 1] for i in np.nonzero(~reachable)[0]]
+            keep = np.nonzero(reachable)[0]
+            order_result = {"id": order.get('id'), "sequence": [], "distance": 0.0, "initial_distance": 0.0,
+                            "unreachable": unreachable, "invalid": invalid}
+            if len(keep) > 1:
+                tour, distance, initial = plan_route(matrix[np.ix_(keep, keep)], data.get('return_to_depot', True))
+                order_result.update(sequence=[index[keep[i] - 1] for i in tour],
+                                    distance=round(distance, 3), initial_distance=round(initial, 3))
+            results.append(order_result)
+    except RoutingError as e:
+        return jsonify({"error": str(e)}), 409
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": f"拣货点无效: {e}"}), 400
+
+    return jsonify({"depot": {"x": depot[0], "z": depot[1]}, "orders": results})
+
+def new_cargo_id():
+    """生成货物ID：16 位十六进制随机数（与 SKU 批量导入相同），批量创建时也不必担心碰撞"""
+    return os.urandom(8).hex()
+
+@app.route('/api/cargos/batch', methods=['POST'])
+def batch_cargos():
+    """批量创建/移动/删除货物，在同一个事务中提交
+
+    请求体: {"create": [{sku_id, x, y, z, rotation}...],
+             "update": [{id, x?, y?, z?, rotation?}...],
+             "delete": [货物ID...],
+             "settle": false}
+    update 中未提供的坐标字段保持不变。返回按 create 顺序分配的货物ID。
+    settle 为真时在同一事务中由服务端重新计算所有货物的落定高度，结果在 settled 中返回。
+    """
+    data = request.json or {}
+    creates = data.get('create', [])
+    updates = data.get('update', [])
+    deletes = data.get('delete', [])
+    
+    if not all(isinstance(items, list) for items in (creates, updates, deletes)):
+        return jsonify({"error": "create、update 和 delete 必须是数组"}), 400
+    
+    def optional_float(item, key):
+        value = item.get(key)
+        return None if value is None else float(value)
+    
+    now = datetime.now().isoformat()
+    try:
+        new_rows = [(
+            new_cargo_id(),
+            item['sku_id'],
+            float(item.get('x', 0)),
+            float(item.get('y', 0)),
+            float(item.get('z', 0)),
+            float(item.get('rotation', 0)),
+            now
+        ) for item in creates]
+        update_rows = [(
+            optional_float(item, 'x'),
+            optional_float(item, 'y'),
+            optional_float(item, 'z'),
+            optional_float(item, 'rotation'),
+            item['id']
+        ) for item in updates]
+    except (KeyError, TypeError, ValueError, AttributeError) as e:
+        return jsonify({"error": f"货物数据无效: {e}"}), 400
+    
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.executemany('''
+            INSERT INTO cargos (id, sku_id, x, y, z, rotation, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', new_rows)
+        
+        cursor.executemany('''
+            UPDATE cargos SET
+                x = COALESCE(?, x),
+                y = COALESCE(?, y),
+                z = COALESCE(?, z),
+                rotation = COALESCE(?, rotation)
+            WHERE id = ?
+        ''', update_rows)
+        updated_count = cursor.rowcount if update_rows else 0
+        
+        cursor.executemany('DELETE FROM cargos WHERE id = ?', [(cargo_id,) for cargo_id in deletes])
+        deleted_count = cursor.rowcount if deletes else 0
+        
+        settled = settle_cargos(cursor) if data.get('settle') else []
+        
+        conn.commit()
+    except sqlite3.IntegrityError as e:
+        conn.rollback()
+        conn.close()
+        return jsonify({"error": f"货物引用了不存在的SKU: {e}"}), 400
+    except Exception as e:
+        conn.rollback()
+        conn.close()
+        return jsonify({"error": str(e)}), 500
+    
+    conn.close()
+    
+    return jsonify({
+        "status": "success",
+        "ids": [row[0] for row in new_rows],
+        "updated_count": updated_count,
+        "deleted_count": deleted_count,
+        "settled": settled
+    })
+
 @app.route('/api/cargos/<cargo_id>', methods=['DELETE'])
 def delete_cargo(cargo_id):
     """删除单个货物"""
@@ -745,13 +1949,31 @@ def update_cargo(cargo_id):
     return jsonify({"status": "success"})
 
 
+def send_upload(directory, filename):
+    """发送上传文件：带强 ETag 和长期缓存头，支持条件请求和 Range（由 send_file 处理）"""
+    etag = fingerprint(filename)
+    max_age = FINGERPRINTED_MAX_AGE if etag else UPLOAD_MAX_AGE
+    
+    if UPLOAD_SENDFILE == 'x-accel-redirect':
+        path = safe_join(directory, filename)
+        if path is None or not os.path.isfile(path):
+            abort(404)
+        relative = os.path.relpath(path, os.path.join(app.static_folder, 'uploads')).replace(os.sep, '/')
+        response = Response(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        response.headers['X-Accel-Redirect'] = UPLOAD_ACCEL_PREFIX + relative
+    else:
+        response = send_from_directory(directory, filename, etag=etag or True, max_age=max_age)
+    
+    response.headers['Cache-Control'] = f'public, max-age={max_age}' + (', immutable' if etag else '')
+    return response
+
 @app.route('/static/uploads/sku_images/<filename>')
 def serve_sku_image(filename):
-    return send_from_directory(SKU_IMAGE_DIR, filename)
+    return send_upload(SKU_IMAGE_DIR, filename)
 
 @app.route('/static/uploads/sku_thumbnails/<filename>')
 def serve_sku_thumbnail(filename):
-    return send_from_directory(SKU_THUMB_DIR, filename)
+    return send_upload(SKU_THUMB_DIR, filename)
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5002)
\ No newline at end of file
+    create_app().run(debug=True, host='0.0.0.0', port=5002)
\ No newline at end of file
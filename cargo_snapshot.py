@@ -0,0 +1,85 @@
+"""货物场景快照的紧凑二进制格式
+
+用于启动时批量加载货物，按列存放，全部为小端序：
+
+    4 字节      魔数 b'WCS1'
+    uint32      头部 JSON 的字节数 H
+    H 字节      头部 JSON（UTF-8）：{"version", "count", "skus", "ids_bytes"}
+    0~3 字节    填充到 4 字节对齐
+    float32[N]  x
+    float32[N]  y
+    float32[N]  z
+    float32[N]  rotation
+    uint32[N]   sku_index（指向头部 skus 数组的下标）
+    ids_bytes   货物 ID，以 '\n' 分隔的 UTF-8 文本
+
+SKU 信息在头部只出现一次，货物只保存坐标和 SKU 下标。
+"""
+import json
+import struct
+
+import numpy as np
+
+SNAPSHOT_MAGIC = b'WCS1'
+SNAPSHOT_VERSION = 1
+SNAPSHOT_BATCH = 5000
+
+
+def build_cargo_snapshot(conn, sku_to_dict):
+    """从数据库读取所有货物并打包为二进制快照"""
+    cursor = conn.cursor()
+    cursor.execute('SELECT COUNT(*) AS count FROM cargos')
+    count = cursor.fetchone()['count']
+
+    skus = []
+    sku_index = {}
+    cursor.execute('SELECT * FROM skus WHERE id IN (SELECT DISTINCT sku_id FROM cargos)')
+    for row in cursor.fetchall():
+        sku_index[row['id']] = len(skus)
+        skus.append(sku_to_dict(row))
+
+    positions = np.zeros((4, count), dtype='<f4')
+    indices = np.zeros(count, dtype='<u4')
+    ids = []
+
+    cursor.execute('SELECT id, sku_id, x, y, z, rotation FROM cargos ORDER BY created_at DESC')
+    offset = 0
+    while offset < count:
+        rows = cursor.fetchmany(SNAPSHOT_BATCH)
+        if not rows:
+            break
+        rows = rows[:count - offset]
+        end = offset + len(rows)
+        positions[:, offset:end] = np.array(
+            [(row['x'] or 0, row['y'] or 0, row['z'] or 0, row['rotation'] or 0) for row in rows],
+            dtype='<f4').T
+        for i, row in enumerate(rows, start=offset):
+            sku_id = row['sku_id']
+            if sku_id not in sku_index:
+                # 引用了已删除SKU的货物：只保留 ID，客户端按默认外观显示
+                sku_index[sku_id] = len(skus)
+                skus.append({"id": sku_id})
+            indices[i] = sku_index[sku_id]
+            ids.append(row['id'])
+        offset = end
+
+    ids_bytes = '\n'.join(ids).encode('utf-8')
+    header = json.dumps({
+        "version": SNAPSHOT_VERSION,
+        "count": offset,
+        "skus": skus,
+        "ids_bytes": len(ids_bytes),
+    }, ensure_ascii=False).encode('utf-8')
+
+    prefix_length = len(SNAPSHOT_MAGIC) + 4 + len(header)
+    padding = b'\0' * (-prefix_length % 4)
+
+    return b''.join([
+        SNAPSHOT_MAGIC,
+        struct.pack('<I', len(header)),
+        header,
+        padding,
+        positions[:, :offset].tobytes(),
+        indices[:offset].tobytes(),
+        ids_bytes,
+    ])
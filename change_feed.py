@@ -0,0 +1,244 @@
+"""变更日志与 SSE 推送
+
+所有修改按发生顺序追加到 change_log 表，每条变更有递增的 revision（与配置的 revision 无关）：
+
+- SKU / 货物：由 skus、cargos 表上的触发器记录，批量导入、级联删除、落定计算等都会产生变更；
+- 货架 / 零件 / 库道：布局写回数据库时（layout_db.LayoutDB.sync）记录增量，
+  同时记录一条 config 变更，携带写回时的配置 revision。
+
+客户端通过 SSE 订阅变更并只应用增量；断线重连时按 Last-Event-ID（或 since 参数）
+从断点续传。断点已被清理、或落后太多（例如刚批量导入了大量 SKU）时推送 reset，
+客户端应重新全量加载。
+
+每个进程只有一个后台线程轮询 change_log，新变更缓存在内存中分发给所有连接，
+连接数再多也不会增加数据库查询。但每个 SSE 连接会一直占用一个请求线程，
+因此每个进程的连接数有上限（max_streams），超出时由调用方拒绝，客户端改用轮询。
+"""
+import json
+import sqlite3
+import threading
+import time
+from collections import deque
+
+CHANGE_POLL_INTERVAL = 0.5
+# 内存中缓存的最近变更条数，落后不多的连接直接从内存读取
+CHANGE_BUFFER_SIZE = 2000
+# 一次最多补发的变更条数，超过时推送 reset
+CHANGE_MAX_REPLAY = 10000
+# change_log 保留的变更条数，更早的定期清理
+CHANGE_LOG_RETENTION = 100000
+CHANGE_PRUNE_INTERVAL = 60
+CHANGE_HEARTBEAT = 15
+
+SKU_EVENT_COLUMNS = ('id', 'name', 'sku_code', 'length', 'width', 'height', 'weight', 'image', 'thumbnail',
+                     'texture_top', 'texture_bottom', 'texture_front', 'texture_back', 'texture_left',
+                     'texture_right', 'created_at')
+CARGO_EVENT_COLUMNS = ('id', 'sku_id', 'x', 'y', 'z', 'rotation', 'created_at')
+
+
+def _json_supported(cursor):
+    try:
+        cursor.execute("SELECT json_object('a', 1)")
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+
+def init_change_log(cursor):
+    """创建变更日志表及 skus/cargos 上记录变更的触发器
+
+    SQLite 不支持 JSON 函数时触发器只记录 ID，客户端按 ID 重新获取对象。
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS change_log (
+            revision INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            op TEXT NOT NULL,
+            entity_id TEXT,
+            data TEXT
+        )
+    ''')
+
+    with_data = _json_supported(cursor)
+    for table, kind, columns in (('skus', 'sku', SKU_EVENT_COLUMNS), ('cargos', 'cargo', CARGO_EVENT_COLUMNS)):
+        for event, row in (('INSERT', 'new'), ('UPDATE', 'new'), ('DELETE', 'old')):
+            if with_data and event != 'DELETE':
+                data = f"json_object({', '.join(f''''{column}', {row}.{column}''' for column in columns)})"
+            else:
+                data = 'NULL'
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_change_{event.lower()} AFTER {event} ON {table} BEGIN
+                    INSERT INTO change_log (kind, op, entity_id, data)
+                    VALUES ('{kind}', '{event.lower()}', {row}.id, {data});
+                END
+            ''')
+
+
+def append_changes(cursor, changes):
+    """在调用方的事务中追加变更，changes 为 [(kind, op, entity_id, data)]，data 为 JSON 文本或 None"""
+    cursor.executemany('INSERT INTO change_log (kind, op, entity_id, data) VALUES (?, ?, ?, ?)', changes)
+
+
+def latest_revision(cursor):
+    cursor.execute('SELECT MAX(revision) AS revision FROM change_log')
+    return cursor.fetchone()[0] or 0
+
+
+def _event_json(row):
+    """变更行转换为 JSON 文本，data 列已是 JSON，直接拼接"""
+    head = json.dumps({"revision": row[0], "kind": row[1], "op": row[2], "id": row[3]}, ensure_ascii=False)
+    return f'{head[:-1]}, "data": {row[4] or "null"}}}'
+
+
+def _sse(event, data, event_id=None):
+    prefix = f'id: {event_id}\n' if event_id is not None else ''
+    return f'{prefix}event: {event}\ndata: {data}\n\n'
+
+
+class ChangeFeed:
+    """进程内的变更分发器"""
+
+    def __init__(self, connect, poll_interval=CHANGE_POLL_INTERVAL, buffer_size=CHANGE_BUFFER_SIZE,
+                 max_replay=CHANGE_MAX_REPLAY, retention=CHANGE_LOG_RETENTION, max_streams=None):
+        self.connect = connect
+        self.poll_interval = poll_interval
+        self.buffer_size = buffer_size
+        self.max_replay = max_replay
+        self.retention = retention
+        self.max_streams = max_streams
+        self._streams = 0
+        self._cond = threading.Condition()
+        # 最近的变更 (revision, JSON 文本)，revision 连续递增
+        self._recent = deque(maxlen=buffer_size)
+        self._latest = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def latest(self):
+        self._ensure_started()
+        return self._latest
+
+    def _ensure_started(self):
+        with self._cond:
+            if self._thread is not None:
+                return
+            conn = self.connect()
+            try:
+                self._latest = latest_revision(conn.cursor())
+            finally:
+                conn.close()
+            self._thread = threading.Thread(target=self._run, name='change-feed', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        last_prune = time.monotonic()
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self._poll()
+                if time.monotonic() - last_prune >= CHANGE_PRUNE_INTERVAL:
+                    self._prune()
+                    last_prune = time.monotonic()
+            except sqlite3.Error as e:
+                print(f"读取变更日志失败: {e}")
+
+    def _poll(self):
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            latest = latest_revision(cursor)
+            if latest <= self._latest:
+                return
+            # 一次积压太多时只读取最近的部分，更早的由连接按需从数据库补发
+            start = max(self._latest, latest - self.buffer_size)
+            cursor.execute('''
+                SELECT revision, kind, op, entity_id, data FROM change_log
+                WHERE revision > ? AND revision <= ? ORDER BY revision
+            ''', (start, latest))
+            events = [(row[0], _event_json(row)) for row in cursor.fetchall()]
+        finally:
+            conn.close()
+
+        with self._cond:
+            if start > self._latest:
+                self._recent.clear()
+            self._recent.extend(events)
+            self._latest = latest
+            self._cond.notify_all()
+
+    def _prune(self):
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM change_log WHERE revision <= ?', (latest_revision(cursor) - self.retention,))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def changes_since(self, since):
+        """revision 大于 since 的变更 [(revision, JSON 文本)]；无法补发（已清理或太多）时返回 None"""
+        self._ensure_started()
+        with self._cond:
+            latest = self._latest
+            if since == latest:
+                return []
+            if since > latest:
+                return None
+            if self._recent and since >= self._recent[0][0] - 1:
+                return [event for event in self._recent if event[0] > since]
+
+        if latest - since > self.max_replay:
+            return None
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT revision, kind, op, entity_id, data FROM change_log
+                WHERE revision > ? AND revision <= ? ORDER BY revision
+            ''', (since, latest))
+            rows = cursor.fetchall()
+        finally:
+            conn.close()
+        if not rows or rows[0][0] != since + 1:
+            return None
+        return [(row[0], _event_json(row)) for row in rows]
+
+    def acquire_stream(self):
+        """占用一个 SSE 连接名额，已达 max_streams 时返回 False；连接结束后调用 release_stream"""
+        with self._cond:
+            if self.max_streams is not None and self._streams >= self.max_streams:
+                return False
+            self._streams += 1
+            return True
+
+    def release_stream(self):
+        with self._cond:
+            self._streams -= 1
+
+    def stream(self, since=None, heartbeat=CHANGE_HEARTBEAT):
+        """生成 SSE 文本：先推送 ready（起始 revision），之后推送 change / reset，空闲时发送心跳
+
+        since 为 None 时从当前最新的 revision 开始，只推送之后的变更。
+        """
+        if since is None:
+            since = self.latest
+        yield _sse('ready', json.dumps({"revision": since}), since)
+
+        while not self._stop.is_set():
+            events = self.changes_since(since)
+            if events is None:
+                since = self.latest
+                yield _sse('reset', json.dumps({"revision": since}), since)
+                continue
+            if events:
+                yield ''.join(_sse('change', data, revision) for revision, data in events)
+                since = events[-1][0]
+                continue
+            with self._cond:
+                if not self._cond.wait_for(lambda: self._latest != since or self._stop.is_set(), timeout=heartbeat):
+                    yield ': keepalive\n\n'
+
+    def close(self):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
@@ -0,0 +1,344 @@
+"""仓库配置的进程内存储
+
+配置文件只在首次访问时解析一次，之后所有读取都直接使用内存中的数据；
+修改只标记为脏并安排一次延迟写回，短时间内的多次修改合并为一次落盘。
+落盘采用“临时文件 + rename”的方式，保证文件始终是完整的 JSON。
+
+每次修改都会递增配置中的 revision，客户端可据此做乐观并发控制。
+货架以稳定的 UUID 作为 ID，并维护 ID -> 列表下标 的索引，按 ID 的增删改查均为 O(1)。
+
+配置了布局后端（layout_db.LayoutDB）时，货架、零件、库道保存在数据库中，
+配置文件只保存其余的全局参数、视角、环境等设置。
+
+多进程部署（shared=True）时每个进程各有一份内存副本：修改在跨进程文件锁内完成并立即写回，
+不再延迟合并；读取前检查配置文件是否已被其他进程改写（比较 inode、修改时间和大小），
+改写过则重新加载。revision 因此在所有进程之间保持一致。
+"""
+import copy
+import json
+import os
+import tempfile
+import threading
+import uuid
+from contextlib import contextmanager, nullcontext
+
+from layout_db import LAYOUT_KEYS
+from process_lock import ProcessLock
+
+
+class RevisionConflict(Exception):
+    """客户端提交时携带的 revision 已过期"""
+
+    def __init__(self, current_revision):
+        super().__init__(f"revision 已过期，当前为 {current_revision}")
+        self.current_revision = current_revision
+
+
+def check_layout(config):
+    """检查配置结构：必须是对象，shelves/parts/aisles 必须是由对象组成的数组，否则抛出 ValueError"""
+    if not isinstance(config, dict):
+        raise ValueError("配置必须是 JSON 对象")
+    for key in LAYOUT_KEYS:
+        items = config.get(key)
+        if items is not None and not (isinstance(items, list) and all(isinstance(item, dict) for item in items)):
+            raise ValueError(f"{key} 必须是由对象组成的数组")
+
+
+def index_shelves(shelves):
+    """建立货架 ID -> 下标 的索引，为缺少或重复 ID 的货架分配新 ID；返回 (索引, 是否分配了新 ID)"""
+    positions = {}
+    assigned = False
+    for index, shelf in enumerate(shelves):
+        shelf_id = shelf.get('id')
+        if not isinstance(shelf_id, str) or not shelf_id or shelf_id in positions:
+            shelf_id = shelf['id'] = str(uuid.uuid4())
+            assigned = True
+        positions[shelf_id] = index
+    return positions, assigned
+
+
+class ShelfCollection:
+    """按稳定 ID 访问的货架集合：列表保存货架数据，字典保存 ID -> 下标"""
+
+    def __init__(self, shelves, positions):
+        self._shelves = shelves
+        self._positions = positions
+
+    def __len__(self):
+        return len(self._shelves)
+
+    def __iter__(self):
+        return iter(self._shelves)
+
+    def __contains__(self, shelf_id):
+        return shelf_id in self._positions
+
+    def get(self, shelf_id):
+        index = self._positions.get(shelf_id)
+        return None if index is None else self._shelves[index]
+
+    def add(self, data):
+        """添加货架并返回其 ID，未指定 ID 时自动生成"""
+        shelf_id = data.get('id') or str(uuid.uuid4())
+        if not isinstance(shelf_id, str):
+            raise ValueError(f"货架ID必须是字符串: {shelf_id!r}")
+        if shelf_id in self._positions:
+            raise KeyError(shelf_id)
+        data['id'] = shelf_id
+        self._positions[shelf_id] = len(self._shelves)
+        self._shelves.append(data)
+        return shelf_id
+
+    def update(self, shelf_id, data):
+        """合并更新货架字段（ID 不可修改），货架不存在时返回 False"""
+        shelf = self.get(shelf_id)
+        if shelf is None:
+            return False
+        shelf.update({key: value for key, value in data.items() if key != 'id'})
+        return True
+
+    def delete(self, shelf_id):
+        """删除货架，用末尾元素填补空位以保持 O(1)，货架不存在时返回 False"""
+        index = self._positions.pop(shelf_id, None)
+        if index is None:
+            return False
+        last = self._shelves.pop()
+        if index < len(self._shelves):
+            self._shelves[index] = last
+            self._positions[last['id']] = index
+        return True
+
+
+class ConfigStore:
+    """常驻内存的配置存储，支持延迟（write-behind）原子写回"""
+
+    def __init__(self, path, default, flush_delay=1.0, layout=None, shared=False):
+        self.path = path
+        self.default = default
+        self.flush_delay = flush_delay
+        self.layout = layout
+        self.shared = shared
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        self._process_lock = ProcessLock(path + '.lock') if shared else None
+        self._config = None
+        self._dirty = False
+        self._timer = None
+        self._shelf_positions = None
+        # 最近一次加载或写回后配置文件的 (inode, 修改时间, 大小)，多进程模式下用于发现其他进程的修改
+        self._signature = None
+
+    def _load(self):
+        """从文件读取配置，文件不存在或损坏时使用默认配置"""
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                pass
+        return copy.deepcopy(self.default)
+
+    def _file_signature(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def _exclusive(self):
+        """多进程模式下的跨进程锁，单进程时为空操作；须在持有 self._lock 时使用"""
+        return self._process_lock if self.shared else nullcontext()
+
+    def _load_state(self):
+        self._config = None
+        self._shelf_positions = None
+        self._dirty = False
+        config = self._load()
+        config.setdefault('revision', 0)
+        self._config = config
+        layout = self.layout.load() if self.layout is not None else None
+        if layout is not None:
+            config.update(layout)
+        self._shelf_collection(config)
+        if self.layout is not None and layout is None:
+            # 首次启用数据库存储：迁移旧文件中的布局，并把文件改写为不含布局的版本
+            self.layout.migrate(config, self.path)
+            self._mark_dirty()
+
+    def _ensure_loaded(self):
+        if not self.shared:
+            if self._config is None:
+                self._load_state()
+            return self._config
+
+        if self._config is None or self._file_signature() != self._signature:
+            with self._process_lock:
+                self._signature = self._file_signature()
+                self._load_state()
+                self._write_through()
+        return self._config
+
+    @property
+    def revision(self):
+        with self._lock:
+            return self._ensure_loaded().get('revision', 0)
+
+    @contextmanager
+    def read(self):
+        """只读访问配置，调用方在 with 块内完成序列化，不得修改返回的对象"""
+        with self._lock:
+            yield self._ensure_loaded()
+
+    def _shelf_collection(self, config):
+        """返回货架集合；索引失效时重建，并为缺少或重复 ID 的货架分配新 ID"""
+        shelves = config.setdefault('shelves', [])
+        if self._shelf_positions is None:
+            self._shelf_positions, assigned = index_shelves(shelves)
+            if assigned:
+                self._mark_dirty()
+        return ShelfCollection(shelves, self._shelf_positions)
+
+    @contextmanager
+    def read_shelves(self):
+        """只读访问货架集合"""
+        with self._lock:
+            yield self._shelf_collection(self._ensure_loaded())
+
+    @contextmanager
+    def write_shelves(self, expected_revision=None):
+        """可写访问货架集合，增删改通过集合方法完成以便索引保持同步"""
+        with self.write(expected_revision, reindex=False) as config:
+            yield self._shelf_collection(config)
+
+    @contextmanager
+    def write(self, expected_revision=None, reindex=True):
+        """可写访问配置，退出 with 块后安排延迟写回
+
+        进入 with 块时 revision 已递增为本次修改后的值；块内抛出异常时
+        revision 会被还原且不会标记修改，调用方需自行保证数据未被改动。
+        确定不会改动货架列表时传入 reindex=False 可跳过货架索引重建。
+        """
+        with self._lock, self._exclusive():
+            config = self._ensure_loaded()
+            current = config.get('revision', 0)
+            if expected_revision is not None and expected_revision != current:
+                raise RevisionConflict(current)
+            config['revision'] = current + 1
+            try:
+                yield config
+                if reindex:
+                    self._shelf_positions = None
+                    self._shelf_collection(config)
+            except BaseException:
+                config['revision'] = current
+                self._shelf_positions = None
+                raise
+            self._mark_dirty()
+            self._write_through()
+
+    def replace(self, config, expected_revision=None):
+        """整体替换配置（导入配置时使用）
+
+        新配置先在局部完成校验和索引，成功后才替换当前配置；结构不合法时抛出 ValueError，当前配置保持不变。
+        """
+        check_layout(config)
+        config = dict(config)
+        config['shelves'] = config.get('shelves') or []
+        positions, _ = index_shelves(config['shelves'])
+        with self._lock, self._exclusive():
+            current = self._ensure_loaded().get('revision', 0)
+            if expected_revision is not None and expected_revision != current:
+                raise RevisionConflict(current)
+            config['revision'] = current + 1
+            self._config = config
+            self._shelf_positions = positions
+            self._mark_dirty()
+            self._write_through()
+
+    def _mark_dirty(self):
+        self._dirty = True
+        if self.shared:
+            # 由 _write_through 在释放跨进程锁之前写回
+            return
+        if self.flush_delay <= 0:
+            self.flush()
+            return
+        if self._timer is None:
+            self._timer = threading.Timer(self.flush_delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _prepare(self):
+        """在持有 self._lock 时调用：序列化脏数据，没有修改时返回 None"""
+        if not self._dirty:
+            return None
+        document = self._config
+        layout_snapshot = None
+        revision = self._config.get('revision')
+        if self.layout is not None:
+            document = {key: value for key, value in self._config.items() if key not in LAYOUT_KEYS}
+            layout_snapshot = self.layout.snapshot(self._config)
+        data = json.dumps(document, ensure_ascii=False, separators=(',', ':'))
+        self._dirty = False
+        return data, layout_snapshot, revision
+
+    def _persist(self, prepared):
+        data, layout_snapshot, revision = prepared
+        try:
+            if layout_snapshot is not None:
+                self.layout.sync(layout_snapshot, revision=revision)
+            self._atomic_write(data)
+        except Exception:
+            with self._lock:
+                self._dirty = True
+            raise
+
+    def _write_through(self):
+        """多进程模式：在持有 self._lock 和跨进程锁时立即写回，并记录新的文件签名"""
+        if not self.shared:
+            return False
+        prepared = self._prepare()
+        if prepared is None:
+            return False
+        self._persist(prepared)
+        self._signature = self._file_signature()
+        return True
+
+    def flush(self):
+        """立即把脏数据写回文件"""
+        if self.shared:
+            with self._lock, self._process_lock:
+                if self._config is None:
+                    return False
+                # 文件已被其他进程改写时以文件为准，丢弃本进程未写回的修改
+                self._ensure_loaded()
+                return self._write_through()
+
+        with self._flush_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                prepared = self._prepare()
+            if prepared is None:
+                return False
+            self._persist(prepared)
+            return True
+
+    def _atomic_write(self, data):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix='.config-', suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def close(self):
+        """关闭存储：取消定时器并写回所有未保存的修改（进程退出时调用）"""
+        self.flush()
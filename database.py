@@ -0,0 +1,125 @@
+"""SQLite 连接池与连接参数
+
+每次请求不再新建连接：连接用完后调用 close() 会归还到池中，下次直接复用，
+省去建连、解析 schema 和预热页缓存的开销，连接自带的语句缓存也得以复用。
+新连接统一设置 WAL 日志、synchronous=NORMAL、页缓存和 mmap 等参数，
+这些参数可以通过 WAREHOUSE_DB_* 环境变量调整；外键约束始终开启。
+
+SQLite 连接不能跨 fork 使用：子进程中连接池会丢弃从父进程继承的空闲连接，重新建连。
+"""
+import os
+import sqlite3
+import threading
+import weakref
+
+DEFAULT_DB_SETTINGS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size_kb': 64 * 1024,
+    'mmap_size': 256 * 1024 * 1024,
+    'busy_timeout_ms': 5000,
+    'cached_statements': 256,
+    'pool_size': 8,
+}
+
+JOURNAL_MODES = {'DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF'}
+SYNCHRONOUS_MODES = {'OFF', 'NORMAL', 'FULL', 'EXTRA'}
+
+
+def load_db_settings(environ=os.environ, prefix='WAREHOUSE_DB_'):
+    """默认参数叠加环境变量，例如 WAREHOUSE_DB_CACHE_SIZE_KB=131072"""
+    settings = dict(DEFAULT_DB_SETTINGS)
+    for key, default in DEFAULT_DB_SETTINGS.items():
+        value = environ.get(prefix + key.upper())
+        if value is None:
+            continue
+        settings[key] = int(value) if isinstance(default, int) else value.upper()
+
+    if settings['journal_mode'] not in JOURNAL_MODES:
+        raise ValueError(f"无效的 journal_mode: {settings['journal_mode']}")
+    if settings['synchronous'] not in SYNCHRONOUS_MODES:
+        raise ValueError(f"无效的 synchronous: {settings['synchronous']}")
+    return settings
+
+
+class PooledConnection(sqlite3.Connection):
+    """close() 时归还连接池而不是真正关闭的连接"""
+
+    pool = None
+
+    def close(self):
+        if self.pool is None:
+            super().close()
+        else:
+            self.pool.release(self)
+
+    def close_for_real(self):
+        self.pool = None
+        super().close()
+
+
+class ConnectionPool:
+    """线程安全的 SQLite 连接池，空闲连接数不超过 pool_size"""
+
+    def __init__(self, path, settings=None):
+        self.path = path
+        self.settings = settings or load_db_settings()
+        self._idle = []
+        self._lock = threading.Lock()
+        self._closed = False
+        # 继承自父进程的连接只保留引用、不关闭，避免在子进程中操作父进程的数据库句柄
+        self._inherited = []
+        if hasattr(os, 'register_at_fork'):
+            pool = weakref.ref(self)
+            os.register_at_fork(after_in_child=lambda: pool() and pool()._after_fork())
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self._inherited.extend(self._idle)
+        self._idle = []
+
+    def _open(self):
+        s = self.settings
+        conn = sqlite3.connect(
+            self.path,
+            timeout=s['busy_timeout_ms'] / 1000,
+            check_same_thread=False,
+            cached_statements=s['cached_statements'],
+            factory=PooledConnection,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute(f"PRAGMA journal_mode = {s['journal_mode']}")
+        conn.execute(f"PRAGMA synchronous = {s['synchronous']}")
+        conn.execute(f"PRAGMA cache_size = {-int(s['cache_size_kb'])}")
+        conn.execute(f"PRAGMA mmap_size = {int(s['mmap_size'])}")
+        conn.execute(f"PRAGMA busy_timeout = {int(s['busy_timeout_ms'])}")
+        conn.execute('PRAGMA temp_store = MEMORY')
+        conn.execute('PRAGMA foreign_keys = ON')
+        conn.pool = self
+        return conn
+
+    def connect(self):
+        """取出一个空闲连接，没有空闲连接时新建"""
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return self._open()
+
+    def release(self, conn):
+        """归还连接：回滚未提交的事务，池满或已关闭时真正关闭"""
+        if conn.in_transaction:
+            conn.rollback()
+        conn.row_factory = sqlite3.Row
+        with self._lock:
+            if not self._closed and len(self._idle) < self.settings['pool_size']:
+                self._idle.append(conn)
+                return
+        conn.close_for_real()
+
+    def close_all(self):
+        """关闭所有空闲连接（进程退出时调用）"""
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close_for_real()
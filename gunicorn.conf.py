@@ -0,0 +1,38 @@
+"""生产环境的 gunicorn 配置
+
+启动: gunicorn -c gunicorn.conf.py
+参数可用环境变量调整，见 README 的“生产部署”一节。
+"""
+import multiprocessing
+import os
+
+# 多个 worker 共享配置文件和数据库，必须在导入 app 之前开启
+os.environ.setdefault('WAREHOUSE_SHARED_STATE', '1')
+
+wsgi_app = 'app:create_app()'
+bind = os.environ.get('WAREHOUSE_BIND', '0.0.0.0:5002')
+
+# 默认每个 CPU 核一个 worker；每个 worker 用线程处理并发请求，
+# SSE 变更推送（/api/changes/stream）的每个连接会长期占用一个线程
+workers = int(os.environ.get('WAREHOUSE_WORKERS', 0)) or multiprocessing.cpu_count()
+worker_class = 'gthread'
+threads = int(os.environ.get('WAREHOUSE_THREADS', 16))
+# SSE 连接最多占用一半线程，其余线程留给普通请求；超出的连接返回 503，客户端改为轮询
+os.environ.setdefault('WAREHOUSE_SSE_MAX_CONNECTIONS', str(max(1, threads // 2)))
+
+# 每个 worker 各有一个图片处理进程池，按 worker 数平分 CPU，避免总共启动 CPU 核数² 个 Pillow 进程
+os.environ.setdefault('WAREHOUSE_IMAGE_WORKERS', str(max(1, multiprocessing.cpu_count() // workers)))
+
+# 不预加载：每个 worker 各自导入并初始化应用，数据库连接、后台线程和图片进程池都不会跨 fork 共享
+preload_app = False
+
+timeout = 120
+graceful_timeout = 30
+keepalive = 5
+
+# worker 处理一定数量的请求后重启，抖动避免所有 worker 同时重启
+max_requests = int(os.environ.get('WAREHOUSE_MAX_REQUESTS', 10000))
+max_requests_jitter = max_requests // 10
+
+accesslog = os.environ.get('WAREHOUSE_ACCESS_LOG', '-')
+errorlog = '-'
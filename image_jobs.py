@@ -0,0 +1,246 @@
+"""SKU 图片的异步处理
+
+上传接口只负责保存原图并立即返回，缩略图等派生图和多面贴图合成图交给独立的进程池生成，
+不再占用 Web 工作线程的 CPU。排队中的任务数有上限，超出时提交会抛出 QueueFull，
+由调用方返回 503 让客户端稍后重试。
+
+任务状态保存在提交任务的进程的内存中（pending / done / failed），可按任务 ID 或输出文件名查询；
+需要跨进程共享或持久化的状态由调用方在 on_finish 回调中保存（派生图状态见 image_store.py）。
+
+进程池不用 fork 启动：提交任务时 Web 进程中已有请求线程和后台线程，fork 会把它们持有的锁
+复制进子进程而导致死锁。子进程由 forkserver（Windows 上为 spawn）启动，任务函数必须是本模块的
+顶层函数、参数只能是路径和数字等可序列化的值，回调在提交任务的进程中执行。
+"""
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+# 进程池的启动方式
+POOL_START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+COMPOSITE_CELL_SIZE = 100
+TEXTURE_MAX_SIZE = 1024
+
+# 多面贴图展开图中每个面所在的格子（列, 行），整张图为 4 x 3 格
+COMPOSITE_LAYOUT = {
+    'texture_top': (1, 0),
+    'texture_left': (0, 1),
+    'texture_front': (1, 1),
+    'texture_right': (2, 1),
+    'texture_back': (3, 1),
+    'texture_bottom': (1, 2),
+}
+
+
+def _save_image(img, path, image_format, **options):
+    """先写临时文件再替换，避免客户端读到写了一半的图片"""
+    tmp_path = f"{path}.tmp"
+    try:
+        img.save(tmp_path, image_format, **options)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _load_tile(img_path, cell_size, stretch=False):
+    """读取一张贴图并缩放到格子大小：stretch 为真时拉伸铺满，否则按比例缩放到格子内"""
+    with Image.open(img_path) as img:
+        img = img.convert('RGB')
+        if stretch:
+            return img.resize((cell_size, cell_size), Image.Resampling.LANCZOS)
+        img.thumbnail((cell_size, cell_size))
+        return img
+
+
+def make_composite(texture_paths, composite_path, cell_size=COMPOSITE_CELL_SIZE):
+    """将多面贴图合成为一张缩略图（展开图），texture_paths 为 {texture_面: 文件路径}"""
+    composite = Image.new('RGB', (cell_size * 4, cell_size * 3), color=(240, 240, 240))
+
+    for texture_key, (column, row) in COMPOSITE_LAYOUT.items():
+        img_path = texture_paths.get(texture_key)
+        if not img_path or not os.path.exists(img_path):
+            continue
+        try:
+            img = _load_tile(img_path, cell_size)
+            offset_x = (cell_size - img.width) // 2
+            offset_y = (cell_size - img.height) // 2
+            composite.paste(img, (column * cell_size + offset_x, row * cell_size + offset_y))
+        except Exception as e:
+            print(f"处理贴图失败 {texture_key}: {e}")
+
+    _save_image(composite, composite_path, 'JPEG', quality=85)
+    return os.path.basename(composite_path)
+
+
+def make_atlas_page(tiles, page_path, page_size, tile_size):
+    """把贴图按格子拼成一页图集，tiles 为 [(格子序号, 文件路径)]，格子按行优先排列"""
+    columns = page_size // tile_size
+    page = Image.new('RGB', (page_size, page_size), color=(212, 165, 116))
+
+    for slot, img_path in tiles:
+        try:
+            img = _load_tile(img_path, tile_size, stretch=True)
+        except Exception as e:
+            print(f"处理贴图失败 {os.path.basename(img_path)}: {e}")
+            continue
+        page.paste(img, ((slot % columns) * tile_size, (slot // columns) * tile_size))
+
+    _save_image(page, page_path, 'WEBP', quality=85, method=4)
+    return os.path.basename(page_path)
+
+
+def _power_of_two_floor(value, limit):
+    size = 1
+    while size * 2 <= min(value, limit):
+        size *= 2
+    return size
+
+
+def make_derivatives(image_path, derivatives):
+    """从一张原图生成多种尺寸的派生图
+
+    derivatives 为 [(输出路径, 尺寸)]：尺寸为整数时按最长边缩放，
+    为 'texture' 时宽高各自缩放到不超过 TEXTURE_MAX_SIZE 的 2 的幂（便于 Three.js 生成 mipmap）。
+    输出格式由扩展名决定（.webp / .jpg）。
+    """
+    written = []
+    with Image.open(image_path) as source:
+        source.load()
+        has_alpha = source.mode in ('RGBA', 'LA') or 'transparency' in source.info
+        source = source.convert('RGBA' if has_alpha else 'RGB')
+        for path, size in derivatives:
+            if size == 'texture':
+                target = (_power_of_two_floor(source.width, TEXTURE_MAX_SIZE),
+                          _power_of_two_floor(source.height, TEXTURE_MAX_SIZE))
+                img = source.resize(target, Image.Resampling.LANCZOS)
+            else:
+                img = source.copy()
+                img.thumbnail((size, size), Image.Resampling.LANCZOS)
+            if path.endswith('.webp'):
+                _save_image(img, path, 'WEBP', quality=82, method=4)
+            else:
+                if img.mode == 'RGBA':
+                    background = Image.new('RGB', img.size, (255, 255, 255))
+                    background.paste(img, mask=img.split()[-1])
+                    img = background
+                _save_image(img, path, 'JPEG', quality=85)
+            written.append(os.path.basename(path))
+    return written
+
+
+class QueueFull(Exception):
+    """排队中的图片任务已达上限"""
+
+
+class ImageJobQueue:
+    """有界的图片处理任务队列，任务在进程池中执行"""
+
+    def __init__(self, max_workers=None, max_pending=64, history=1000):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.history = history
+        self._executor = None
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()
+        self._outputs = {}
+        self._pending = 0
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                 mp_context=multiprocessing.get_context(POOL_START_METHOD))
+        return self._executor
+
+    def submit(self, kind, func, *args, outputs=(), on_finish=None):
+        """提交任务并返回任务信息；outputs 为任务将生成的文件名，用于按文件查询状态
+
+        on_finish 在任务结束（成功或失败）后以任务信息为参数调用。
+        """
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise QueueFull(f"图片处理队列已满（{self.max_pending}）")
+            job = {
+                "id": uuid.uuid4().hex,
+                "kind": kind,
+                "status": "pending",
+                "outputs": list(outputs),
+                "error": None,
+                "created_at": time.time(),
+                "finished_at": None,
+            }
+            self._jobs[job['id']] = job
+            for filename in job['outputs']:
+                self._outputs[filename] = job['id']
+            self._pending += 1
+            future = self._get_executor().submit(func, *args)
+
+        future.add_done_callback(lambda f: self._finish(job['id'], f, on_finish))
+        return dict(job)
+
+    def _finish(self, job_id, future, on_finish=None):
+        error = future.exception()
+        with self._lock:
+            self._pending -= 1
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job['status'] = 'failed' if error else 'done'
+            job['error'] = str(error) if error else None
+            job['finished_at'] = time.time()
+            if not error:
+                for filename in job['outputs']:
+                    self._outputs.pop(filename, None)
+            self._trim()
+            finished = dict(job)
+        if error:
+            print(f"图片处理失败 {finished['kind']}: {error}")
+        if on_finish is not None:
+            try:
+                on_finish(finished)
+            except Exception as e:
+                print(f"记录图片任务结果失败 {finished['kind']}: {e}")
+
+    def _trim(self):
+        """只保留最近 history 个已结束的任务"""
+        finished = len(self._jobs) - self._pending
+        for job_id in list(self._jobs):
+            if finished <= self.history:
+                break
+            job = self._jobs[job_id]
+            if job['status'] == 'pending':
+                continue
+            del self._jobs[job_id]
+            for filename in job['outputs']:
+                if self._outputs.get(filename) == job_id:
+                    del self._outputs[filename]
+            finished -= 1
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return None if job is None else dict(job)
+
+    def job_for(self, filename):
+        """生成该输出文件且尚未成功的任务（排队中或失败），没有时返回 None"""
+        with self._lock:
+            job_id = self._outputs.get(filename)
+            return None if job_id is None else dict(self._jobs[job_id])
+
+    def status_for(self, filename):
+        """本进程中输出文件的处理状态：pending / failed，没有未成功的任务时返回 None"""
+        job = self.job_for(filename) if filename else None
+        return None if job is None else job['status']
+
+    def shutdown(self):
+        """等待排队中的任务完成并关闭进程池（进程退出时调用）"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
@@ -0,0 +1,337 @@
+"""内容寻址的 SKU 图片存储
+
+上传的图片以内容的 BLAKE2 摘要命名（<摘要>.<扩展名>），相同内容只保存一次，
+派生图（64/150/512 像素缩略图、2 的幂尺寸的 WebP 贴图）也只生成一次。
+
+image_files 表记录每个文件被多少个 SKU 引用（image 与六个 texture_* 字段，
+同一 SKU 多个字段引用同一文件只计一次），由 skus 表上的触发器维护。
+删除 SKU 时只有引用计数归零、且最后一个引用移除后超过宽限期未被重新上传的文件才会被删除，
+其他 SKU 仍在使用的文件不受影响。
+
+派生图的生成状态（pending / ready / failed）和对应的任务 ID 也记在 image_files 行上，
+所有进程都能查询；进程重启后由 resumable_derivatives 找出未完成的派生图重新提交。
+
+旧版本以随机文件名保存的图片不在 image_files 中，仍按原来的方式处理。
+"""
+import hashlib
+import os
+import re
+import tempfile
+import time
+
+CONTENT_HASH_SIZE = 16
+HASHED_NAME = re.compile(r'^([0-9a-f]{32})\.[a-z0-9]+$')
+# 原图、派生图（<摘要>_<后缀>.webp）、合成缩略图（sku_composite_<摘要>.jpg）和
+# 贴图图集（atlas_<摘要>.webp）的文件名都由内容决定
+FINGERPRINTED_NAME = re.compile(r'^(?:sku_composite_|atlas_)?([0-9a-f]{32})(?:_[a-z0-9]+)?\.[a-z0-9]+$')
+DERIVATIVE_NAME = re.compile(r'^([0-9a-f]{32})_[a-z0-9]+\.webp$')
+
+# 派生图：后缀 -> 尺寸（最长边像素，texture 为 2 的幂贴图）
+DERIVATIVES = {
+    '64': 64,
+    '150': 150,
+    '512': 512,
+    'tex': 'texture',
+}
+THUMBNAIL_DERIVATIVE = '150'
+
+SKU_IMAGE_COLUMNS = ('image', 'texture_top', 'texture_bottom', 'texture_front',
+                     'texture_back', 'texture_left', 'texture_right')
+
+# 引用计数归零后文件至少保留的秒数，期间重新上传相同内容可直接复用
+RELEASE_GRACE_PERIOD = 3600
+RELEASE_BATCH = 500
+
+# SQLite 中的当前 Unix 时间（秒），与 time.time() 一致
+NOW_SQL = "((julianday('now') - 2440587.5) * 86400.0)"
+
+# 排队超过该秒数仍为 pending 的派生图视为提交它的进程已退出，启动时重新提交
+DERIVATIVE_STALE_AFTER = 600
+DERIVATIVE_COLUMNS = {
+    'derivative_status': 'TEXT',
+    'derivative_job': 'TEXT',
+    'derivative_error': 'TEXT',
+    'derivative_queued_at': 'REAL',
+}
+
+
+def content_hash(data):
+    return hashlib.blake2b(data, digest_size=CONTENT_HASH_SIZE).hexdigest()
+
+
+def content_digest(filename):
+    """内容寻址文件名中的摘要，旧版随机文件名返回 None"""
+    match = HASHED_NAME.match(filename or '')
+    return match.group(1) if match else None
+
+
+def fingerprint(filename):
+    """由内容决定的文件名（内容不变则文件名不变）返回其指纹，可用作强 ETag；其他文件返回 None"""
+    match = FINGERPRINTED_NAME.match(filename or '')
+    return filename.rsplit('.', 1)[0] if match else None
+
+
+def derivative_name(digest, suffix):
+    return f"{digest}_{suffix}.webp"
+
+
+def thumbnail_name(digest):
+    return derivative_name(digest, THUMBNAIL_DERIVATIVE)
+
+
+def init_image_schema(cursor):
+    """创建 image_files 表及维护引用计数的触发器"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS image_files (
+            filename TEXT PRIMARY KEY,
+            hash TEXT NOT NULL UNIQUE,
+            bytes INTEGER NOT NULL,
+            refcount INTEGER NOT NULL DEFAULT 0,
+            created_at REAL,
+            last_used_at REAL
+        )
+    ''')
+
+    existing = {row[1] for row in cursor.execute('PRAGMA table_info(image_files)').fetchall()}
+    for column, column_type in DERIVATIVE_COLUMNS.items():
+        if column not in existing:
+            cursor.execute(f'ALTER TABLE image_files ADD COLUMN {column} {column_type}')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_image_files_job ON image_files(derivative_job)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_image_files_unused ON image_files(last_used_at) WHERE refcount <= 0')
+
+    def refs(prefix):
+        return ', '.join(f'{prefix}.{column}' for column in SKU_IMAGE_COLUMNS)
+
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS image_files_sku_insert AFTER INSERT ON skus BEGIN
+            UPDATE image_files SET refcount = refcount + 1 WHERE filename IN ({refs('new')});
+        END
+    ''')
+    # 引用减少时刷新 last_used_at，release 的宽限期从最后一次被引用算起而不是从上传算起；
+    # 旧版本的触发器不刷新时间，先删除再重建
+    release = f'''
+        UPDATE image_files SET refcount = refcount - 1, last_used_at = {NOW_SQL}
+        WHERE filename IN ({refs('old')});
+    '''
+    cursor.execute('DROP TRIGGER IF EXISTS image_files_sku_delete')
+    cursor.execute(f'''
+        CREATE TRIGGER image_files_sku_delete AFTER DELETE ON skus BEGIN
+            {release}
+        END
+    ''')
+    cursor.execute('DROP TRIGGER IF EXISTS image_files_sku_update')
+    cursor.execute(f'''
+        CREATE TRIGGER image_files_sku_update AFTER UPDATE OF {', '.join(SKU_IMAGE_COLUMNS)} ON skus BEGIN
+            {release}
+            UPDATE image_files SET refcount = refcount + 1 WHERE filename IN ({refs('new')});
+        END
+    ''')
+
+
+class ImageStore:
+    """按内容摘要保存图片，原图放在 image_dir，派生图放在 derived_dir"""
+
+    def __init__(self, connect, image_dir, derived_dir, grace_period=RELEASE_GRACE_PERIOD):
+        self.connect = connect
+        self.image_dir = image_dir
+        self.derived_dir = derived_dir
+        self.grace_period = grace_period
+
+    def derivative_paths(self, digest):
+        """[(派生图路径, 尺寸)]，用作 image_jobs.make_derivatives 的参数"""
+        return [(os.path.join(self.derived_dir, derivative_name(digest, suffix)), size)
+                for suffix, size in DERIVATIVES.items()]
+
+    def missing_derivatives(self, digest):
+        return [path for path, _ in self.derivative_paths(digest) if not os.path.exists(path)]
+
+    def store(self, data, ext):
+        """保存图片内容，返回 (文件名, 摘要, 是否需要生成派生图)；相同内容已存在时直接复用"""
+        digest = content_hash(data)
+        now = time.time()
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('SELECT filename FROM image_files WHERE hash = ?', (digest,))
+            row = cursor.fetchone()
+            filename = row['filename'] if row else f"{digest}.{ext}"
+            path = os.path.join(self.image_dir, filename)
+
+            written = not os.path.exists(path)
+            if written:
+                self._atomic_write(path, data)
+            else:
+                # 刷新修改时间，避免刚被复用的旧文件被回收（见 upload_gc.py）
+                os.utime(path)
+            needs_derivatives = bool(self.missing_derivatives(digest))
+            # 其他进程可能同时保存了相同内容：以先写入的记录为准，只刷新使用时间
+            cursor.execute('''
+                INSERT INTO image_files (filename, hash, bytes, refcount, created_at, last_used_at, derivative_status)
+                VALUES (?, ?, ?, 0, ?, ?, ?)
+                ON CONFLICT(hash) DO UPDATE SET last_used_at = excluded.last_used_at
+            ''', (filename, digest, len(data), now, now, None if needs_derivatives else 'ready'))
+            cursor.execute('SELECT filename FROM image_files WHERE hash = ?', (digest,))
+            stored = cursor.fetchone()['filename']
+            conn.commit()
+        finally:
+            conn.close()
+        if stored != filename and written:
+            # 相同内容以不同扩展名先被保存，删除本次写入的副本
+            os.remove(path)
+        return stored, digest, needs_derivatives
+
+    def mark_derivatives(self, digest, status, job_id=None, error=None):
+        """记录派生图状态；pending 只在该任务还没有记录结果时写入，不会覆盖先完成的同一任务"""
+        conn = self.connect()
+        try:
+            if status == 'pending':
+                conn.execute('''
+                    UPDATE image_files SET derivative_status = 'pending', derivative_job = ?,
+                        derivative_error = NULL, derivative_queued_at = ?
+                    WHERE hash = ? AND derivative_job IS NOT ?
+                ''', (job_id, time.time(), digest, job_id))
+            else:
+                conn.execute('''
+                    UPDATE image_files SET derivative_status = ?, derivative_job = COALESCE(?, derivative_job),
+                        derivative_error = ?
+                    WHERE hash = ?
+                ''', (status, job_id, error, digest))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def derivative_statuses(self, filenames):
+        """派生图文件名（<摘要>_<后缀>.webp）-> 生成状态，一次查询；其他文件名和未记录的派生图不在结果中"""
+        names = {}
+        for filename in filenames:
+            match = DERIVATIVE_NAME.match(filename or '')
+            if match:
+                names.setdefault(match.group(1), []).append(filename)
+        if not names:
+            return {}
+        digests = list(names)
+        statuses = {}
+        conn = self.connect()
+        try:
+            for start in range(0, len(digests), RELEASE_BATCH):
+                chunk = digests[start:start + RELEASE_BATCH]
+                rows = conn.execute(f'''
+                    SELECT hash, derivative_status FROM image_files
+                    WHERE hash IN ({', '.join('?' * len(chunk))}) AND derivative_status IS NOT NULL
+                ''', chunk).fetchall()
+                for row in rows:
+                    for filename in names[row['hash']]:
+                        statuses[filename] = row['derivative_status']
+        finally:
+            conn.close()
+        return statuses
+
+    def derivative_job(self, job_id):
+        """按任务 ID 查询派生图任务（可能由其他进程提交），不存在时返回 None"""
+        conn = self.connect()
+        try:
+            row = conn.execute('''
+                SELECT hash, derivative_status, derivative_error, derivative_queued_at
+                FROM image_files WHERE derivative_job = ?
+            ''', (job_id,)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        status = row['derivative_status']
+        return {
+            "id": job_id,
+            "kind": 'derivatives',
+            "status": 'done' if status == 'ready' else status,
+            "outputs": [derivative_name(row['hash'], suffix) for suffix in DERIVATIVES],
+            "error": row['derivative_error'],
+            "created_at": row['derivative_queued_at'],
+            "finished_at": None,
+        }
+
+    def resumable_derivatives(self):
+        """启动时调用：返回需要（重新）生成派生图的 [(文件名, 摘要)]，并把它们标记为刚排队
+
+        派生图已齐全的记为 ready，原图已不存在的记为 failed。标记在同一事务中完成，
+        多个进程依次启动时后启动的进程不会重复提交。
+        """
+        now = time.time()
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT filename, hash FROM image_files
+                WHERE derivative_status IS NULL
+                   OR (derivative_status = 'pending' AND COALESCE(derivative_queued_at, 0) < ?)
+            ''', (now - DERIVATIVE_STALE_AFTER,))
+            pending, ready, failed = [], [], []
+            for row in cursor.fetchall():
+                if not self.missing_derivatives(row['hash']):
+                    ready.append((row['hash'],))
+                elif not os.path.exists(os.path.join(self.image_dir, row['filename'])):
+                    failed.append((row['hash'],))
+                else:
+                    pending.append((row['filename'], row['hash']))
+            cursor.executemany("UPDATE image_files SET derivative_status = 'ready' WHERE hash = ?", ready)
+            cursor.executemany('''
+                UPDATE image_files SET derivative_status = 'failed', derivative_error = '原图不存在' WHERE hash = ?
+            ''', failed)
+            cursor.executemany('''
+                UPDATE image_files SET derivative_status = 'pending', derivative_job = NULL, derivative_queued_at = ?
+                WHERE hash = ?
+            ''', [(now, digest) for _, digest in pending])
+            conn.commit()
+        finally:
+            conn.close()
+        return pending
+
+    def _atomic_write(self, path, data):
+        fd, tmp_path = tempfile.mkstemp(prefix='.upload-', suffix='.tmp', dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def release(self, cursor, filenames):
+        """在删除/修改 SKU 的同一事务中调用：删除引用计数已归零且超过宽限期的文件记录
+
+        宽限期从最后一个引用被移除时算起（由触发器刷新 last_used_at），本次刚释放的文件通常还在宽限期内，
+        因此同时回收一批其他早已过期的无引用文件。返回需要删除的文件名，调用方在事务提交后交给 remove_files 删除。
+        """
+        names = sorted({name for name in filenames if content_digest(name)})
+        cutoff = time.time() - self.grace_period
+        released = []
+        # 分批查询，避免批量删除大量 SKU 时超出 SQLite 的参数个数上限
+        for start in range(0, len(names), RELEASE_BATCH):
+            chunk = names[start:start + RELEASE_BATCH]
+            placeholders = ', '.join('?' * len(chunk))
+            cursor.execute(f'''
+                SELECT filename FROM image_files
+                WHERE filename IN ({placeholders}) AND refcount <= 0 AND last_used_at < ?
+            ''', (*chunk, cutoff))
+            released.extend(row['filename'] for row in cursor.fetchall())
+        cursor.execute('SELECT filename FROM image_files WHERE refcount <= 0 AND last_used_at < ? LIMIT ?',
+                       (cutoff, RELEASE_BATCH))
+        released.extend(row['filename'] for row in cursor.fetchall() if row['filename'] not in released)
+        cursor.executemany('DELETE FROM image_files WHERE filename = ?', [(name,) for name in released])
+        return released
+
+    def remove_files(self, filenames):
+        """删除原图及其全部派生图，返回释放的字节数"""
+        reclaimed = 0
+        for filename in filenames:
+            paths = [os.path.join(self.image_dir, filename)]
+            digest = content_digest(filename)
+            if digest:
+                paths.extend(path for path, _ in self.derivative_paths(digest))
+            for path in paths:
+                try:
+                    reclaimed += os.path.getsize(path)
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+        return reclaimed
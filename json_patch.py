@@ -0,0 +1,154 @@
+"""RFC 6902 JSON Patch 的最小实现
+
+补丁直接作用在内存中的配置上（不复制整个文档），任一操作失败时
+按相反顺序撤销已执行的操作，保证补丁整体生效或整体不生效。
+"""
+import copy
+
+
+class JsonPatchError(ValueError):
+    """补丁格式错误或无法应用"""
+
+
+def _parse_pointer(pointer):
+    if not isinstance(pointer, str) or (pointer and not pointer.startswith('/')):
+        raise JsonPatchError(f"无效的 JSON Pointer: {pointer!r}")
+    if pointer == '':
+        raise JsonPatchError("不支持对整个文档进行操作")
+    return [token.replace('~1', '/').replace('~0', '~') for token in pointer[1:].split('/')]
+
+
+def _list_index(container, token, allow_end=False):
+    if token == '-' and allow_end:
+        return len(container)
+    if not token.isdigit() or (len(token) > 1 and token.startswith('0')):
+        raise JsonPatchError(f"无效的数组下标: {token}")
+    index = int(token)
+    upper = len(container) if allow_end else len(container) - 1
+    if index > upper:
+        raise JsonPatchError(f"数组下标越界: {token}")
+    return index
+
+
+def _resolve_parent(doc, tokens):
+    container = doc
+    for token in tokens[:-1]:
+        if isinstance(container, list):
+            container = container[_list_index(container, token)]
+        elif isinstance(container, dict):
+            if token not in container:
+                raise JsonPatchError(f"路径不存在: {token}")
+            container = container[token]
+        else:
+            raise JsonPatchError(f"路径不存在: {token}")
+    if not isinstance(container, (list, dict)):
+        raise JsonPatchError("目标的父节点不是对象或数组")
+    return container, tokens[-1]
+
+
+def _get(doc, pointer):
+    container, key = _resolve_parent(doc, _parse_pointer(pointer))
+    if isinstance(container, list):
+        return container[_list_index(container, key)]
+    if key not in container:
+        raise JsonPatchError(f"路径不存在: {pointer}")
+    return container[key]
+
+
+def _add(doc, pointer, value, undo):
+    container, key = _resolve_parent(doc, _parse_pointer(pointer))
+    if isinstance(container, list):
+        index = _list_index(container, key, allow_end=True)
+        container.insert(index, value)
+        undo.append(lambda: container.pop(index))
+    elif key in container:
+        old = container[key]
+        container[key] = value
+        undo.append(lambda: container.__setitem__(key, old))
+    else:
+        container[key] = value
+        undo.append(lambda: container.pop(key))
+
+
+def _remove(doc, pointer, undo):
+    container, key = _resolve_parent(doc, _parse_pointer(pointer))
+    if isinstance(container, list):
+        index = _list_index(container, key)
+        value = container.pop(index)
+        undo.append(lambda: container.insert(index, value))
+    else:
+        if key not in container:
+            raise JsonPatchError(f"路径不存在: {pointer}")
+        value = container.pop(key)
+        undo.append(lambda: container.__setitem__(key, value))
+    return value
+
+
+def _replace(doc, pointer, value, undo):
+    container, key = _resolve_parent(doc, _parse_pointer(pointer))
+    if isinstance(container, list):
+        key = _list_index(container, key)
+    elif key not in container:
+        raise JsonPatchError(f"路径不存在: {pointer}")
+    old = container[key]
+    container[key] = value
+    undo.append(lambda: container.__setitem__(key, old))
+
+
+def _apply_operation(doc, operation, undo):
+    if not isinstance(operation, dict) or 'op' not in operation or 'path' not in operation:
+        raise JsonPatchError("补丁操作必须包含 op 和 path")
+
+    op = operation['op']
+    path = operation['path']
+
+    if op in ('add', 'replace', 'test') and 'value' not in operation:
+        raise JsonPatchError(f"{op} 操作缺少 value")
+    if op in ('move', 'copy') and 'from' not in operation:
+        raise JsonPatchError(f"{op} 操作缺少 from")
+    # 先校验所有指针，避免对非字符串调用字符串方法
+    _parse_pointer(path)
+    if op in ('move', 'copy'):
+        _parse_pointer(operation['from'])
+
+    if op == 'add':
+        _add(doc, path, operation['value'], undo)
+    elif op == 'remove':
+        _remove(doc, path, undo)
+    elif op == 'replace':
+        _replace(doc, path, operation['value'], undo)
+    elif op == 'move':
+        source = operation['from']
+        if path.startswith(source + '/'):
+            raise JsonPatchError("不能把节点移动到它自己的子节点中")
+        if path != source:
+            _add(doc, path, _remove(doc, source, undo), undo)
+    elif op == 'copy':
+        _add(doc, path, copy.deepcopy(_get(doc, operation['from'])), undo)
+    elif op == 'test':
+        if _get(doc, path) != operation['value']:
+            raise JsonPatchError(f"test 操作失败: {path}")
+    else:
+        raise JsonPatchError(f"不支持的操作: {op}")
+
+
+def apply_patch(doc, operations, validate=None):
+    """就地应用补丁操作列表，失败时回滚并抛出 JsonPatchError
+
+    validate 为可选的校验函数，在全部操作完成后以文档为参数调用，抛出 ValueError 时同样回滚。
+    """
+    if not isinstance(operations, list):
+        raise JsonPatchError("补丁必须是操作数组")
+
+    undo = []
+    try:
+        for operation in operations:
+            _apply_operation(doc, operation, undo)
+        if validate is not None:
+            validate(doc)
+    except (ValueError, IndexError, KeyError, TypeError) as e:
+        for revert in reversed(undo):
+            revert()
+        if isinstance(e, JsonPatchError):
+            raise
+        raise JsonPatchError(str(e)) from e
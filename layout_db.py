@@ -0,0 +1,370 @@
+"""仓库布局（货架、零件、库道）的 SQLite 持久化与空间索引
+
+布局数据保存在与 SKU/货物相同的数据库中，每类对象一张表，几何字段单独成列，
+完整的对象 JSON 保存在 data 列中以便原样还原。每张表配一个 R*Tree 虚拟表，
+保存对象在地面（X/Z 平面）上的外接矩形，区域查询只需对数时间。
+
+写回是增量的：只有内容或顺序发生变化的行才会被写入，写入的增量同时记录到变更日志。
+"""
+import json
+import math
+import os
+import shutil
+
+from change_feed import append_changes
+
+LAYOUT_KEYS = ('shelves', 'parts', 'aisles')
+# 变更日志中的对象类型；零件和库道没有 ID，以列表下标标识
+LAYOUT_CHANGE_KINDS = {'shelves': 'shelf', 'parts': 'part', 'aisles': 'aisle'}
+
+# 各类零件的默认占地尺寸 (宽, 深)，与 parts.js 中的创建函数保持一致
+PART_DEFAULT_SIZES = {
+    'dock': (4, 0.3),
+    'wall': (6, 0.2),
+    'staircase': (3, 4),
+    'elevator': (3, 3),
+    'restroom': (4, 3),
+    'office': (6, 4),
+}
+
+DEFAULT_AISLE_WIDTH = 2
+
+
+def _num(value, default=0.0):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float(default)
+
+
+def _rotated_bounds(x, z, half_x, half_z, rotation):
+    """绕 Y 轴旋转后的外接矩形 (min_x, max_x, min_z, max_z)"""
+    cos = abs(math.cos(rotation))
+    sin = abs(math.sin(rotation))
+    extent_x = half_x * cos + half_z * sin
+    extent_z = half_x * sin + half_z * cos
+    return (x - extent_x, x + extent_x, z - extent_z, z + extent_z)
+
+
+def shelf_geometry(shelf):
+    """货架的中心与尺寸：长度沿 Z 轴，深度沿 X 轴（与 shelf.js 一致）"""
+    position = shelf.get('position') or {}
+    dimensions = shelf.get('dimensions') or {}
+    return {
+        'x': _num(position.get('x')),
+        'y': _num(position.get('y')),
+        'z': _num(position.get('z')),
+        'length': _num(dimensions.get('length'), 2),
+        'height': _num(dimensions.get('height'), 3),
+        'depth': _num(dimensions.get('depth'), 1),
+        'rotation': _num(shelf.get('rotation')),
+    }
+
+
+def shelf_footprint(shelf):
+    g = shelf_geometry(shelf)
+    return _rotated_bounds(g['x'], g['z'], g['depth'] / 2, g['length'] / 2, g['rotation'])
+
+
+def part_geometry(part):
+    """零件的中心、占地尺寸（宽沿本地 X，深沿本地 Z）与旋转"""
+    part_type = part.get('partType', '')
+    position = part.get('position') or {}
+    default_width, default_depth = PART_DEFAULT_SIZES.get(part_type, (1, 1))
+    if part_type == 'wall':
+        width = _num(part.get('length'), default_width)
+        depth = _num(part.get('thickness'), default_depth)
+    else:
+        width = _num(part.get('width'), default_width)
+        depth = _num(part.get('depth'), default_depth)
+    return {
+        'part_type': part_type,
+        'x': _num(position.get('x')),
+        'z': _num(position.get('z')),
+        'rotation': _num(part.get('rotation')),
+        'width': width,
+        'depth': depth,
+        'height': _num(part.get('height'), 3),
+    }
+
+
+def part_footprint(part):
+    g = part_geometry(part)
+    return _rotated_bounds(g['x'], g['z'], g['width'] / 2, g['depth'] / 2, g['rotation'])
+
+
+def aisle_points(aisle):
+    return [(_num(p.get('x')), _num(p.get('z'))) for p in aisle.get('path') or [] if isinstance(p, dict)]
+
+
+def aisle_width(aisle):
+    return _num(aisle.get('width'), DEFAULT_AISLE_WIDTH)
+
+
+def aisle_footprint(aisle):
+    points = aisle_points(aisle)
+    if not points:
+        return None
+    half_width = aisle_width(aisle) / 2
+    xs = [p[0] for p in points]
+    zs = [p[1] for p in points]
+    return (min(xs) - half_width, max(xs) + half_width, min(zs) - half_width, max(zs) + half_width)
+
+
+def init_layout_schema(cursor):
+    """创建布局表与 R*Tree 空间索引"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS layout_meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS layout_shelves (
+            rid INTEGER PRIMARY KEY,
+            id TEXT UNIQUE NOT NULL,
+            seq INTEGER NOT NULL,
+            x REAL, y REAL, z REAL,
+            length REAL, height REAL, depth REAL,
+            rotation REAL DEFAULT 0,
+            data TEXT NOT NULL
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS layout_parts (
+            rid INTEGER PRIMARY KEY,
+            seq INTEGER UNIQUE NOT NULL,
+            part_type TEXT,
+            x REAL, z REAL,
+            rotation REAL DEFAULT 0,
+            width REAL, depth REAL, height REAL,
+            data TEXT NOT NULL
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS layout_aisles (
+            rid INTEGER PRIMARY KEY,
+            seq INTEGER UNIQUE NOT NULL,
+            width REAL,
+            data TEXT NOT NULL
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS layout_aisle_points (
+            aisle_rid INTEGER NOT NULL,
+            point_index INTEGER NOT NULL,
+            x REAL, z REAL,
+            PRIMARY KEY (aisle_rid, point_index)
+        )
+    ''')
+
+    for table in ('layout_shelves', 'layout_parts', 'layout_aisles'):
+        cursor.execute(f'''
+            CREATE VIRTUAL TABLE IF NOT EXISTS {table}_rtree
+            USING rtree(rid, min_x, max_x, min_z, max_z)
+        ''')
+
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_layout_shelves_seq ON layout_shelves(seq)')
+
+
+class LayoutDB:
+    """布局数据的数据库后端，由 ConfigStore 在加载和写回时调用"""
+
+    def __init__(self, connect):
+        self._connect = connect
+        # 每类对象已持久化的行：键 -> (seq, data)，用于增量写回
+        self._persisted = None
+
+    def load(self):
+        """读取布局；数据库尚未初始化（从未迁移）时返回 None"""
+        conn = self._connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT value FROM layout_meta WHERE key = 'initialized'")
+            if cursor.fetchone() is None:
+                return None
+
+            persisted = {kind: {} for kind in LAYOUT_KEYS}
+            layout = {}
+
+            cursor.execute('SELECT id, seq, data FROM layout_shelves ORDER BY seq')
+            rows = cursor.fetchall()
+            layout['shelves'] = [json.loads(row['data']) for row in rows]
+            persisted['shelves'] = {row['id']: (row['seq'], row['data']) for row in rows}
+
+            for kind in ('parts', 'aisles'):
+                cursor.execute(f'SELECT seq, data FROM layout_{kind} ORDER BY seq')
+                rows = cursor.fetchall()
+                layout[kind] = [json.loads(row['data']) for row in rows]
+                persisted[kind] = {row['seq']: (row['seq'], row['data']) for row in rows}
+
+            self._persisted = persisted
+            return layout
+        finally:
+            conn.close()
+
+    def migrate(self, config, config_path):
+        """把旧配置文件中的布局导入数据库，并保留一份原文件备份"""
+        if any(config.get(kind) for kind in LAYOUT_KEYS) and os.path.exists(config_path):
+            backup_path = config_path + '.bak'
+            if not os.path.exists(backup_path):
+                shutil.copy2(config_path, backup_path)
+
+        self._persisted = {kind: {} for kind in LAYOUT_KEYS}
+        self.sync(self.snapshot(config), initialize=True)
+
+    @staticmethod
+    def snapshot(config):
+        """在持有配置锁时调用：把布局序列化为 {类型: [(键, seq, data)]}"""
+        snapshot = {}
+        for kind in LAYOUT_KEYS:
+            rows = []
+            for seq, item in enumerate(config.get(kind) or []):
+                if not isinstance(item, dict):
+                    continue
+                key = item.get('id') if kind == 'shelves' else seq
+                if key is None:
+                    continue
+                data = json.dumps(item, ensure_ascii=False, separators=(',', ':'))
+                rows.append((key, seq, data))
+            snapshot[kind] = rows
+        return snapshot
+
+    def sync(self, snapshot, initialize=False, revision=None):
+        """把快照与已持久化的行比较，只写入变化的部分
+
+        写入的增量同时追加到变更日志（change_feed.py）；传入配置的 revision 时
+        另外记录一条 config 变更，即使布局本身没有变化。
+        """
+        persisted = self._persisted or {kind: {} for kind in LAYOUT_KEYS}
+        changes = {}
+        for kind in LAYOUT_KEYS:
+            current = {key: (seq, data) for key, seq, data in snapshot.get(kind, [])}
+            previous = persisted.get(kind, {})
+            upserts = [(key, seq, data) for key, (seq, data) in current.items() if previous.get(key) != (seq, data)]
+            deletes = [key for key in previous if key not in current]
+            changes[kind] = (current, upserts, deletes)
+
+        layout_changed = any(upserts or deletes for _, upserts, deletes in changes.values())
+        if not initialize and not layout_changed and revision is None:
+            return
+
+        conn = self._connect()
+        try:
+            cursor = conn.cursor()
+            self._sync_shelves(cursor, *changes['shelves'][1:])
+            self._sync_parts(cursor, *changes['parts'][1:])
+            self._sync_aisles(cursor, *changes['aisles'][1:])
+            if initialize:
+                cursor.execute("INSERT OR REPLACE INTO layout_meta (key, value) VALUES ('initialized', '1')")
+            else:
+                log = [(LAYOUT_CHANGE_KINDS[kind], 'upsert', str(key), data)
+                       for kind in LAYOUT_KEYS for key, _, data in changes[kind][1]]
+                log.extend((LAYOUT_CHANGE_KINDS[kind], 'delete', str(key), None)
+                           for kind in LAYOUT_KEYS for key in changes[kind][2])
+                if revision is not None:
+                    log.append(('config', 'update', None, json.dumps({"revision": revision})))
+                append_changes(cursor, log)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+        self._persisted = {kind: changes[kind][0] for kind in LAYOUT_KEYS}
+
+    def _sync_shelves(self, cursor, upserts, deletes):
+        for shelf_id in deletes:
+            cursor.execute('SELECT rid FROM layout_shelves WHERE id = ?', (shelf_id,))
+            row = cursor.fetchone()
+            if row:
+                cursor.execute('DELETE FROM layout_shelves_rtree WHERE rid = ?', (row['rid'],))
+                cursor.execute('DELETE FROM layout_shelves WHERE rid = ?', (row['rid'],))
+
+        for shelf_id, seq, data in upserts:
+            shelf = json.loads(data)
+            g = shelf_geometry(shelf)
+            cursor.execute('''
+                INSERT INTO layout_shelves (id, seq, x, y, z, length, height, depth, rotation, data)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET
+                    seq = excluded.seq, x = excluded.x, y = excluded.y, z = excluded.z,
+                    length = excluded.length, height = excluded.height, depth = excluded.depth,
+                    rotation = excluded.rotation, data = excluded.data
+            ''', (shelf_id, seq, g['x'], g['y'], g['z'], g['length'], g['height'], g['depth'], g['rotation'], data))
+            cursor.execute('SELECT rid FROM layout_shelves WHERE id = ?', (shelf_id,))
+            rid = cursor.fetchone()['rid']
+            cursor.execute('INSERT OR REPLACE INTO layout_shelves_rtree VALUES (?, ?, ?, ?, ?)',
+                           (rid, *shelf_footprint(shelf)))
+
+    def _sync_parts(self, cursor, upserts, deletes):
+        if deletes:
+            cursor.executemany('DELETE FROM layout_parts_rtree WHERE rid IN (SELECT rid FROM layout_parts WHERE seq = ?)',
+                               [(seq,) for seq in deletes])
+            cursor.executemany('DELETE FROM layout_parts WHERE seq = ?', [(seq,) for seq in deletes])
+
+        for _, seq, data in upserts:
+            part = json.loads(data)
+            g = part_geometry(part)
+            cursor.execute('''
+                INSERT INTO layout_parts (seq, part_type, x, z, rotation, width, depth, height, data)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(seq) DO UPDATE SET
+                    part_type = excluded.part_type, x = excluded.x, z = excluded.z,
+                    rotation = excluded.rotation, width = excluded.width, depth = excluded.depth,
+                    height = excluded.height, data = excluded.data
+            ''', (seq, g['part_type'], g['x'], g['z'], g['rotation'], g['width'], g['depth'], g['height'], data))
+            cursor.execute('SELECT rid FROM layout_parts WHERE seq = ?', (seq,))
+            rid = cursor.fetchone()['rid']
+            cursor.execute('INSERT OR REPLACE INTO layout_parts_rtree VALUES (?, ?, ?, ?, ?)',
+                           (rid, *part_footprint(part)))
+
+    def _sync_aisles(self, cursor, upserts, deletes):
+        for seq in deletes:
+            cursor.execute('SELECT rid FROM layout_aisles WHERE seq = ?', (seq,))
+            row = cursor.fetchone()
+            if row:
+                cursor.execute('DELETE FROM layout_aisles_rtree WHERE rid = ?', (row['rid'],))
+                cursor.execute('DELETE FROM layout_aisle_points WHERE aisle_rid = ?', (row['rid'],))
+                cursor.execute('DELETE FROM layout_aisles WHERE rid = ?', (row['rid'],))
+
+        for _, seq, data in upserts:
+            aisle = json.loads(data)
+            cursor.execute('''
+                INSERT INTO layout_aisles (seq, width, data) VALUES (?, ?, ?)
+                ON CONFLICT(seq) DO UPDATE SET width = excluded.width, data = excluded.data
+            ''', (seq, _num(aisle.get('width'), DEFAULT_AISLE_WIDTH), data))
+            cursor.execute('SELECT rid FROM layout_aisles WHERE seq = ?', (seq,))
+            rid = cursor.fetchone()['rid']
+
+            cursor.execute('DELETE FROM layout_aisle_points WHERE aisle_rid = ?', (rid,))
+            cursor.executemany('INSERT INTO layout_aisle_points (aisle_rid, point_index, x, z) VALUES (?, ?, ?, ?)',
+                               [(rid, i, x, z) for i, (x, z) in enumerate(aisle_points(aisle))])
+
+            cursor.execute('DELETE FROM layout_aisles_rtree WHERE rid = ?', (rid,))
+            bounds = aisle_footprint(aisle)
+            if bounds:
+                cursor.execute('INSERT INTO layout_aisles_rtree VALUES (?, ?, ?, ?, ?)', (rid, *bounds))
+
+    def query_region(self, min_x, max_x, min_z, max_z, kinds=LAYOUT_KEYS):
+        """查询占地矩形与给定区域相交的布局对象"""
+        conn = self._connect()
+        try:
+            cursor = conn.cursor()
+            result = {}
+            for kind in kinds:
+                cursor.execute(f'''
+                    SELECT t.data FROM layout_{kind}_rtree r
+                    JOIN layout_{kind} t ON t.rid = r.rid
+                    WHERE r.max_x >= ? AND r.min_x <= ? AND r.max_z >= ? AND r.min_z <= ?
+                    ORDER BY t.seq
+                ''', (min_x, max_x, min_z, max_z))
+                result[kind] = [json.loads(row['data']) for row in cursor.fetchall()]
+            return result
+        finally:
+            conn.close()
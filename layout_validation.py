@@ -0,0 +1,272 @@
+"""布局校验：货架、零件、库道之间的重叠与库道净宽检查
+
+所有对象都表示为地面上的旋转矩形：货架（深度沿本地 X、长度沿本地 Z）、零件（宽沿本地 X、深沿本地 Z），
+库道折线的每一段是以库道宽度为宽、沿路径方向的矩形。检查的规则：
+
+- overlap: 两个货架/零件的占地相交（墙与墙、墙与月台相接是正常的，不计）；
+- aisle_blocked: 货架或零件占用了库道（月台可以位于库道端头）；
+- aisle_width: 库道宽度小于 global_params.min_aisle_width（默认 DEFAULT_MIN_AISLE_WIDTH 米）。
+
+候选对用空间哈希生成：按外接矩形把对象登记到均匀网格中，排序后同一格内的对象两两成为候选，
+复杂度约为 O(n log n)；候选对再用分离轴定理（SAT）整批计算穿透深度，穿透不超过
+OVERLAP_TOLERANCE 的（例如背靠背摆放的货架）视为相接而非重叠。
+
+增量模式：与上一次校验的布局逐个对象比较几何参数，只重新检查发生变化的对象，
+两端都未变化的违规直接沿用上一次的结果。
+"""
+import math
+import threading
+
+import numpy as np
+
+from layout_db import LAYOUT_CHANGE_KINDS, aisle_points, aisle_width, part_geometry, shelf_geometry
+
+DEFAULT_MIN_AISLE_WIDTH = 1.2
+# 允许的穿透深度（米）
+OVERLAP_TOLERANCE = 0.01
+# 变化的对象超过这个比例时直接全量检查
+INCREMENTAL_RATIO = 0.5
+MIN_CELL_SIZE = 0.5
+MAX_CELL_SIZE = 50.0
+
+# 允许相交的对象类别（货架为 shelf，库道为 aisle，零件为其 partType）
+ALLOWED_OVERLAPS = {
+    frozenset(('wall',)),
+    frozenset(('wall', 'dock')),
+    frozenset(('aisle',)),
+    frozenset(('aisle', 'dock')),
+}
+
+_KEY_OFFSET = 1 << 30
+_KEY_SPAN = 1 << 31
+
+
+class Footprints:
+    """布局对象的占地矩形（列数组）；库道的每一段各占一行，owner 指向所属对象"""
+
+    def __init__(self, layout):
+        # 对象: (kind, key) -> 几何签名，用于增量比较
+        self.objects = {}
+        self.aisle_widths = {}
+        owner, category, rows = [], [], []
+
+        def add(obj, cat, x, z, half_x, half_z, rotation):
+            owner.append(obj)
+            category.append(cat)
+            rows.append((x, z, half_x, half_z, rotation))
+
+        object_keys = []
+        for kind in ('shelves', 'parts', 'aisles'):
+            for seq, item in enumerate(layout.get(kind) or []):
+                if not isinstance(item, dict):
+                    continue
+                key = item.get('id') if kind == 'shelves' else seq
+                if key is None:
+                    continue
+                obj = len(object_keys)
+                object_keys.append((LAYOUT_CHANGE_KINDS[kind], str(key)))
+                if kind == 'shelves':
+                    g = shelf_geometry(item)
+                    add(obj, 'shelf', g['x'], g['z'], g['depth'] / 2, g['length'] / 2, g['rotation'])
+                    signature = (g['x'], g['z'], g['depth'], g['length'], g['rotation'])
+                elif kind == 'parts':
+                    g = part_geometry(item)
+                    add(obj, g['part_type'], g['x'], g['z'], g['width'] / 2, g['depth'] / 2, g['rotation'])
+                    signature = (g['part_type'], g['x'], g['z'], g['width'], g['depth'], g['rotation'])
+                else:
+                    width = aisle_width(item)
+                    points = aisle_points(item)
+                    self.aisle_widths[obj] = width
+                    for (x0, z0), (x1, z1) in zip(points, points[1:]):
+                        length = math.hypot(x1 - x0, z1 - z0)
+                        if length > 0:
+                            add(obj, 'aisle', (x0 + x1) / 2, (z0 + z1) / 2, width / 2, length / 2,
+                                math.atan2(x1 - x0, z1 - z0))
+                    signature = (width, tuple(points))
+                self.objects[object_keys[-1]] = signature
+
+        self.keys = object_keys
+        self.owner = np.array(owner, dtype=np.int64)
+        self.categories = sorted(set(category))
+        self.category = np.array([self.categories.index(cat) for cat in category], dtype=np.int64)
+        data = np.array(rows, dtype=float).reshape(-1, 5)
+        self.x, self.z, self.half_x, self.half_z, self.rotation = data.T
+        cos, sin = np.abs(np.cos(self.rotation)), np.abs(np.sin(self.rotation))
+        extent_x = self.half_x * cos + self.half_z * sin
+        extent_z = self.half_x * sin + self.half_z * cos
+        self.bounds = (self.x - extent_x, self.x + extent_x, self.z - extent_z, self.z + extent_z)
+
+    def __len__(self):
+        return len(self.owner)
+
+    def allowed_matrix(self):
+        """allowed[i, j]: 类别 i 与类别 j 的对象是否允许相交"""
+        cats = self.categories
+        allowed = [[frozenset((a, b)) in ALLOWED_OVERLAPS for b in cats] for a in cats]
+        return np.array(allowed, dtype=bool).reshape(len(cats), len(cats))
+
+
+class SpatialHash:
+    """均匀网格上的空间哈希：每个矩形登记到它的外接矩形覆盖的所有格子中"""
+
+    def __init__(self, bounds, cell_size):
+        self.cell_size = cell_size
+        cells, items = self._expand(bounds)
+        order = np.lexsort((items, cells))
+        self.cells = cells[order]
+        self.items = items[order]
+
+    def _expand(self, bounds):
+        min_x, max_x, min_z, max_z = bounds
+        ix0, ix1 = np.floor(min_x / self.cell_size).astype(np.int64), np.floor(max_x / self.cell_size).astype(np.int64)
+        iz0, iz1 = np.floor(min_z / self.cell_size).astype(np.int64), np.floor(max_z / self.cell_size).astype(np.int64)
+        span_z = iz1 - iz0 + 1
+        counts = (ix1 - ix0 + 1) * span_z
+        items = np.repeat(np.arange(len(min_x)), counts)
+        offset = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        ix = ix0[items] + offset // span_z[items]
+        iz = iz0[items] + offset % span_z[items]
+        return (ix + _KEY_OFFSET) * _KEY_SPAN + (iz + _KEY_OFFSET), items
+
+    def pairs(self):
+        """同一格内的所有对象对 (i < j)，已去重"""
+        first, second = [], []
+        for k in range(1, len(self.cells)):
+            same = self.cells[:-k] == self.cells[k:]
+            if not same.any():
+                break
+            first.append(self.items[:-k][same])
+            second.append(self.items[k:][same])
+        return _unique_pairs(first, second)
+
+    def query(self, bounds, ids):
+        """与给定矩形（编号 ids）落在同一格内的对象，返回候选对 (ids 中的编号, 对象)"""
+        cells, queries = self._expand(bounds)
+        start = np.searchsorted(self.cells, cells, side='left')
+        end = np.searchsorted(self.cells, cells, side='right')
+        counts = end - start
+        query = np.repeat(queries, counts)
+        position = np.repeat(start - (np.cumsum(counts) - counts), counts) + np.arange(counts.sum())
+        return _unique_pairs([np.asarray(ids)[query]], [self.items[position]])
+
+
+def _unique_pairs(first, second):
+    if not first:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    a, b = np.concatenate(first), np.concatenate(second)
+    a, b = np.minimum(a, b), np.maximum(a, b)
+    keep = a != b
+    combined = np.unique(a[keep] * _KEY_SPAN + b[keep])
+    return combined // _KEY_SPAN, combined % _KEY_SPAN
+
+
+def cell_size_for(footprints):
+    """网格边长取货架/零件外接矩形边长的中位数的两倍，库道段可能很长，不参与计算"""
+    if len(footprints) == 0:
+        return MIN_CELL_SIZE
+    min_x, max_x, min_z, max_z = footprints.bounds
+    solid = np.array([footprints.keys[obj][0] != 'aisle' for obj in footprints.owner], dtype=bool)
+    extent = np.maximum(max_x - min_x, max_z - min_z)[solid]
+    size = 2 * float(np.median(extent)) if len(extent) else MAX_CELL_SIZE
+    return min(max(size, MIN_CELL_SIZE), MAX_CELL_SIZE)
+
+
+def penetration(footprints, i, j):
+    """旋转矩形对 (i, j) 的穿透深度（分离轴定理），不相交时不大于 0"""
+    f = footprints
+    cos_i, sin_i, cos_j, sin_j = np.cos(f.rotation[i]), np.sin(f.rotation[i]), np.cos(f.rotation[j]), np.sin(f.rotation[j])
+    # 本地 X、Z 轴在世界坐标中的方向
+    axes = [(cos_i, -sin_i), (sin_i, cos_i), (cos_j, -sin_j), (sin_j, cos_j)]
+    dx, dz = f.x[j] - f.x[i], f.z[j] - f.z[i]
+    depth = np.full(len(i), np.inf)
+    for nx, nz in axes:
+        radius_i = f.half_x[i] * np.abs(cos_i * nx - sin_i * nz) + f.half_z[i] * np.abs(sin_i * nx + cos_i * nz)
+        radius_j = f.half_x[j] * np.abs(cos_j * nx - sin_j * nz) + f.half_z[j] * np.abs(sin_j * nx + cos_j * nz)
+        np.minimum(depth, radius_i + radius_j - np.abs(dx * nx + dz * nz), out=depth)
+    return depth
+
+
+def check_pairs(footprints, i, j):
+    """精确检查候选对，返回 {(对象键, 对象键): (规则, 穿透深度)}，对象键为 (kind, id)"""
+    f = footprints
+    if len(i):
+        keep = ~f.allowed_matrix()[f.category[i], f.category[j]] & (f.owner[i] != f.owner[j])
+        # 外接矩形不相交的候选对不需要精确计算
+        min_x, max_x, min_z, max_z = f.bounds
+        keep &= (min_x[i] < max_x[j]) & (min_x[j] < max_x[i]) & (min_z[i] < max_z[j]) & (min_z[j] < max_z[i])
+        i, j = i[keep], j[keep]
+    depth = penetration(f, i, j)
+    hit = depth > OVERLAP_TOLERANCE
+
+    result = {}
+    for a, b, d in zip(f.owner[i[hit]].tolist(), f.owner[j[hit]].tolist(), depth[hit].tolist()):
+        pair = tuple(sorted((f.keys[a], f.keys[b])))
+        rule = 'aisle_blocked' if pair[0][0] == 'aisle' or pair[1][0] == 'aisle' else 'overlap'
+        # 同一对对象的多个矩形（库道的多段）只报告一次，取最大的穿透深度
+        if pair not in result or result[pair][1] < d:
+            result[pair] = (rule, d)
+    return result
+
+
+def _object(key):
+    return {"kind": key[0], "id": key[1]}
+
+
+class LayoutValidator:
+    """保存最近一次校验的布局与结果，下一次校验只重新检查发生变化的对象"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._objects = None
+        self._pairs = None
+
+    def validate(self, layout, min_aisle_width=DEFAULT_MIN_AISLE_WIDTH, full=False, commit=True):
+        """校验布局，返回 {violations, checked, incremental}
+
+        commit=False 时（例如校验尚未保存的布局）不更新保存的结果。
+        """
+        footprints = Footprints(layout)
+        with self._lock:
+            previous_objects, previous_pairs = self._objects, self._pairs
+            changed = None
+            if not full and previous_objects is not None:
+                changed = [obj for obj, key in enumerate(footprints.keys)
+                           if previous_objects.get(key) != footprints.objects[key]]
+                if len(changed) > INCREMENTAL_RATIO * len(footprints.keys):
+                    changed = None
+
+            if changed is None:
+                pairs = self._check_all(footprints)
+                checked = len(footprints.keys)
+            else:
+                changed_keys = {footprints.keys[obj] for obj in changed}
+                pairs = {pair: value for pair, value in previous_pairs.items()
+                         if pair[0] in footprints.objects and pair[1] in footprints.objects
+                         and pair[0] not in changed_keys and pair[1] not in changed_keys}
+                pairs.update(self._check_changed(footprints, changed))
+                checked = len(changed)
+
+            if commit:
+                self._objects, self._pairs = footprints.objects, pairs
+
+        violations = [{"type": rule, "objects": [_object(a), _object(b)], "depth": round(depth, 4)}
+                      for (a, b), (rule, depth) in sorted(pairs.items())]
+        violations.extend({"type": "aisle_width", "objects": [_object(footprints.keys[obj])],
+                           "width": width, "min_width": min_aisle_width}
+                          for obj, width in sorted(footprints.aisle_widths.items()) if width < min_aisle_width)
+        return {"violations": violations, "checked": checked, "incremental": changed is not None}
+
+    @staticmethod
+    def _check_all(footprints):
+        if len(footprints) == 0:
+            return {}
+        grid = SpatialHash(footprints.bounds, cell_size_for(footprints))
+        return check_pairs(footprints, *grid.pairs())
+
+    @staticmethod
+    def _check_changed(footprints, changed):
+        rows = np.nonzero(np.isin(footprints.owner, changed))[0]
+        if len(rows) == 0:
+            return {}
+        grid = SpatialHash(footprints.bounds, cell_size_for(footprints))
+        return check_pairs(footprints, *grid.query(tuple(b[rows] for b in footprints.bounds), rows))
@@ -0,0 +1,485 @@
+"""货位占用与容量分析
+
+货物按坐标映射到 (货架, 层, 格口)（与 slotting.py 的格口划分一致），在此基础上计算：
+
+- 体积占用率：格口内货物体积 / 格口可用容积（格口长度 × 可用深度 × 可用高度）；
+- 每层承重：每个（货架, 层）上的货物总重与承重上限之比；
+- 热力图：按地面网格汇总货物数、体积、重量、占用率或周转次数，可只统计某个 SKU；
+- 剩余容量直方图：格口占用率、格口剩余容积、每层承重比例的分布。
+
+cargos、skus 表在进程内以列数组缓存（OccupancyEngine），各格口的货物数、体积、重量也常驻内存。
+同步时读取 change_log（change_feed.py）中上次同步之后的变更，按 ID 重新读取变动的货物，
+只把这些货物从原格口减去、加到新格口；SKU 尺寸或重量变化时按列重新汇总，不重新读取货物；
+布局（配置 revision）变化时重新计算所有货物的格口。变更日志已被清理或积压过多时整体重新加载。
+
+货物周转次数取变更日志中该货物的新增与修改次数（只统计日志保留范围内的变更）。
+各分析结果按 (配置 revision, 变更日志 revision) 缓存。
+"""
+import threading
+
+import numpy as np
+
+from change_feed import latest_revision
+from slotting import DEFAULT_LAYER_LOAD, build_segments, cells_per_layer, locate_cargos
+from stacking import shelf_arrays
+from warehouse_stats import SKU_VOLUME, SKU_WEIGHT
+
+# 待应用的变更超过这个数时整体重新加载
+FULL_RELOAD_CHANGES = 20000
+LOOKUP_BATCH = 500
+DEFAULT_HEATMAP_RESOLUTION = 2.0
+MAX_HEATMAP_CELLS = 250000
+HEATMAP_METRICS = ('count', 'volume', 'weight', 'fill', 'velocity')
+DEFAULT_HISTOGRAM_BINS = 10
+MAX_HISTOGRAM_BINS = 100
+RESULT_CACHE_SIZE = 64
+
+
+class AnalyticsError(ValueError):
+    """查询参数无效"""
+
+
+def _grow(array, size, fill=0):
+    """容量不足时按倍数扩容"""
+    if len(array) >= size:
+        return array
+    grown = np.full(max(size, 2 * len(array), 1024), fill, dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+def _histogram(values, bins, value_range):
+    counts, edges = np.histogram(values, bins=bins, range=value_range)
+    return {"edges": [round(float(edge), 6) for edge in edges], "counts": counts.tolist()}
+
+
+class OccupancyEngine:
+    """进程内的占用分析缓存，所有方法线程安全"""
+
+    def __init__(self, connect):
+        self.connect = connect
+        self._lock = threading.Lock()
+        self.layout_revision = None
+        self.log_revision = None
+        self._results = {}
+        self._reset_columns()
+        self._set_layout([], 0, 0, DEFAULT_LAYER_LOAD)
+
+    def _reset_columns(self):
+        # 货物列：删除的行 ids[row] 为 None 并放入 _free 等待复用
+        self.ids = []
+        self.index = {}
+        self._free = []
+        self.x = np.zeros(0)
+        self.y = np.zeros(0)
+        self.z = np.zeros(0)
+        self.sku = np.zeros(0, dtype=np.int64)
+        self.moves = np.zeros(0)
+        self.alive = np.zeros(0, dtype=bool)
+        # 货物所在格口的扁平下标 (货架 * 层数 + 层) * 每层格口数 + 格口，不在格口中为 -1
+        self.key = np.zeros(0, dtype=np.int64)
+        self.volume = np.zeros(0)
+        self.weight = np.zeros(0)
+        # SKU 列
+        self.sku_ids = []
+        self.sku_index = {}
+        self.sku_volume = np.zeros(0)
+        self.sku_weight = np.zeros(0)
+
+    @property
+    def version(self):
+        return self.layout_revision, self.log_revision
+
+    # ---- 同步 ----
+
+    def sync(self, revision, load_layout):
+        """与配置和数据库同步，返回版本
+
+        revision 为当前配置 revision；与上次不同时调用 load_layout() 取得
+        (revision, 货架列表, 层数, 格口数, 每层承重)。
+        """
+        with self._lock:
+            conn = self.connect()
+            try:
+                cursor = conn.cursor()
+                latest = latest_revision(cursor)
+                if self.log_revision is None or latest < self.log_revision:
+                    self._reload(cursor, latest)
+                elif latest > self.log_revision:
+                    cursor.execute('SELECT MIN(revision) AS revision FROM change_log')
+                    oldest = cursor.fetchone()['revision'] or 0
+                    if oldest > self.log_revision + 1 or latest - self.log_revision > FULL_RELOAD_CHANGES:
+                        self._reload(cursor, latest)
+                    else:
+                        self._apply_changes(cursor, latest)
+            finally:
+                conn.close()
+
+            if revision != self.layout_revision:
+                self.layout_revision, shelves, layer_count, cell_count, layer_load = load_layout()
+                self._set_layout(shelves, layer_count, cell_count, layer_load)
+                self._locate(np.nonzero(self.alive)[0])
+                self._regroup()
+            return self.version
+
+    def _reload(self, cursor, latest):
+        self._reset_columns()
+        self._load_skus(cursor, None)
+        cursor.execute('SELECT id, sku_id, x, y, z FROM cargos')
+        self._upsert_rows(cursor.fetchall())
+        cursor.execute('''
+            SELECT entity_id, COUNT(*) AS moves FROM change_log
+            WHERE kind = 'cargo' AND op != 'delete' AND revision <= ?
+            GROUP BY entity_id
+        ''', (latest,))
+        for row in cursor.fetchall():
+            position = self.index.get(row['entity_id'])
+            if position is not None:
+                self.moves[position] = row['moves']
+        self._derive(np.nonzero(self.alive)[0])
+        self._locate(np.nonzero(self.alive)[0])
+        self._regroup()
+        self.log_revision = latest
+
+    def _apply_changes(self, cursor, latest):
+        cursor.execute('''
+            SELECT kind, op, entity_id FROM change_log
+            WHERE revision > ? AND revision <= ? AND kind IN ('cargo', 'sku')
+            ORDER BY revision
+        ''', (self.log_revision, latest))
+        cargo_ids, sku_ids, moved = set(), set(), []
+        for row in cursor.fetchall():
+            if row['kind'] == 'sku':
+                sku_ids.add(row['entity_id'])
+            else:
+                cargo_ids.add(row['entity_id'])
+                if row['op'] != 'delete':
+                    moved.append(row['entity_id'])
+
+        if sku_ids:
+            self._load_skus(cursor, sku_ids)
+        if cargo_ids:
+            self._update_cargos(cursor, cargo_ids)
+        for cargo_id in moved:
+            position = self.index.get(cargo_id)
+            if position is not None:
+                self.moves[position] += 1
+        if sku_ids:
+            # SKU 尺寸或重量变化影响它的所有货物，按列重新汇总
+            self._derive(np.nonzero(self.alive)[0])
+            self._regroup()
+        self.log_revision = latest
+
+    def _load_skus(self, cursor, sku_ids):
+        """读取全部（sku_ids 为 None）或指定 SKU 的单件体积和重量，已删除的 SKU 记为 0"""
+        query = f"SELECT id, {SKU_VOLUME.format(s='skus')} AS volume, {SKU_WEIGHT.format(s='skus')} AS weight FROM skus"
+        if sku_ids is None:
+            cursor.execute(query)
+            rows = cursor.fetchall()
+        else:
+            sku_ids = list(sku_ids)
+            rows = []
+            for start in range(0, len(sku_ids), LOOKUP_BATCH):
+                chunk = sku_ids[start:start + LOOKUP_BATCH]
+                cursor.execute(f"{query} WHERE id IN ({', '.join('?' * len(chunk))})", chunk)
+                rows.extend(cursor.fetchall())
+            found = {row['id'] for row in rows}
+            for sku_id in sku_ids:
+                if sku_id not in found and sku_id in self.sku_index:
+                    position = self.sku_index[sku_id]
+                    self.sku_volume[position] = self.sku_weight[position] = 0
+
+        for row in rows:
+            position = self.sku_index.get(row['id'])
+            if position is None:
+                position = self.sku_index[row['id']] = len(self.sku_ids)
+                self.sku_ids.append(row['id'])
+                self.sku_volume = _grow(self.sku_volume, position + 1)
+                self.sku_weight = _grow(self.sku_weight, position + 1)
+            self.sku_volume[position] = row['volume']
+            self.sku_weight[position] = row['weight']
+
+    def _sku_position(self, sku_id):
+        position = self.sku_index.get(sku_id)
+        if position is None:
+            # 引用了不存在的 SKU：登记一个体积、重量为 0 的占位
+            position = self.sku_index[sku_id] = len(self.sku_ids)
+            self.sku_ids.append(sku_id)
+            self.sku_volume = _grow(self.sku_volume, position + 1)
+            self.sku_weight = _grow(self.sku_weight, position + 1)
+        return position
+
+    def _upsert_rows(self, rows):
+        """写入货物行，返回写入的行号"""
+        positions = []
+        for row in rows:
+            position = self.index.get(row['id'])
+            if position is None:
+                position = self._free.pop() if self._free else len(self.ids)
+                if position == len(self.ids):
+                    self.ids.append(None)
+                self.ids[position] = row['id']
+                self.index[row['id']] = position
+            positions.append(position)
+
+        size = len(self.ids)
+        for name in ('x', 'y', 'z', 'moves', 'volume', 'weight'):
+            setattr(self, name, _grow(getattr(self, name), size))
+        self.sku = _grow(self.sku, size, -1)
+        self.key = _grow(self.key, size, -1)
+        self.alive = _grow(self.alive, size, False)
+
+        positions = np.array(positions, dtype=np.int64)
+        self.x[positions] = [row['x'] or 0 for row in rows]
+        self.y[positions] = [row['y'] or 0 for row in rows]
+        self.z[positions] = [row['z'] or 0 for row in rows]
+        self.sku[positions] = [self._sku_position(row['sku_id']) for row in rows]
+        self.alive[positions] = True
+        return positions
+
+    def _update_cargos(self, cursor, cargo_ids):
+        """重新读取变动的货物：先从原格口减去，更新后再加到新格口"""
+        cargo_ids = list(cargo_ids)
+        rows = []
+        for start in range(0, len(cargo_ids), LOOKUP_BATCH):
+            chunk = cargo_ids[start:start + LOOKUP_BATCH]
+            cursor.execute(f"SELECT id, sku_id, x, y, z FROM cargos WHERE id IN ({', '.join('?' * len(chunk))})", chunk)
+            rows.extend(cursor.fetchall())
+
+        existing = np.array([self.index[cargo_id] for cargo_id in cargo_ids if cargo_id in self.index], dtype=np.int64)
+        self._accumulate(existing, -1)
+
+        found = {row['id'] for row in rows}
+        for cargo_id in cargo_ids:
+            position = self.index.get(cargo_id)
+            if cargo_id not in found and position is not None:
+                del self.index[cargo_id]
+                self.ids[position] = None
+                self._free.append(position)
+                self.alive[position] = False
+                self.key[position] = -1
+                self.moves[position] = 0
+
+        positions = self._upsert_rows(rows)
+        self._derive(positions)
+        self._locate(positions)
+        self._accumulate(positions, 1)
+
+    def _derive(self, positions):
+        self.volume[positions] = self.sku_volume[self.sku[positions]]
+        self.weight[positions] = self.sku_weight[self.sku[positions]]
+
+    # ---- 布局与格口 ----
+
+    def _set_layout(self, shelves, layer_count, cell_count, layer_load):
+        self.shelves = shelves
+        self.layer_count = layer_count
+        self.per_layer = cells_per_layer(layer_count, cell_count)
+        self.layer_load = layer_load
+        self.cell_total = len(shelves) * layer_count * self.per_layer
+        segments = build_segments(shelves, layer_count, cell_count) if self.cell_total else None
+        if segments is None:
+            self.capacity = np.zeros(0)
+            self.cell_x = self.cell_z = np.zeros(0)
+            self.geometry = []
+            return
+        self.geometry = segments['geometry']
+        self.capacity = segments['cell_length'] * segments['depth'] * segments['clearance']
+        # 格口中心的地面坐标，用于占用率热力图
+        along = segments['start'] + segments['cell_length'] / 2
+        shelf = segments['shelf']
+        rotation = np.array([g['rotation'] for g in self.geometry], dtype=float)[shelf]
+        self.cell_x = np.array([g['x'] for g in self.geometry], dtype=float)[shelf] + along * np.sin(rotation)
+        self.cell_z = np.array([g['z'] for g in self.geometry], dtype=float)[shelf] + along * np.cos(rotation)
+
+    def _locate(self, positions):
+        if self.cell_total == 0:
+            self.key[positions] = -1
+            return
+        owner, layer, cell = locate_cargos(self.shelves, self.layer_count, self.per_layer, self.x[positions],
+                                           self.y[positions], self.z[positions], self.geometry)
+        self.key[positions] = np.where(owner >= 0, (owner * self.layer_count + layer) * self.per_layer + cell, -1)
+
+    def _regroup(self):
+        placed = self.alive[:len(self.ids)] & (self.key[:len(self.ids)] >= 0)
+        keys = self.key[:len(self.ids)][placed]
+        self.cell_count = np.bincount(keys, minlength=self.cell_total).astype(float)
+        self.cell_volume = np.bincount(keys, weights=self.volume[:len(self.ids)][placed], minlength=self.cell_total)
+        self.cell_weight = np.bincount(keys, weights=self.weight[:len(self.ids)][placed], minlength=self.cell_total)
+        self._results.clear()
+
+    def _accumulate(self, positions, sign):
+        positions = positions[self.key[positions] >= 0]
+        keys = self.key[positions]
+        np.add.at(self.cell_count, keys, sign)
+        np.add.at(self.cell_volume, keys, sign * self.volume[positions])
+        np.add.at(self.cell_weight, keys, sign * self.weight[positions])
+        self._results.clear()
+
+    # ---- 分析结果 ----
+
+    def _cached(self, key, compute):
+        with self._lock:
+            if key not in self._results:
+                if len(self._results) >= RESULT_CACHE_SIZE:
+                    self._results.clear()
+                self._results[key] = compute()
+            return self._results[key]
+
+    def _grids(self):
+        """(货架, 层, 格口) 形状的货物数、体积、重量、容积"""
+        shape = (len(self.shelves), self.layer_count, self.per_layer)
+        return (self.cell_count.reshape(shape), self.cell_volume.reshape(shape),
+                self.cell_weight.reshape(shape), self.capacity.reshape(shape))
+
+    def occupancy(self, detail=None):
+        """占用概况；detail 为 shelves / layers / cells 时附带按货架、层、格口的明细"""
+        return self._cached(('occupancy', detail), lambda: self._occupancy(detail))
+
+    def _occupancy(self, detail):
+        count, volume, weight, capacity = self._grids()
+        alive = self.alive[:len(self.ids)]
+        layer_weight = weight.sum(axis=2)
+        total_capacity = float(capacity.sum())
+        occupied = int(np.count_nonzero(count > 0))
+        result = {
+            "shelf_count": len(self.shelves),
+            "layer_count": self.layer_count,
+            "cells_per_layer": self.per_layer,
+            "total_cells": self.cell_total,
+            "occupied_cells": occupied,
+            "free_cells": self.cell_total - occupied,
+            "cargo_count": int(np.count_nonzero(alive)),
+            "placed_cargo_count": int(count.sum()),
+            "capacity_volume": round(total_capacity, 6),
+            "cargo_volume": round(float(volume.sum()), 6),
+            "cargo_weight": round(float(weight.sum()), 6),
+            "fill": round(float(volume.sum()) / total_capacity, 6) if total_capacity > 0 else 0.0,
+            "layer_load_limit": self.layer_load,
+            "overloaded_layers": int(np.count_nonzero(layer_weight > self.layer_load)),
+        }
+        if detail not in ('shelves', 'layers', 'cells'):
+            return result
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            shelf_fill = np.nan_to_num(volume.sum(axis=(1, 2)) / capacity.sum(axis=(1, 2)))
+            layer_fill = np.nan_to_num(volume.sum(axis=2) / capacity.sum(axis=2))
+            cell_fill = np.nan_to_num(volume / capacity)
+        load = layer_weight / self.layer_load if self.layer_load > 0 else np.zeros_like(layer_weight)
+        shelves = []
+        for s, shelf in enumerate(self.shelves):
+            entry = {
+                "id": shelf.get('id'),
+                "cargo_count": int(count[s].sum()),
+                "occupied_cells": int(np.count_nonzero(count[s] > 0)),
+                "fill": round(float(shelf_fill[s]), 6),
+                "cargo_weight": round(float(weight[s].sum()), 6),
+                "max_layer_load": round(float(load[s].max()), 6) if self.layer_count else 0.0,
+            }
+            if detail in ('layers', 'cells'):
+                entry["layers"] = [{
+                    "layer": layer,
+                    "cargo_count": int(count[s, layer].sum()),
+                    "fill": round(float(layer_fill[s, layer]), 6),
+                    "cargo_weight": round(float(layer_weight[s, layer]), 6),
+                    "load": round(float(load[s, layer]), 6),
+                } for layer in range(self.layer_count)]
+            if detail == 'cells':
+                entry["cells"] = {"count": count[s].astype(int).tolist(), "fill": np.round(cell_fill[s], 4).tolist()}
+            shelves.append(entry)
+        result["shelves"] = shelves
+        return result
+
+    def heatmap(self, metric='count', resolution=DEFAULT_HEATMAP_RESOLUTION, sku_id=None):
+        """地面网格热力图，values[行][列]，行沿 Z、列沿 X；sku_id 只统计该 SKU 的货物（fill 除外）"""
+        if metric not in HEATMAP_METRICS:
+            raise AnalyticsError(f"metric 必须是 {', '.join(HEATMAP_METRICS)} 之一")
+        if not resolution > 0:
+            raise AnalyticsError("resolution 必须大于 0")
+        return self._cached(('heatmap', metric, resolution, sku_id), lambda: self._heatmap(metric, resolution, sku_id))
+
+    def _heatmap(self, metric, resolution, sku_id):
+        live = np.nonzero(self.alive[:len(self.ids)])[0]
+        if sku_id is not None and metric != 'fill':
+            position = self.sku_index.get(sku_id)
+            live = live[self.sku[live] == position] if position is not None else live[:0]
+
+        xs = [self.x[live], self.cell_x]
+        zs = [self.z[live], self.cell_z]
+        if self.shelves:
+            bounds = shelf_arrays(self.shelves)
+            xs += [bounds['min_x'], bounds['max_x']]
+            zs += [bounds['min_z'], bounds['max_z']]
+        all_x, all_z = np.concatenate(xs), np.concatenate(zs)
+        if len(all_x) == 0:
+            return {"metric": metric, "origin": {"x": 0.0, "z": 0.0}, "resolution": resolution,
+                    "columns": 0, "rows": 0, "max": 0.0, "values": []}
+
+        origin_x = float(np.floor(all_x.min() / resolution) * resolution)
+        origin_z = float(np.floor(all_z.min() / resolution) * resolution)
+        columns = int((all_x.max() - origin_x) // resolution) + 1
+        rows = int((all_z.max() - origin_z) // resolution) + 1
+        if columns * rows > MAX_HEATMAP_CELLS:
+            raise AnalyticsError(f"网格过大（{columns} x {rows}），请增大 resolution")
+
+        def bins(x, z, weights=None):
+            index = (np.floor((z - origin_z) / resolution).astype(np.int64) * columns
+                     + np.floor((x - origin_x) / resolution).astype(np.int64))
+            return np.bincount(index, weights=weights, minlength=columns * rows).astype(float)
+
+        if metric == 'fill':
+            capacity = bins(self.cell_x, self.cell_z, self.capacity)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                values = np.nan_to_num(bins(self.cell_x, self.cell_z, self.cell_volume) / capacity)
+        else:
+            weights = {'count': None, 'volume': self.volume, 'weight': self.weight, 'velocity': self.moves}[metric]
+            values = bins(self.x[live], self.z[live], None if weights is None else weights[live])
+
+        values = values.reshape(rows, columns)
+        return {
+            "metric": metric,
+            "origin": {"x": origin_x, "z": origin_z},
+            "resolution": resolution,
+            "columns": columns,
+            "rows": rows,
+            "max": round(float(values.max()), 6),
+            "values": np.round(values, 4).tolist(),
+        }
+
+    def histogram(self, bins=DEFAULT_HISTOGRAM_BINS):
+        """格口占用率、格口剩余容积、每层承重比例的分布；占用率、承重超过 1 的计入最后一档"""
+        if not 1 <= bins <= MAX_HISTOGRAM_BINS:
+            raise AnalyticsError(f"bins 必须在 1 到 {MAX_HISTOGRAM_BINS} 之间")
+        return self._cached(('histogram', bins), lambda: self._histogram(bins))
+
+    def _histogram(self, bins):
+        _, volume, weight, capacity = self._grids()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fill = np.nan_to_num(volume / capacity).reshape(-1)
+        free = np.maximum(capacity - volume, 0).reshape(-1)
+        load = (weight.sum(axis=2) / self.layer_load).reshape(-1) if self.layer_load > 0 else np.zeros(0)
+        return {
+            "bins": bins,
+            "cell_fill": _histogram(np.minimum(fill, 1), bins, (0, 1)),
+            "free_volume": _histogram(free, bins, (0, float(free.max()) if len(free) and free.max() > 0 else 1)),
+            "layer_load": _histogram(np.minimum(load, 1), bins, (0, 1)),
+            "overloaded_layers": int(np.count_nonzero(load > 1)),
+        }
+
+    def sku_velocity(self, limit=50):
+        """按周转次数排序的 SKU：货物数、周转次数、每件货物的平均周转次数"""
+        return self._cached(('velocity', limit), lambda: self._sku_velocity(limit))
+
+    def _sku_velocity(self, limit):
+        live = np.nonzero(self.alive[:len(self.ids)])[0]
+        sku = self.sku[live]
+        cargo_count = np.bincount(sku, minlength=len(self.sku_ids))
+        moves = np.bincount(sku, weights=self.moves[live], minlength=len(self.sku_ids))
+        used = np.nonzero(cargo_count)[0]
+        order = used[np.lexsort((-cargo_count[used], -moves[used]))][:limit]
+        return [{
+            "sku_id": self.sku_ids[i],
+            "cargo_count": int(cargo_count[i]),
+            "moves": int(moves[i]),
+            "velocity": round(float(moves[i]) / cargo_count[i], 4),
+        } for i in order.tolist()]
@@ -0,0 +1,56 @@
+"""跨进程文件锁
+
+多个 worker 进程（gunicorn -w N）共享同一份配置文件和数据库，初始化数据库、
+修改配置等“读-改-写”操作需要在进程之间互斥。ProcessLock 基于 flock，
+同一进程内的线程之间通过 RLock 互斥，同一线程可以重入。
+
+每次加锁都重新打开锁文件：flock 绑定在打开的文件描述上，
+fork 出的子进程不会继承父进程持有的锁。
+"""
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+class ProcessLock:
+    """可重入的跨进程互斥锁，用法: with lock: ..."""
+
+    def __init__(self, path):
+        if fcntl is None:
+            raise RuntimeError("当前平台不支持跨进程文件锁（需要 fcntl），只能以单进程方式运行")
+        self.path = path
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def __enter__(self):
+        self._lock.acquire()
+        if self._depth == 0:
+            try:
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                except BaseException:
+                    os.close(fd)
+                    raise
+            except BaseException:
+                self._lock.release()
+                raise
+            self._fd = fd
+        self._depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._depth -= 1
+        if self._depth == 0:
+            fd, self._fd = self._fd, None
+            try:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            finally:
+                os.close(fd)
+        self._lock.release()
+        return False
@@ -0,0 +1,353 @@
+"""拣货路径与行走距离
+
+库道（配置 aisles，每条为折线 path + 宽度 width）编译为无向图：折线顶点为节点，
+相邻顶点之间为边；不同库道相交处、以及库道端点伸入另一条库道（T 形路口）处切分线段并连通。
+节点数不超过 ALL_PAIRS_LIMIT 时用 NumPy 的 Floyd-Warshall 预先计算全部节点之间的最短距离，
+更大的图按需对起点做 Dijkstra 并缓存结果。编译结果按库道内容缓存，只有库道变化时才重新编译。
+
+拣货点（货物或任意坐标）先移到所在货架靠近它的长边（取货面），再垂直投影到最近的库道边上；
+两点之间的行走距离 = 各自到库道的距离 + 经由库道的最短距离。
+
+每张拣货单从起点（depot）出发，用最近邻构造初始顺序，再用 2-opt 改进（每一步用 NumPy
+一次计算与所有候选交换的收益）。同一批拣货单的拣货点一起计算距离。
+"""
+import heapq
+import json
+import math
+import threading
+import time
+
+import numpy as np
+
+from layout_db import DEFAULT_AISLE_WIDTH, aisle_points, shelf_geometry
+from stacking import containing_shelf, shelf_arrays
+
+ALL_PAIRS_LIMIT = 800
+# 按需计算时缓存的最短距离行数
+DIJKSTRA_CACHE_SIZE = 4096
+# 坐标相差小于该值的节点视为同一个节点（米）
+NODE_TOLERANCE = 1e-3
+# 库道端点与另一条库道中心线的距离不超过其半宽加该值时视为连通
+JUNCTION_TOLERANCE = 0.25
+# 2-opt 的最大轮数与单张拣货单的时间上限（秒）
+TWO_OPT_MAX_PASSES = 50
+TWO_OPT_TIME_LIMIT = 2.0
+# 拣货点与库道的距离计算中每批处理的点数
+SNAP_BATCH = 256
+
+EPSILON = 1e-9
+
+
+class RoutingError(ValueError):
+    """请求无效或库道图无法满足请求"""
+
+
+def aisle_fingerprint(aisles):
+    return json.dumps(aisles or [], sort_keys=True, ensure_ascii=False)
+
+
+def _segments(aisles):
+    """库道折线拆分为线段，返回 (起点数组, 终点数组, 半宽数组, 是否为折线首/末段)"""
+    starts, ends, half_widths, first, last = [], [], [], [], []
+    for aisle in aisles or []:
+        if not isinstance(aisle, dict):
+            continue
+        points = aisle_points(aisle)
+        half_width = float(aisle.get('width') or DEFAULT_AISLE_WIDTH) / 2
+        pairs = [(a, b) for a, b in zip(points, points[1:]) if a != b]
+        for k, (a, b) in enumerate(pairs):
+            starts.append(a)
+            ends.append(b)
+            half_widths.append(half_width)
+            first.append(k == 0)
+            last.append(k == len(pairs) - 1)
+    return (np.array(starts, dtype=float).reshape(-1, 2), np.array(ends, dtype=float).reshape(-1, 2),
+            np.array(half_widths, dtype=float), np.array(first, dtype=bool), np.array(last, dtype=bool))
+
+
+def project(points, starts, ends):
+    """点到每条线段的最近点：返回 (距离, 参数 t) 两个 [点数, 线段数] 数组"""
+    direction = ends - starts
+    length_sq = np.maximum((direction ** 2).sum(axis=1), EPSILON)
+    offset = points[:, None, :] - starts[None, :, :]
+    t = np.clip((offset * direction[None, :, :]).sum(axis=2) / length_sq, 0.0, 1.0)
+    nearest = starts[None, :, :] + t[:, :, None] * direction[None, :, :]
+    return np.sqrt(((points[:, None, :] - nearest) ** 2).sum(axis=2)), t
+
+
+def _crossings(starts, ends):
+    """两两相交的线段，返回 [(线段 i, t_i, 线段 j, t_j)]"""
+    result = []
+    count = len(starts)
+    direction = ends - starts
+    for i in range(count - 1):
+        p, r = starts[i], direction[i]
+        q, s = starts[i + 1:], direction[i + 1:]
+        denom = r[0] * s[:, 1] - r[1] * s[:, 0]
+        qp = q - p
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = (qp[:, 0] * s[:, 1] - qp[:, 1] * s[:, 0]) / denom
+            u = (qp[:, 0] * r[1] - qp[:, 1] * r[0]) / denom
+        hit = (np.abs(denom) > EPSILON) & (t >= -EPSILON) & (t <= 1 + EPSILON) & (u >= -EPSILON) & (u <= 1 + EPSILON)
+        for k in np.nonzero(hit)[0]:
+            result.append((i, float(np.clip(t[k], 0, 1)), i + 1 + int(k), float(np.clip(u[k], 0, 1))))
+    return result
+
+
+class AisleGraph:
+    """编译后的库道图"""
+
+    def __init__(self, aisles):
+        starts, ends, half_widths, first, last = _segments(aisles)
+        self.fingerprint = aisle_fingerprint(aisles)
+        splits = [{0.0, 1.0} for _ in range(len(starts))]
+        connectors = []
+
+        for i, ti, j, tj in _crossings(starts, ends):
+            splits[i].add(ti)
+            splits[j].add(tj)
+
+        # T 形路口：折线首尾端点落在另一条库道范围内时，在投影处切分并用一条边连接
+        if len(starts):
+            endpoints = [(starts[k], k, 0.0) for k in np.nonzero(first)[0]] + \
+                        [(ends[k], k, 1.0) for k in np.nonzero(last)[0]]
+            points = np.array([point for point, _, _ in endpoints], dtype=float).reshape(-1, 2)
+            distance, t = project(points, starts, ends)
+            for row, (point, own, own_t) in enumerate(endpoints):
+                distance[row, own] = np.inf
+                reach = half_widths + JUNCTION_TOLERANCE
+                candidates = np.nonzero(distance[row] <= reach)[0]
+                if len(candidates) == 0:
+                    continue
+                k = int(candidates[np.argmin(distance[row, candidates])])
+                splits[k].add(float(t[row, k]))
+                if distance[row, k] > NODE_TOLERANCE:
+                    connectors.append((own, own_t, k, float(t[row, k])))
+
+        self._node_ids = {}
+        self.nodes = []
+        adjacency = {}
+
+        def node(point):
+            key = (round(point[0] / NODE_TOLERANCE), round(point[1] / NODE_TOLERANCE))
+            if key not in self._node_ids:
+                self._node_ids[key] = len(self.nodes)
+                self.nodes.append((float(point[0]), float(point[1])))
+            return self._node_ids[key]
+
+        def connect(a, b, weight):
+            if a != b and weight < adjacency.setdefault(a, {}).get(b, np.inf):
+                adjacency[a][b] = weight
+                adjacency.setdefault(b, {})[a] = weight
+
+        # 切分后的每一小段是图的一条边，edge_a/edge_b 为其两端节点，用于把拣货点接入图中
+        edge_a, edge_b = [], []
+        for k, values in enumerate(splits):
+            ts = sorted(values)
+            length = float(np.hypot(*(ends[k] - starts[k])))
+            ids = [node(starts[k] + t * (ends[k] - starts[k])) for t in ts]
+            for (t0, a), (t1, b) in zip(zip(ts, ids), zip(ts[1:], ids[1:])):
+                if t1 - t0 <= EPSILON:
+                    continue
+                connect(a, b, (t1 - t0) * length)
+                edge_a.append(a)
+                edge_b.append(b)
+
+        for own, own_t, k, t in connectors:
+            a = node(starts[own] + own_t * (ends[own] - starts[own]))
+            b = node(starts[k] + t * (ends[k] - starts[k]))
+            connect(a, b, float(np.hypot(*(np.array(self.nodes[a]) - np.array(self.nodes[b])))))
+
+        self.adjacency = adjacency
+        nodes = np.array(self.nodes, dtype=float).reshape(-1, 2)
+        self.edge_a = np.array(edge_a, dtype=np.int64)
+        self.edge_b = np.array(edge_b, dtype=np.int64)
+        self.edge_start = nodes[self.edge_a] if len(edge_a) else np.zeros((0, 2))
+        self.edge_end = nodes[self.edge_b] if len(edge_b) else np.zeros((0, 2))
+        self.edge_length = np.hypot(*(self.edge_end - self.edge_start).T) if len(edge_a) else np.zeros(0)
+
+        self._lock = threading.Lock()
+        self._rows = {}
+        self.all_pairs = self._floyd_warshall() if len(self.nodes) <= ALL_PAIRS_LIMIT else None
+
+    @property
+    def node_count(self):
+        return len(self.nodes)
+
+    @property
+    def edge_count(self):
+        return sum(len(neighbors) for neighbors in self.adjacency.values()) // 2
+
+    def _floyd_warshall(self):
+        count = len(self.nodes)
+        dist = np.full((count, count), np.inf)
+        np.fill_diagonal(dist, 0.0)
+        for a, neighbors in self.adjacency.items():
+            for b, weight in neighbors.items():
+                dist[a, b] = weight
+        for k in range(count):
+            np.minimum(dist, dist[:, k, None] + dist[None, k, :], out=dist)
+        return dist
+
+    def _dijkstra(self, source):
+        dist = np.full(len(self.nodes), np.inf)
+        dist[source] = 0.0
+        heap = [(0.0, source)]
+        while heap:
+            d, a = heapq.heappop(heap)
+            if d > dist[a]:
+                continue
+            for b, weight in self.adjacency.get(a, {}).items():
+                nd = d + weight
+                if nd < dist[b]:
+                    dist[b] = nd
+                    heapq.heappush(heap, (nd, b))
+        return dist
+
+    def distances(self, sources, targets):
+        """节点之间的最短距离矩阵 [len(sources), len(targets)]"""
+        sources, targets = np.asarray(sources, dtype=np.int64), np.asarray(targets, dtype=np.int64)
+        if self.all_pairs is not None:
+            return self.all_pairs[np.ix_(sources, targets)]
+        rows = []
+        for source in sources.tolist():
+            with self._lock:
+                row = self._rows.get(source)
+            if row is None:
+                row = self._dijkstra(source)
+                with self._lock:
+                    if len(self._rows) >= DIJKSTRA_CACHE_SIZE:
+                        self._rows.pop(next(iter(self._rows)))
+                    self._rows[source] = row
+            rows.append(row[targets])
+        return np.array(rows).reshape(len(sources), len(targets))
+
+    def snap(self, points):
+        """每个点在图上的接入位置：(所在边下标, 点到边的距离, 接入点到边起点的长度)"""
+        if len(self.edge_length) == 0:
+            raise RoutingError("没有可用的库道")
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        edge = np.zeros(len(points), dtype=np.int64)
+        offset = np.zeros(len(points))
+        along = np.zeros(len(points))
+        for start in range(0, len(points), SNAP_BATCH):
+            chunk = slice(start, start + SNAP_BATCH)
+            distance, t = project(points[chunk], self.edge_start, self.edge_end)
+            nearest = distance.argmin(axis=1)
+            rows = np.arange(len(nearest))
+            edge[chunk] = nearest
+            offset[chunk] = distance[rows, nearest]
+            along[chunk] = t[rows, nearest] * self.edge_length[nearest]
+        return edge, offset, along
+
+    def point_distances(self, points):
+        """任意点之间经由库道的行走距离矩阵，不连通时为 inf"""
+        edge, offset, along = self.snap(points)
+        # 从接入点走到所在边两端节点的代价
+        costs = np.stack([offset + along, offset + self.edge_length[edge] - along], axis=1)
+        ends = np.stack([self.edge_a[edge], self.edge_b[edge]], axis=1)
+        unique, inverse = np.unique(ends.reshape(-1), return_inverse=True)
+        inverse = inverse.reshape(-1, 2)
+        between = self.distances(unique, unique)
+
+        result = np.full((len(edge), len(edge)), np.inf)
+        for p in range(2):
+            for q in range(2):
+                candidate = costs[:, p, None] + between[np.ix_(inverse[:, p], inverse[:, q])] + costs[None, :, q]
+                np.minimum(result, candidate, out=result)
+
+        # 同一条边上的两个点可以直接沿边走
+        same = edge[:, None] == edge[None, :]
+        direct = offset[:, None] + np.abs(along[:, None] - along[None, :]) + offset[None, :]
+        result = np.where(same, np.minimum(result, direct), result)
+        np.fill_diagonal(result, 0.0)
+        return result
+
+
+class RouteCache:
+    """按库道内容缓存编译好的图：配置 revision 相同时直接复用，revision 变化但库道未变时也复用"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._revision = None
+        self._graph = None
+
+    def get(self, revision, aisles):
+        with self._lock:
+            if self._graph is not None and self._revision == revision:
+                return self._graph
+            fingerprint = aisle_fingerprint(aisles)
+            if self._graph is None or self._graph.fingerprint != fingerprint:
+                self._graph = AisleGraph(aisles)
+            self._revision = revision
+            return self._graph
+
+
+def access_points(points, shelves):
+    """货架上的拣货点移到货架靠近它的长边（取货面）上，不在货架上的点保持不变"""
+    points = np.array(points, dtype=float).reshape(-1, 2)
+    if len(points) == 0 or not shelves:
+        return points
+    owner = containing_shelf(points[:, 0], points[:, 1], shelf_arrays(shelves))
+    for i in np.nonzero(owner >= 0)[0]:
+        g = shelf_geometry(shelves[owner[i]])
+        cos, sin = math.cos(g['rotation']), math.sin(g['rotation'])
+        dx, dz = points[i, 0] - g['x'], points[i, 1] - g['z']
+        # 本地坐标：深度沿 X，长度沿 Z（与 layout_db.shelf_geometry 一致）
+        across = dx * cos - dz * sin
+        along = dx * sin + dz * cos
+        across = g['depth'] / 2 if across >= 0 else -g['depth'] / 2
+        points[i] = (g['x'] + across * cos + along * sin, g['z'] - across * sin + along * cos)
+    return points
+
+
+def tour_length(matrix, tour):
+    return float(sum(matrix[a, b] for a, b in zip(tour, tour[1:] + tour[:1])))
+
+
+def nearest_neighbour(matrix):
+    """从 0 号点（起点）出发的最近邻顺序"""
+    count = len(matrix)
+    visited = np.zeros(count, dtype=bool)
+    visited[0] = True
+    tour = [0]
+    for _ in range(count - 1):
+        row = np.where(visited, np.inf, matrix[tour[-1]])
+        tour.append(int(row.argmin()))
+        visited[tour[-1]] = True
+    return tour
+
+
+def two_opt(matrix, tour, max_passes=TWO_OPT_MAX_PASSES, time_limit=TWO_OPT_TIME_LIMIT):
+    """2-opt 改进闭合回路（0 号点固定在开头）"""
+    tour = np.array(tour, dtype=np.int64)
+    count = len(tour)
+    if count < 4:
+        return tour.tolist()
+    deadline = time.monotonic() + time_limit
+    for _ in range(max_passes):
+        improved = False
+        for i in range(1, count - 1):
+            a, b = tour[i - 1], tour[i]
+            c = tour[i + 1:]
+            d = np.append(tour[i + 2:], tour[0])
+            delta = matrix[a, c] + matrix[b, d] - matrix[a, b] - matrix[c, d]
+            k = int(delta.argmin())
+            if delta[k] < -EPSILON:
+                j = i + 1 + k
+                tour[i:j + 1] = tour[i:j + 1][::-1].copy()
+                improved = True
+        if not improved or time.monotonic() > deadline:
+            break
+    return tour.tolist()
+
+
+def plan_route(matrix, return_to_depot=True):
+    """matrix 为包含起点（0 号）的距离矩阵，返回 (拣货点访问顺序（不含起点）, 总距离, 最近邻的总距离)"""
+    matrix = np.array(matrix, dtype=float)
+    if not return_to_depot:
+        # 不返回起点时，回到起点的边代价为 0，闭合回路即等价于从起点出发的路径
+        matrix[:, 0] = 0.0
+    initial = nearest_neighbour(matrix)
+    tour = two_opt(matrix, initial)
+    return tour[1:], tour_length(matrix, tour), tour_length(matrix, initial)
@@ -0,0 +1,349 @@
+"""场景的视野裁剪与分级细节（LOD）查询
+
+大型仓库的客户端不必一次加载全部货架和货物，可以按视野（矩形范围或视锥体）分批查询，
+离相机越远返回的细节越少：
+
+- full：货架及其上的每个货物；
+- cells：货架及按格口汇总的占用体积（每个有货的格口一个盒子，高度到格口内货物的最高点）；
+- tiles：一片区域内的货架合并为一个包围盒，附带货架数、货物数和体积占用率。
+
+SceneIndex 在布局或货物变化后重建一次，包括货架、货物、格口占用的列数组，以及分块金字塔：
+第 0 级是覆盖全部货架的一个正方形分块，每往下一级边长减半，最细一级的边长不小于 MIN_TILE_SIZE，
+每一级只保存含有货架（按中心归属）的分块的汇总。
+
+查询逐级遍历这棵四叉树，每一级整批计算：与视野不相交的分块跳过；离相机超过 far 距离、
+且距离不小于分块边长的 TILE_SPLIT_FACTOR 倍的分块整体作为一个汇总盒子返回，其余继续细分；
+到达最细一级后再逐个货架按距离确定细节级别。零件和库道数量很少，与视野相交的总是完整返回；
+不在货架上的货物只在 full 级别返回。
+"""
+import math
+
+import numpy as np
+
+from layout_db import aisle_footprint, part_footprint, part_geometry, shelf_geometry
+from slotting import SHELF_MARGIN, cells_per_layer, locate_cargos
+from stacking import LAYER_BOARD_OFFSET, containing_shelf, shelf_arrays
+
+DETAIL_LEVELS = ('tiles', 'cells', 'full')
+# 默认的细节距离（米）：近于 near 返回货物，近于 far 返回格口占用，更远的合并为分块
+DEFAULT_LOD_DISTANCES = (30.0, 120.0)
+MIN_TILE_SIZE = 8.0
+MAX_TILE_LEVELS = 12
+TILE_SPLIT_FACTOR = 2.0
+# 没有相机位置时，tiles 级别按查询范围选择分块层级，使返回的分块数不超过这个值
+MAX_REGION_TILES = 256
+
+
+class SceneQueryError(ValueError):
+    """查询参数无效"""
+
+
+def _ranges(starts, ends):
+    """把若干 [start, end) 区间展开为一个下标数组"""
+    counts = ends - starts
+    return np.repeat(starts - (np.cumsum(counts) - counts), counts) + np.arange(counts.sum())
+
+
+def _aggregate(keys, members, columns):
+    """按 keys 对货架 members 分组汇总，返回 {keys, min_x, max_x, min_z, max_z, height, 计数列...}"""
+    unique, inverse = np.unique(keys, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    size = len(unique)
+    result = {'keys': unique}
+    for name, reduce, initial in (('min_x', np.minimum, np.inf), ('max_x', np.maximum, -np.inf),
+                                  ('min_z', np.minimum, np.inf), ('max_z', np.maximum, -np.inf),
+                                  ('height', np.maximum, 0.0)):
+        values = np.full(size, initial)
+        reduce.at(values, inverse, columns[name][members])
+        result[name] = values
+    result['shelf_count'] = np.bincount(inverse, minlength=size)
+    for name in ('cargo_count', 'cargo_volume', 'shelf_volume'):
+        result[name] = np.bincount(inverse, weights=columns[name][members], minlength=size)
+    return result
+
+
+class SceneIndex:
+    """某一版本的布局与货物的查询索引"""
+
+    def __init__(self, config, cargos, skus, layer_count, cell_count):
+        """cargos: 列字典 {id, sku_id（列表）, x, y, z, rotation, length, width, height}；skus: {sku_id: SKU 字典}"""
+        self.shelves = [shelf for shelf in config.get('shelves') or [] if isinstance(shelf, dict)]
+        self.parts = [part for part in config.get('parts') or [] if isinstance(part, dict)]
+        self.aisles = [aisle for aisle in config.get('aisles') or [] if isinstance(aisle, dict)]
+        self.skus = skus
+        self.layer_count = layer_count
+        self.per_layer = cells_per_layer(layer_count, cell_count)
+        self._build_cargos(cargos)
+        self._build_cells()
+        self._build_pyramid()
+        self._build_fixtures()
+
+    def _build_cargos(self, cargos):
+        self.cargo_ids = list(cargos['id'])
+        self.cargo_sku_ids = list(cargos['sku_id'])
+        c = {key: np.asarray(cargos[key], dtype=float) for key in ('x', 'y', 'z', 'rotation', 'length', 'width', 'height')}
+        self.cargo = c
+        count = len(self.shelves)
+
+        self.geometry = [shelf_geometry(shelf) for shelf in self.shelves]
+        self.shelf = shelf_arrays(self.shelves)
+        self.shelf['shelf_volume'] = np.array([g['length'] * g['depth'] * g['height'] for g in self.geometry],
+                                              dtype=float)
+        self.shelf_of = (containing_shelf(c['x'], c['z'], self.shelf) if count and len(c['x'])
+                         else np.full(len(c['x']), -1, dtype=np.int64))
+        self.owner, self.layer, self.cell = locate_cargos(self.shelves, self.layer_count, self.per_layer,
+                                                          c['x'], c['y'], c['z'], self.geometry)
+        # 按所属货架排序：不在货架上的货物为 order[start[0]:start[1]]，货架 s 的为 order[start[s + 1]:start[s + 2]]
+        self.cargo_order = np.argsort(self.shelf_of, kind='stable')
+        self.cargo_start = np.searchsorted(self.shelf_of[self.cargo_order], np.arange(-1, count + 1))
+
+        on_shelf = self.shelf_of >= 0
+        volume = c['length'] * c['width'] * c['height']
+        self.shelf['cargo_count'] = np.bincount(self.shelf_of[on_shelf], minlength=count).astype(float)
+        self.shelf['cargo_volume'] = np.bincount(self.shelf_of[on_shelf], weights=volume[on_shelf], minlength=count)
+
+    def _build_cells(self):
+        """每个有货的格口汇总为一个盒子：格口的长度与深度，从层板到格口内货物的最高点"""
+        located = np.nonzero(self.owner >= 0)[0]
+        keys = (self.owner[located] * self.layer_count + self.layer[located]) * self.per_layer + self.cell[located]
+        unique, inverse = np.unique(keys, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        top = np.zeros(len(unique))
+        np.maximum.at(top, inverse, self.cargo['y'][located] + self.cargo['height'][located])
+
+        shelf, rest = np.divmod(unique, self.layer_count * self.per_layer)
+        layer, cell = np.divmod(rest, self.per_layer)
+
+        def column(key):
+            return np.array([g[key] for g in self.geometry], dtype=float)[shelf] if len(shelf) else np.zeros(0)
+
+        length, depth, height, rotation = column('length'), column('depth'), column('height'), column('rotation')
+        cell_length = np.maximum(length - 2 * SHELF_MARGIN, 0) / self.per_layer
+        along = -length / 2 + SHELF_MARGIN + (cell + 0.5) * cell_length
+        board = (layer + 1) * height / self.layer_count - LAYER_BOARD_OFFSET
+        center_x, center_z = column('x'), column('z')
+
+        self.cells = {
+            'shelf': shelf, 'layer': layer, 'cell': cell,
+            'count': np.bincount(inverse, minlength=len(unique)),
+            'x': center_x + along * np.sin(rotation),
+            'y': (board + top) / 2,
+            'z': center_z + along * np.cos(rotation),
+            'length': cell_length,
+            'depth': np.maximum(depth - 2 * SHELF_MARGIN, 0),
+            'height': np.maximum(top - board, 0),
+            'rotation': rotation,
+        }
+        # 货架 s 的格口为 cells[cell_start[s]:cell_start[s + 1]]（键按货架有序）
+        self.cell_start = np.searchsorted(shelf, np.arange(len(self.shelves) + 1))
+
+    def _build_pyramid(self):
+        s = self.shelf
+        count = len(self.shelves)
+        self.levels = []
+        if count == 0:
+            self.origin, self.size, self.tile_size = (0.0, 0.0), MIN_TILE_SIZE, MIN_TILE_SIZE
+            return
+
+        center_x, center_z = (s['min_x'] + s['max_x']) / 2, (s['min_z'] + s['max_z']) / 2
+        self.origin = (float(center_x.min()), float(center_z.min()))
+        extent = max(float(center_x.max()) - self.origin[0], float(center_z.max()) - self.origin[1], MIN_TILE_SIZE)
+        level_count = min(MAX_TILE_LEVELS, 1 + max(0, int(math.floor(math.log2(extent / MIN_TILE_SIZE)))))
+        side = 1 << (level_count - 1)
+        # 最细一级的边长略大于 extent / side，保证最右侧的货架中心也落在网格内
+        self.tile_size = extent * (1 + 1e-9) / side
+        self.size = self.tile_size * side
+
+        tx = np.clip(np.floor((center_x - self.origin[0]) / self.tile_size), 0, side - 1).astype(np.int64)
+        tz = np.clip(np.floor((center_z - self.origin[1]) / self.tile_size), 0, side - 1).astype(np.int64)
+        members = np.arange(count)
+        for level in range(level_count):
+            shift = level_count - 1 - level
+            keys = (tx >> shift) * (1 << level) + (tz >> shift)
+            self.levels.append(_aggregate(keys, members, s))
+
+        # 最细一级的分块 -> 货架
+        finest = tx * side + tz
+        self.tile_order = np.argsort(finest, kind='stable')
+        self.tile_keys = finest[self.tile_order]
+        self.finest_keys = finest
+
+    def _build_fixtures(self):
+        def bounds(items, footprint, height):
+            kept, rows = [], []
+            for item in items:
+                box = footprint(item)
+                if box is not None:
+                    kept.append(item)
+                    rows.append((*box, height(item)))
+            return kept, np.array(rows, dtype=float).reshape(-1, 5).T
+
+        self.parts, self.part_bounds = bounds(self.parts, part_footprint, lambda part: part_geometry(part)['height'])
+        self.aisles, self.aisle_bounds = bounds(self.aisles, aisle_footprint, lambda aisle: 0.0)
+
+    def query(self, bbox=None, planes=None, camera=None, detail='full', lod_distances=DEFAULT_LOD_DISTANCES):
+        """按视野查询
+
+        bbox: (min_x, max_x, min_z, max_z)；planes: 视锥体的平面 [(nx, ny, nz, d)...]，
+        n·p + d >= 0 为内侧（与 three.js 的 Frustum 一致）；camera: 相机位置 (x, y, z)，
+        没有相机时所有对象都按 detail 返回；detail 为最高细节级别。
+        """
+        if detail not in DETAIL_LEVELS:
+            raise SceneQueryError(f"detail 必须是 {', '.join(DETAIL_LEVELS)} 之一")
+        near, far = lod_distances
+        if not 0 <= near <= far:
+            raise SceneQueryError("lod_distances 必须满足 0 <= near <= far")
+        cap = DETAIL_LEVELS.index(detail)
+        planes = None if planes is None else np.asarray(planes, dtype=float).reshape(-1, 4)
+
+        def visible(min_x, max_x, min_y, max_y, min_z, max_z):
+            mask = np.ones(len(min_x), dtype=bool)
+            if bbox is not None:
+                mask &= (max_x >= bbox[0]) & (min_x <= bbox[1]) & (max_z >= bbox[2]) & (min_z <= bbox[3])
+            if planes is not None:
+                # 包围盒沿平面法向最靠内的顶点仍在外侧时，整个盒子不可见
+                for nx, ny, nz, d in planes:
+                    px = np.where(nx >= 0, max_x, min_x)
+                    py = np.where(ny >= 0, max_y, min_y)
+                    pz = np.where(nz >= 0, max_z, min_z)
+                    mask &= nx * px + ny * py + nz * pz + d >= 0
+            return mask
+
+        def lod(min_x, max_x, min_y, max_y, min_z, max_z):
+            """(细节级别, 到相机的距离)"""
+            if camera is None:
+                return np.full(len(min_x), cap), np.full(len(min_x), np.inf)
+            dx = np.maximum(np.maximum(min_x - camera[0], camera[0] - max_x), 0)
+            dy = np.maximum(np.maximum(min_y - camera[1], camera[1] - max_y), 0)
+            dz = np.maximum(np.maximum(min_z - camera[2], camera[2] - max_z), 0)
+            distance = np.sqrt(dx * dx + dy * dy + dz * dz)
+            return np.minimum(np.where(distance < near, 2, np.where(distance < far, 1, 0)), cap), distance
+
+        tiles = []
+        candidates = self._traverse(bbox, camera, visible, lod, tiles)
+
+        # 最细一级未合并的分块中的货架逐个确定细节级别
+        s = self.shelf
+        boxes = (s['min_x'][candidates], s['max_x'][candidates], np.zeros(len(candidates)),
+                 s['height'][candidates], s['min_z'][candidates], s['max_z'][candidates])
+        candidates = candidates[visible(*boxes)]
+        levels, _ = lod(s['min_x'][candidates], s['max_x'][candidates], np.zeros(len(candidates)),
+                        s['height'][candidates], s['min_z'][candidates], s['max_z'][candidates])
+        far_shelves = candidates[levels == 0]
+        if len(far_shelves):
+            partial = _aggregate(self.finest_keys[far_shelves], far_shelves, s)
+            tiles.extend(self._tile_entries(len(self.levels) - 1, partial, np.arange(len(partial['keys']))))
+
+        cell_shelves = candidates[levels == 1]
+        full_shelves = candidates[levels == 2]
+        cells = _ranges(self.cell_start[cell_shelves], self.cell_start[cell_shelves + 1])
+        cargos = self.cargo_order[_ranges(self.cargo_start[full_shelves + 1], self.cargo_start[full_shelves + 2])]
+        # cells 级别的货架上不在格口中的货物（例如放在货架顶上）单独返回
+        stray = self.cargo_order[_ranges(self.cargo_start[cell_shelves + 1], self.cargo_start[cell_shelves + 2])]
+        stray = stray[self.owner[stray] < 0]
+
+        floor = self.cargo_order[self.cargo_start[0]:self.cargo_start[1]]
+        if len(floor) and cap == 2:
+            c = self.cargo
+            half = np.maximum(c['length'][floor], c['width'][floor]) / 2
+            boxes = (c['x'][floor] - half, c['x'][floor] + half, c['y'][floor], c['y'][floor] + c['height'][floor],
+                     c['z'][floor] - half, c['z'][floor] + half)
+            floor_levels, _ = lod(*boxes)
+            floor = floor[visible(*boxes) & (floor_levels == 2)]
+        else:
+            floor = floor[:0]
+
+        cargos = np.concatenate([cargos, stray, floor]).astype(np.int64)
+        shelf_detail = {**{int(i): 'cells' for i in cell_shelves}, **{int(i): 'full' for i in full_shelves}}
+        return {
+            "tile_size": self.tile_size,
+            "tiles": tiles,
+            "shelves": [{**self.shelves[i], "detail": detail_name} for i, detail_name in sorted(shelf_detail.items())],
+            "cells": self._cell_entries(cells),
+            "cargos": self._cargo_entries(cargos),
+            "skus": {sku_id: self.skus[sku_id] for sku_id in {self.cargo_sku_ids[i] for i in cargos.tolist()}
+                     if sku_id in self.skus},
+            "parts": self._fixtures(self.parts, self.part_bounds, visible),
+            "aisles": self._fixtures(self.aisles, self.aisle_bounds, visible),
+        }
+
+    def _traverse(self, bbox, camera, visible, lod, tiles):
+        """逐级遍历分块金字塔，合并的分块追加到 tiles，返回最细一级未合并分块中的货架下标"""
+        level_count = len(self.levels)
+        if level_count == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        region_level = 0
+        if camera is None:
+            extent = max(bbox[1] - bbox[0], bbox[3] - bbox[2]) if bbox is not None else self.size
+            for level in range(level_count):
+                edge = self.size / (1 << level)
+                if (math.ceil(extent / edge) + 1) ** 2 <= MAX_REGION_TILES:
+                    region_level = level
+
+        frontier = np.zeros(1, dtype=np.int64)
+        for level, tile in enumerate(self.levels):
+            rows = np.minimum(np.searchsorted(tile['keys'], frontier), len(tile['keys']) - 1)
+            rows = rows[tile['keys'][rows] == frontier]
+            boxes = (tile['min_x'][rows], tile['max_x'][rows], np.zeros(len(rows)), tile['height'][rows],
+                     tile['min_z'][rows], tile['max_z'][rows])
+            rows = rows[visible(*boxes)]
+            levels, distance = lod(tile['min_x'][rows], tile['max_x'][rows], np.zeros(len(rows)), tile['height'][rows],
+                                   tile['min_z'][rows], tile['max_z'][rows])
+            finest = level == level_count - 1
+            if camera is not None:
+                coarse = finest | (distance >= TILE_SPLIT_FACTOR * self.size / (1 << level))
+            else:
+                coarse = np.full(len(rows), finest or level >= region_level)
+            merged = (levels == 0) & coarse
+            tiles.extend(self._tile_entries(level, tile, rows[merged]))
+
+            keys = tile['keys'][rows[~merged]]
+            if finest:
+                start = np.searchsorted(self.tile_keys, keys, side='left')
+                end = np.searchsorted(self.tile_keys, keys, side='right')
+                return self.tile_order[_ranges(start, end)]
+            side = 1 << level
+            tx, tz = np.divmod(keys, side)
+            frontier = np.sort(np.concatenate([(2 * tx + i) * (2 * side) + (2 * tz + j) for i in (0, 1) for j in (0, 1)]))
+        return np.zeros(0, dtype=np.int64)
+
+    @staticmethod
+    def _tile_entries(level, tile, rows):
+        side = 1 << level
+        entries = []
+        for row in rows.tolist():
+            tx, tz = divmod(int(tile['keys'][row]), side)
+            shelf_volume = float(tile['shelf_volume'][row])
+            entries.append({
+                "level": level, "x": tx, "z": tz,
+                "min_x": float(tile['min_x'][row]), "max_x": float(tile['max_x'][row]),
+                "min_z": float(tile['min_z'][row]), "max_z": float(tile['max_z'][row]),
+                "height": float(tile['height'][row]),
+                "shelf_count": int(tile['shelf_count'][row]),
+                "cargo_count": int(tile['cargo_count'][row]),
+                "fill": round(float(tile['cargo_volume'][row]) / shelf_volume, 4) if shelf_volume > 0 else 0.0,
+            })
+        return entries
+
+    def _cell_entries(self, rows):
+        c = self.cells
+        columns = {key: c[key][rows].tolist() for key in ('x', 'y', 'z', 'length', 'depth', 'height', 'rotation')}
+        shelf, layer, cell, count = (c[key][rows].tolist() for key in ('shelf', 'layer', 'cell', 'count'))
+        return [{
+            "shelf_id": self.shelves[shelf[i]].get('id'), "layer": layer[i], "cell": cell[i], "count": count[i],
+            **{key: values[i] for key, values in columns.items()},
+        } for i in range(len(shelf))]
+
+    def _cargo_entries(self, rows):
+        c = self.cargo
+        x, y, z, rotation = (c[key][rows].tolist() for key in ('x', 'y', 'z', 'rotation'))
+        return [{"id": self.cargo_ids[row], "sku_id": self.cargo_sku_ids[row],
+                 "x": x[i], "y": y[i], "z": z[i], "rotation": rotation[i]}
+                for i, row in enumerate(rows.tolist())]
+
+    @staticmethod
+    def _fixtures(items, bounds, visible):
+        min_x, max_x, min_z, max_z, height = bounds
+        mask = visible(min_x, max_x, np.zeros(len(min_x)), height, min_z, max_z)
+        return [items[i] for i in np.nonzero(mask)[0].tolist()]
@@ -0,0 +1,406 @@
+"""SKU 主数据的批量导入导出
+
+逐条调用 POST /api/skus 导入上百万条 SKU 需要同样多次 HTTP 请求。这里改为流式处理：
+逐行解析 CSV / NDJSON（安装了 pyarrow 时也支持 Parquet），每 IMPORT_BATCH 行为一批，
+用 NumPy 整批校验尺寸和重量，再以 sku_code 为键用 executemany 批量 upsert，每批一个事务。
+校验失败的行不写入，按行号报告原因，其余行照常导入。
+
+文件中缺少的列或空值：新建的 SKU 使用默认值，已有的 SKU 保留原值。
+
+可通过 POST /api/skus/import、GET /api/skus/export 或命令行运行：
+
+    python sku_bulk.py import skus.csv [--format csv|ndjson|parquet] [--dry-run] [--db sku_data.db]
+    python sku_bulk.py export skus.ndjson [--format csv|ndjson|parquet] [--db sku_data.db]
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+from datetime import datetime
+from itertools import islice
+
+import numpy as np
+
+try:
+    import pyarrow
+    import pyarrow.parquet as pq
+except ImportError:
+    pyarrow = None
+
+IMPORT_BATCH = 5000
+EXPORT_BATCH = 5000
+# 查询已有 sku_code 时每条语句的参数个数，避免超出 SQLite 的上限
+LOOKUP_BATCH = 500
+# 响应中最多列出的错误行数，超出部分只计数
+MAX_REPORTED_ERRORS = 1000
+
+FORMATS = ('csv', 'ndjson', 'parquet')
+FORMAT_EXTENSIONS = {'.csv': 'csv', '.ndjson': 'ndjson', '.jsonl': 'ndjson', '.parquet': 'parquet'}
+FORMAT_MIMETYPES = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+# 数值列及新建 SKU 时的默认值，与 skus 表的 DEFAULT 保持一致
+NUMERIC_DEFAULTS = {'length': 0.5, 'width': 0.3, 'height': 0.2, 'weight': 1.0}
+TEXT_COLUMNS = ('name', 'image', 'thumbnail', 'texture_top', 'texture_bottom', 'texture_front',
+                'texture_back', 'texture_left', 'texture_right')
+EXPORT_COLUMNS = ('id', 'sku_code', *NUMERIC_DEFAULTS, *TEXT_COLUMNS, 'created_at', 'updated_at')
+
+
+def _upsert_sql():
+    numeric = list(NUMERIC_DEFAULTS)
+    columns = ['id', 'sku_code', *numeric, *TEXT_COLUMNS, 'created_at', 'updated_at']
+    values = [':id', ':sku_code',
+              *(f'COALESCE(:{column}, {NUMERIC_DEFAULTS[column]})' for column in numeric),
+              *(f"COALESCE(:{column}, '')" for column in TEXT_COLUMNS),
+              ':now', ':now']
+    merged = {column: f'COALESCE(:{column}, {column})' for column in (*numeric, *TEXT_COLUMNS)}
+    updates = ', '.join(f'{column} = {value}' for column, value in merged.items())
+    changed = ' OR '.join(f'{value} IS NOT {column}' for column, value in merged.items())
+    return f'''
+        INSERT INTO skus ({', '.join(columns)}) VALUES ({', '.join(values)})
+        ON CONFLICT(sku_code) DO UPDATE SET {updates}, updated_at = :now WHERE {changed}
+    '''
+
+
+# 参数为空（NULL）的列：插入时取默认值，更新时保留原值；内容没有变化的行不更新，
+# 重复导入同一份主数据时不会触发全文索引等触发器
+UPSERT_SQL = _upsert_sql()
+
+
+class BulkFormatError(ValueError):
+    """不支持的文件格式、缺少可选依赖或文件无法解析"""
+
+
+def detect_format(fmt=None, filename='', content_type=''):
+    """确定文件格式：优先使用显式指定的 format，其次按扩展名和 Content-Type 判断，默认 CSV"""
+    if not fmt:
+        extension = os.path.splitext(filename or '')[1].lower()
+        fmt = FORMAT_EXTENSIONS.get(extension) or next(
+            (name for name, mimetype in FORMAT_MIMETYPES.items() if mimetype == content_type), 'csv')
+    fmt = fmt.lower()
+    if fmt not in FORMATS:
+        raise BulkFormatError(f"不支持的格式: {fmt}")
+    if fmt == 'parquet' and pyarrow is None:
+        raise BulkFormatError("Parquet 格式需要安装 pyarrow")
+    return fmt
+
+
+def read_records(stream, fmt, batch_size=IMPORT_BATCH):
+    """逐行解析二进制流，生成 (行号, 记录)；记录为字典，无法解析的行为错误说明字符串"""
+    if fmt == 'parquet':
+        return _read_parquet(stream, batch_size)
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    return _read_csv(text) if fmt == 'csv' else _read_ndjson(text)
+
+
+def _read_csv(text):
+    reader = csv.DictReader(text)
+    if reader.fieldnames:
+        reader.fieldnames = [name.strip() for name in reader.fieldnames]
+    try:
+        for record in reader:
+            yield reader.line_num, record
+    except csv.Error as e:
+        raise BulkFormatError(f"第 {reader.line_num} 行 CSV 格式错误: {e}") from e
+
+
+def _read_ndjson(text):
+    for line_num, line in enumerate(text, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            record = f"JSON 解析失败: {e}"
+        yield line_num, record if isinstance(record, (dict, str)) else "不是 JSON 对象"
+
+
+def _read_parquet(stream, batch_size):
+    if not stream.seekable():
+        # Parquet 的元数据在文件末尾，需要可随机读取的文件
+        spooled = tempfile.SpooledTemporaryFile(max_size=64 * 1024 * 1024)
+        shutil.copyfileobj(stream, spooled)
+        spooled.seek(0)
+        stream = spooled
+    row = 0
+    for batch in pq.ParquetFile(stream).iter_batches(batch_size=batch_size):
+        for record in batch.to_pylist():
+            row += 1
+            yield row, record
+
+
+def _number_column(values):
+    """把一列值整体转换为浮点数组，返回 (数值, 是否为空, 是否无法解析)"""
+    missing = np.array([value is None or (isinstance(value, str) and not value.strip())
+                        for value in values], dtype=bool)
+    cleaned = [np.nan if empty else value for value, empty in zip(values, missing)]
+    bad = np.zeros(len(values), dtype=bool)
+    try:
+        numbers = np.array(cleaned, dtype=float)
+    except (TypeError, ValueError):
+        # 整列转换失败时才逐个转换，找出无法解析的值
+        numbers = np.empty(len(values))
+        for i, value in enumerate(cleaned):
+            try:
+                numbers[i] = float(value)
+            except (TypeError, ValueError):
+                numbers[i] = np.nan
+                bad[i] = True
+    return numbers, missing, bad
+
+
+def _text(value):
+    if value.__class__ is not str:
+        if value is None:
+            return None
+        value = str(value)
+    return value.strip() or None
+
+
+def validate_batch(records):
+    """整批校验 [(行号, 记录)]，返回 (可写入的参数列表, 错误列表)"""
+    errors = []
+    rows = []
+    for row_num, record in records:
+        if isinstance(record, str):
+            errors.append({"row": row_num, "sku_code": None, "error": record})
+            continue
+        sku_code = _text(record.get('sku_code'))
+        if sku_code is None:
+            errors.append({"row": row_num, "sku_code": None, "error": "缺少 sku_code"})
+            continue
+        get = record.get
+        params = {column: _text(get(column)) for column in TEXT_COLUMNS}
+        params.update({column: get(column) for column in NUMERIC_DEFAULTS})
+        params['row'] = row_num
+        params['sku_code'] = sku_code
+        rows.append(params)
+
+    problems = [[] for _ in rows]
+    for column in NUMERIC_DEFAULTS:
+        numbers, missing, bad = _number_column([row[column] for row in rows])
+        # 尺寸必须为正数，重量可以为 0；NaN/inf 视为无效
+        in_range = numbers >= 0 if column == 'weight' else numbers > 0
+        invalid = bad | (~missing & ~(np.isfinite(numbers) & in_range))
+        for i in np.nonzero(invalid)[0]:
+            problems[i].append(f"{column} 无效: {rows[i][column]!r}")
+        for row, value, empty in zip(rows, numbers.tolist(), missing.tolist()):
+            row[column] = None if empty else value
+
+    valid = []
+    for row, messages in zip(rows, problems):
+        if messages:
+            errors.append({"row": row['row'], "sku_code": row['sku_code'], "error": '；'.join(messages)})
+        else:
+            valid.append(row)
+    errors.sort(key=lambda error: error['row'])
+    return valid, errors
+
+
+def _existing_codes(cursor, codes):
+    codes = list(codes)
+    existing = set()
+    for start in range(0, len(codes), LOOKUP_BATCH):
+        chunk = codes[start:start + LOOKUP_BATCH]
+        cursor.execute(f"SELECT sku_code FROM skus WHERE sku_code IN ({', '.join('?' * len(chunk))})", chunk)
+        existing.update(row[0] for row in cursor.fetchall())
+    return existing
+
+
+def _write_batch(conn, rows, dry_run):
+    """在一个事务中 upsert 一批，返回 (写入成功的行, 实际插入或修改的行数, 错误列表)"""
+    cursor = conn.cursor()
+    now = datetime.now().isoformat()
+    # 按编码排序（稳定排序，同一编码保持文件中的先后顺序），索引插入更集中
+    rows.sort(key=lambda row: row['sku_code'])
+    for row in rows:
+        # 批量导入的规模下 8 位 ID 很容易冲突，这里用 16 位
+        row['id'] = os.urandom(8).hex()
+        row['now'] = now
+    if dry_run:
+        return rows, len(rows), []
+
+    try:
+        cursor.executemany(UPSERT_SQL, rows)
+        changes = cursor.rowcount
+        conn.commit()
+        return rows, changes, []
+    except sqlite3.IntegrityError:
+        conn.rollback()
+
+    # 整批失败时逐行重试，定位出错的行
+    written, changes, errors = [], 0, []
+    for row in rows:
+        try:
+            cursor.execute(UPSERT_SQL, row)
+            written.append(row)
+            changes += cursor.rowcount
+        except sqlite3.IntegrityError as e:
+            errors.append({"row": row['row'], "sku_code": row['sku_code'], "error": str(e)})
+    conn.commit()
+    return written, changes, errors
+
+
+def import_skus(conn, records, batch_size=IMPORT_BATCH, dry_run=False):
+    """导入 read_records 生成的记录，返回统计信息和出错的行（dry_run 时只校验不写入）"""
+    report = {"total": 0, "inserted": 0, "updated": 0, "unchanged": 0, "failed": 0,
+              "errors": [], "dry_run": dry_run}
+    seen = set()
+
+    def add_errors(errors):
+        report["failed"] += len(errors)
+        room = MAX_REPORTED_ERRORS - len(report["errors"])
+        report["errors"].extend(errors[:max(room, 0)])
+
+    records = iter(records)
+    try:
+        while True:
+            batch = list(islice(records, batch_size))
+            if not batch:
+                break
+            report["total"] += len(batch)
+            rows, errors = validate_batch(batch)
+            add_errors(errors)
+            existing = _existing_codes(conn.cursor(), {row['sku_code'] for row in rows} - seen)
+            written, changes, errors = _write_batch(conn, rows, dry_run)
+            add_errors(errors)
+            inserted = 0
+            for row in written:
+                if row['sku_code'] not in seen and row['sku_code'] not in existing:
+                    inserted += 1
+                seen.add(row['sku_code'])
+            report["inserted"] += inserted
+            if dry_run:
+                report["updated"] += len(written) - inserted
+            else:
+                report["updated"] += changes - inserted
+                report["unchanged"] += len(written) - changes
+    except (BulkFormatError, UnicodeDecodeError) as e:
+        # 已提交的批次保留，报告中给出中断原因
+        report["error"] = str(e)
+
+    report["errors_truncated"] = report["failed"] > len(report["errors"])
+    return report
+
+
+class _ChunkSink(io.RawIOBase):
+    """只追加写入的缓冲区，供 ParquetWriter 边写边输出"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data, self._chunks = b''.join(self._chunks), []
+        return data
+
+
+def iter_export(conn, fmt, batch_size=EXPORT_BATCH):
+    """逐批导出全部 SKU，生成字节块；导出的文件可直接用于导入"""
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT {', '.join(EXPORT_COLUMNS)} FROM skus ORDER BY rowid")
+    batches = iter(lambda: cursor.fetchmany(batch_size), [])
+
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        writer.writerow(EXPORT_COLUMNS)
+        for rows in batches:
+            writer.writerows(tuple(row) for row in rows)
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue().encode('utf-8')
+    elif fmt == 'ndjson':
+        for rows in batches:
+            yield ''.join(json.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False) + '\n'
+                          for row in rows).encode('utf-8')
+    else:
+        schema = pyarrow.schema([(column, pyarrow.float64() if column in NUMERIC_DEFAULTS else pyarrow.string())
+                                 for column in EXPORT_COLUMNS])
+        sink = _ChunkSink()
+        with pq.ParquetWriter(sink, schema) as writer:
+            for rows in batches:
+                columns = list(zip(*rows))
+                writer.write_table(pyarrow.Table.from_arrays(
+                    [pyarrow.array(values, type=field.type) for values, field in zip(columns, schema)],
+                    schema=schema))
+                yield sink.drain()
+        yield sink.drain()
+
+
+def main(argv=None):
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+
+    parser = argparse.ArgumentParser(description='批量导入导出 SKU 主数据')
+    parser.add_argument('action', choices=('import', 'export'))
+    parser.add_argument('path', help='导入或导出的文件，- 表示标准输入/输出')
+    parser.add_argument('--format', choices=FORMATS, help='文件格式，默认按扩展名判断')
+    parser.add_argument('--db', default=os.path.join(base_dir, 'sku_data.db'), help='SKU 数据库路径')
+    parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH, help='每批（每个事务）的行数')
+    parser.add_argument('--dry-run', action='store_true', help='只校验，不写入')
+    args = parser.parse_args(argv)
+
+    try:
+        fmt = detect_format(args.format, args.path)
+    except BulkFormatError as e:
+        parser.error(str(e))
+
+    conn = sqlite3.connect(args.db)
+    try:
+        if args.action == 'export':
+            output = sys.stdout.buffer if args.path == '-' else open(args.path, 'wb')
+            try:
+                for chunk in iter_export(conn, fmt, args.batch_size):
+                    output.write(chunk)
+            finally:
+                if output is not sys.stdout.buffer:
+                    output.close()
+            return
+
+        source = sys.stdin.buffer if args.path == '-' else open(args.path, 'rb')
+        try:
+            report = import_skus(conn, read_records(source, fmt, args.batch_size),
+                                 batch_size=args.batch_size, dry_run=args.dry_run)
+        finally:
+            if source is not sys.stdin.buffer:
+                source.close()
+    finally:
+        conn.close()
+
+    for error in report["errors"]:
+        print(f"第 {error['row']} 行 {error['sku_code'] or ''}: {error['error']}", file=sys.stderr)
+    if report["errors_truncated"]:
+        print(f"……另有 {report['failed'] - len(report['errors'])} 行错误未列出", file=sys.stderr)
+    action = '可导入' if args.dry_run else '已导入'
+    print(f"共 {report['total']} 行，{action}：新增 {report['inserted']}，更新 {report['updated']}，"
+          f"未变化 {report['unchanged']}，失败 {report['failed']}")
+    if 'error' in report:
+        print(f"导入中断: {report['error']}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,251 @@
+"""货位分配（slotting）：把一批 SKU 按数量自动摆放到货架的空闲格口中
+
+货架共 global_params.layer_count 层，格口总数 global_params.cell_count 平均分到各层，
+每层沿货架长度方向均分为若干格口；已有货物的格口视为占用。层板高度与 stacking.py 一致，
+每层可用高度为层间距减去上一层横梁占用的高度。
+
+同一格口内同一 SKU 按规则网格摆放：沿货架长度方向逐列，列内先沿深度方向排满一行，
+再向上堆叠（上层货物完全压在下层货物上，满足 stacking.py 的支撑规则）。
+一个 SKU 只占用格口的前一段长度，剩余的长度切分（guillotine）为新的空闲段留给后面的 SKU。
+
+SKU 按单件体积从大到小依次处理，空闲段按层从低到高排列，大件优先放在低层；
+每层的承重（默认 DEFAULT_LAYER_LOAD 千克，扣除已有货物的重量）也是容量上限。
+每个 SKU 在所有空闲段、两种朝向上的容量用 NumPy 一次算出，
+逐段填充时只循环实际用到的空闲段，货物坐标整块生成。
+"""
+import math
+
+import numpy as np
+
+from layout_db import shelf_geometry
+from stacking import DEFAULT_CARGO_SIZE, LAYER_BOARD_OFFSET, SUPPORT_TOLERANCE, containing_shelf, shelf_arrays
+
+# 货架两端立柱、前后横梁占用的宽度（米）
+SHELF_MARGIN = 0.05
+# 上一层层板下方横梁占用的高度（米）
+BEAM_CLEARANCE = 0.07
+# 每层默认承重（千克），可由 global_params.layer_load_limit 或请求参数覆盖
+DEFAULT_LAYER_LOAD = 1000.0
+DEFAULT_CARGO_WEIGHT = 1.0
+
+EPSILON = 1e-9
+
+
+class SlottingError(ValueError):
+    """请求参数无效"""
+
+
+def cells_per_layer(layer_count, cell_count):
+    return max(1, round(cell_count / layer_count)) if layer_count > 0 else 0
+
+
+def build_segments(shelves, layer_count, cell_count):
+    """每个格口一个空闲段，返回列数组；段起点 start 为货架本地长度坐标（从 -长度/2 起）"""
+    per_layer = cells_per_layer(layer_count, cell_count)
+    geometry = [shelf_geometry(shelf) for shelf in shelves]
+    count = len(shelves) * layer_count * per_layer
+
+    shelf_index = np.repeat(np.arange(len(shelves)), layer_count * per_layer)
+    layer = np.tile(np.repeat(np.arange(layer_count), per_layer), len(shelves))
+    cell = np.tile(np.arange(per_layer), len(shelves) * layer_count)
+
+    def per_shelf(key):
+        return np.array([g[key] for g in geometry], dtype=float)[shelf_index] if count else np.zeros(0)
+
+    length, depth, height = per_shelf('length'), per_shelf('depth'), per_shelf('height')
+    layer_height = height / layer_count if layer_count else height
+    cell_length = np.maximum(length - 2 * SHELF_MARGIN, 0) / max(per_layer, 1)
+
+    return {
+        'shelf': shelf_index,
+        'layer': layer,
+        'cell': cell,
+        'start': -length / 2 + SHELF_MARGIN + cell * cell_length,
+        'free': cell_length,
+        'cell_length': cell_length,
+        'depth': np.maximum(depth - 2 * SHELF_MARGIN, 0),
+        'clearance': np.maximum(layer_height - BEAM_CLEARANCE, 0),
+        'board': (layer + 1) * layer_height - LAYER_BOARD_OFFSET,
+        # 承重按（货架, 层）计算
+        'load_key': shelf_index * layer_count + layer,
+        'per_layer': per_layer,
+        'geometry': geometry,
+    }
+
+
+def to_local(x, z, geometry, shelf_index):
+    """世界坐标转换为货架本地坐标 (沿深度, 沿长度)"""
+    sx = np.array([g['x'] for g in geometry], dtype=float)[shelf_index]
+    sz = np.array([g['z'] for g in geometry], dtype=float)[shelf_index]
+    theta = np.array([g['rotation'] for g in geometry], dtype=float)[shelf_index]
+    dx, dz = x - sx, z - sz
+    cos, sin = np.cos(theta), np.sin(theta)
+    return dx * cos - dz * sin, dx * sin + dz * cos
+
+
+def locate_cargos(shelves, layer_count, per_layer, x, y, z, geometry=None):
+    """货物所在的 (货架下标, 层, 格口)，不在任何货架的层板上时三者均为 -1"""
+    x, y, z = (np.asarray(v, dtype=float) for v in (x, y, z))
+    owner = np.full(len(x), -1, dtype=np.int64)
+    layer = np.full(len(x), -1, dtype=np.int64)
+    cell = np.full(len(x), -1, dtype=np.int64)
+    if len(x) == 0 or len(shelves) == 0 or layer_count <= 0:
+        return owner, layer, cell
+
+    if geometry is None:
+        geometry = [shelf_geometry(shelf) for shelf in shelves]
+    found = containing_shelf(x, z, shelf_arrays(shelves))
+    on_shelf = np.nonzero(found >= 0)[0]
+    s = found[on_shelf]
+    height = np.array([g['height'] for g in geometry], dtype=float)[s]
+    length = np.array([g['length'] for g in geometry], dtype=float)[s]
+    found_layer = np.floor((y[on_shelf] + LAYER_BOARD_OFFSET + SUPPORT_TOLERANCE) / (height / layer_count)).astype(np.int64) - 1
+    valid = (found_layer >= 0) & (found_layer < layer_count)
+
+    _, along = to_local(x[on_shelf], z[on_shelf], geometry, s)
+    cell_length = np.maximum(length - 2 * SHELF_MARGIN, EPSILON) / per_layer
+    found_cell = np.clip(np.floor((along + length / 2 - SHELF_MARGIN) / cell_length), 0, per_layer - 1).astype(np.int64)
+
+    rows = on_shelf[valid]
+    owner[rows], layer[rows], cell[rows] = s[valid], found_layer[valid], found_cell[valid]
+    return owner, layer, cell
+
+
+def mark_occupied(segments, shelves, layer_count, cargo_x, cargo_y, cargo_z, cargo_weight):
+    """已有货物所在的格口标记为占用，返回每个（货架, 层）已承担的重量"""
+    loads = np.zeros(len(shelves) * layer_count)
+    owner, layer, cell = locate_cargos(shelves, layer_count, segments['per_layer'],
+                                       cargo_x, cargo_y, cargo_z, segments['geometry'])
+    valid = owner >= 0
+    owner, layer, cell = owner[valid], layer[valid], cell[valid]
+    segments['free'][(owner * layer_count + layer) * segments['per_layer'] + cell] = 0
+    np.add.at(loads, owner * layer_count + layer, np.asarray(cargo_weight, dtype=float)[valid])
+    return loads
+
+
+def _sku_size(sku):
+    def value(key, default):
+        number = sku.get(key)
+        return float(number) if number else default
+    return (value('length', DEFAULT_CARGO_SIZE['length']), value('width', DEFAULT_CARGO_SIZE['width']),
+            value('height', DEFAULT_CARGO_SIZE['height']), value('weight', DEFAULT_CARGO_WEIGHT))
+
+
+def _capacity(segments, a, b, h):
+    """某一朝向（沿长度 a、沿深度 b、高 h）下每个空闲段能放下的件数及网格参数"""
+    rows = np.floor(segments['depth'] / b + EPSILON)
+    tiers = np.floor(segments['clearance'] / h + EPSILON)
+    per_column = rows * tiers
+    columns = np.floor(segments['free'] / a + EPSILON)
+    return columns * per_column, rows, per_column
+
+
+def plan_slotting(items, skus, shelves, layer_count, cell_count, cargos=None, layer_load=DEFAULT_LAYER_LOAD):
+    """计算摆放方案
+
+    items: [(sku_id, 数量)]；skus: {sku_id: SKU 行字典}；cargos: 已有货物 (x, y, z, 重量) 列数组。
+    返回 (placements, summary)：placements 为列数组（sku_id 列表及 x/y/z/rotation/shelf/layer/cell），
+    summary 为 [{sku_id, requested, placed}]，按 items 的顺序。
+    """
+    segments = build_segments(shelves, layer_count, cell_count)
+    if cargos is not None:
+        loads = mark_occupied(segments, shelves, layer_count, *cargos)
+    else:
+        loads = np.zeros(len(shelves) * layer_count)
+    remaining_load = layer_load - loads
+
+    # 空闲段按 (层, 货架, 格口) 排列，低层优先
+    order = np.lexsort((segments['cell'], segments['shelf'], segments['layer']))
+    geometry = segments['geometry']
+    shelf_x = np.array([g['x'] for g in geometry], dtype=float)
+    shelf_z = np.array([g['z'] for g in geometry], dtype=float)
+    shelf_rotation = np.array([g['rotation'] for g in geometry], dtype=float)
+
+    requested = {}
+    for sku_id, quantity in items:
+        requested[sku_id] = requested.get(sku_id, 0) + quantity
+    volumes = {}
+    for sku_id in requested:
+        length, width, height, _ = _sku_size(skus[sku_id])
+        volumes[sku_id] = length * width * height
+
+    chunks = []
+    placed = dict.fromkeys(requested, 0)
+    for sku_id in sorted(requested, key=lambda sku_id: -volumes[sku_id]):
+        length, width, height, weight = _sku_size(skus[sku_id])
+        left = requested[sku_id]
+        if left <= 0 or len(order) == 0:
+            continue
+
+        # 两种朝向：长边沿货架长度（与货架同向）或沿货架深度（多转 90°）
+        cap0, rows0, per0 = _capacity(segments, length, width, height)
+        cap1, rows1, per1 = _capacity(segments, width, length, height)
+        turned = cap1 > cap0
+        capacity = np.where(turned, cap1, cap0)
+        if weight > 0:
+            capacity = np.minimum(capacity, np.floor(np.maximum(remaining_load, 0) / weight + EPSILON)[segments['load_key']])
+
+        for seg in order[capacity[order] > 0]:
+            key = segments['load_key'][seg]
+            n = int(capacity[seg])
+            if weight > 0:
+                n = min(n, int(remaining_load[key] / weight + EPSILON))
+            n = min(n, left)
+            if n <= 0:
+                continue
+
+            a, b = (width, length) if turned[seg] else (length, width)
+            rows = int(rows1[seg] if turned[seg] else rows0[seg])
+            per_column = int(per1[seg] if turned[seg] else per0[seg])
+
+            i = np.arange(n)
+            column, j = np.divmod(i, per_column)
+            tier, row = np.divmod(j, rows)
+            along = segments['start'][seg] + column * a + a / 2
+            across = (row - (rows - 1) / 2) * b
+            s = segments['shelf'][seg]
+            cos, sin = math.cos(shelf_rotation[s]), math.sin(shelf_rotation[s])
+            chunks.append({
+                'sku_id': sku_id,
+                'x': shelf_x[s] + across * cos + along * sin,
+                'y': segments['board'][seg] + tier * height,
+                'z': shelf_z[s] - across * sin + along * cos,
+                'rotation': shelf_rotation[s] + (math.pi / 2 if turned[seg] else 0.0),
+                'shelf': s, 'layer': segments['layer'][seg], 'cell': segments['cell'][seg],
+                'count': n,
+            })
+
+            used = math.ceil(n / per_column) * a
+            segments['start'][seg] += used
+            segments['free'][seg] = max(segments['free'][seg] - used, 0.0)
+            remaining_load[key] -= n * weight
+            left -= n
+            placed[sku_id] += n
+            if left == 0:
+                break
+
+    def column(key):
+        if not chunks:
+            return np.zeros(0)
+        return np.concatenate([np.broadcast_to(chunk[key], chunk['count']) for chunk in chunks])
+
+    placements = {key: column(key) for key in ('x', 'y', 'z', 'rotation', 'shelf', 'layer', 'cell')}
+    placements['sku_id'] = [chunk['sku_id'] for chunk in chunks for _ in range(chunk['count'])]
+
+    summary = [{"sku_id": sku_id, "requested": requested[sku_id], "placed": placed[sku_id]} for sku_id in requested]
+    return placements, summary
+
+
+def parse_items(items):
+    """校验请求中的 [{sku_id, quantity}]，返回 [(sku_id, 数量)]"""
+    if not isinstance(items, list) or not items:
+        raise SlottingError("items 必须是非空数组")
+    parsed = []
+    for item in items:
+        if not isinstance(item, dict) or not isinstance(item.get('sku_id'), str):
+            raise SlottingError(f"无效的条目: {item!r}")
+        quantity = item.get('quantity', 1)
+        if isinstance(quantity, bool) or not isinstance(quantity, int) or quantity < 0:
+            raise SlottingError(f"数量必须是非负整数: {quantity!r}")
+        parsed.append((item['sku_id'], quantity))
+    return parsed
@@ -0,0 +1,216 @@
+"""货物堆叠引擎：在服务端计算货物的落定高度
+
+规则与前端 cargo.js 中的 getSupportHeight 保持一致：
+- 货物中心落在货架占地范围内时，可由低于货物底面的层板支撑，
+  第 i 层层板高度为 (i + 1) * 货架高度 / 层数 - 0.06；
+- 两个货物在 X/Z 方向的重叠超过半宽之和的 80% 时，下方货物的顶面可支撑上方货物；
+- 都没有时落到地面（y = 0）。
+
+货架支撑用均匀网格分桶后整块向量化计算；货物之间的支撑按原始底面高度从低到高
+依次结算，下方货物掉落后，上方货物会在同一遍中随之级联下落。候选支撑对同样按网格
+整块生成，结算切分为互不依赖的批次，每批整块向量化计算（见 settle）。
+"""
+from collections import defaultdict
+
+import numpy as np
+
+from layout_db import shelf_footprint, shelf_geometry
+
+LAYER_BOARD_OFFSET = 0.06
+SUPPORT_TOLERANCE = 0.01
+OVERLAP_FACTOR = 0.8
+
+# 生成候选货物对时每批处理的货物数，限制临时数组的大小
+PAIR_CHUNK = 4096
+
+DEFAULT_CARGO_SIZE = {'width': 0.3, 'length': 0.5, 'height': 0.2}
+
+
+def shelf_arrays(shelves):
+    """把货架列表转换为列数组：占地范围与高度"""
+    bounds = np.array([shelf_footprint(shelf) for shelf in shelves], dtype=float).reshape(-1, 4)
+    heights = np.array([shelf_geometry(shelf)['height'] for shelf in shelves], dtype=float)
+    return {
+        'min_x': bounds[:, 0], 'max_x': bounds[:, 1],
+        'min_z': bounds[:, 2], 'max_z': bounds[:, 3],
+        'height': heights,
+    }
+
+
+def _grid_keys(x, z, cell_size):
+    return np.floor(x / cell_size).astype(np.int64), np.floor(z / cell_size).astype(np.int64)
+
+
+def _shelf_groups(x, z, shelves):
+    """货物按中心所在网格分组，生成 (组内货物下标, 该网格内的货架下标, 中心是否在各货架占地范围内)"""
+    extent = max(float(np.max(shelves['max_x'] - shelves['min_x'])),
+                 float(np.max(shelves['max_z'] - shelves['min_z'])), 0.5)
+    cell_size = extent
+
+    # 货架按占地范围登记到覆盖的所有网格中
+    shelf_cells = defaultdict(list)
+    min_kx, min_kz = _grid_keys(shelves['min_x'], shelves['min_z'], cell_size)
+    max_kx, max_kz = _grid_keys(shelves['max_x'], shelves['max_z'], cell_size)
+    for s in range(len(shelves['height'])):
+        for kx in range(min_kx[s], max_kx[s] + 1):
+            for kz in range(min_kz[s], max_kz[s] + 1):
+                shelf_cells[(kx, kz)].append(s)
+
+    # 每组与该网格内的货架整块比较
+    kx, kz = _grid_keys(x, z, cell_size)
+    cells, inverse = np.unique(np.stack([kx, kz], axis=1), axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    order = np.argsort(inverse, kind='stable')
+    boundaries = np.searchsorted(inverse[order], np.arange(len(cells) + 1))
+
+    for c, (cell_x, cell_z) in enumerate(cells):
+        candidates = shelf_cells.get((int(cell_x), int(cell_z)))
+        if not candidates:
+            continue
+        members = order[boundaries[c]:boundaries[c + 1]]
+        s = np.array(candidates)
+
+        cx = x[members][:, None]
+        cz = z[members][:, None]
+        inside = ((cx >= shelves['min_x'][s]) & (cx <= shelves['max_x'][s]) &
+                  (cz >= shelves['min_z'][s]) & (cz <= shelves['max_z'][s]))
+        yield members, s, inside
+
+
+def containing_shelf(x, z, shelves):
+    """每个货物中心所在的货架下标（占地范围重叠时取靠前的货架，不在任何货架上为 -1）"""
+    x, z = np.asarray(x, dtype=float), np.asarray(z, dtype=float)
+    result = np.full(len(x), -1, dtype=np.int64)
+    if len(x) == 0 or len(shelves['height']) == 0:
+        return result
+
+    for members, s, inside in _shelf_groups(x, z, shelves):
+        # 网格内的货架下标递增，第一个命中的即为靠前的货架
+        hit = inside.any(axis=1)
+        result[members[hit]] = s[inside[hit].argmax(axis=1)]
+    return result
+
+
+def shelf_support(x, z, bottom, shelves, layer_count):
+    """每个货物底面以下最高的货架层板高度（没有时为 0）"""
+    support = np.zeros(len(x))
+    if len(x) == 0 or len(shelves['height']) == 0 or layer_count <= 0:
+        return support
+
+    for members, s, inside in _shelf_groups(x, z, shelves):
+        layer_height = shelves['height'][s] / layer_count
+        # 满足 (i + 1) * layer_height - 0.06 < bottom + 0.01 的最大层号 i + 1
+        reach = (bottom[members][:, None] + SUPPORT_TOLERANCE + LAYER_BOARD_OFFSET) / layer_height
+        level = np.minimum(np.ceil(reach) - 1, layer_count)
+        heights = np.where(level >= 1, level * layer_height - LAYER_BOARD_OFFSET, 0.0)
+        heights = np.where(inside, heights, 0.0)
+        support[members] = np.maximum(support[members], heights.max(axis=1))
+
+    return support
+
+
+def _support_pairs(x, z, half_w, half_d, limit, lower, rank, cell_size):
+    """可能构成支撑关系的货物对 (i, j)：j 先于 i 结算、X/Z 重叠超过阈值，且 j 顶面的下限低于 i 的底面
+
+    货物按中心所在网格排序，每对相邻网格只比较一次（同一格与右、上方向的 4 个邻格），
+    再按结算顺序确定方向；顶面下限（货架支撑 + 自身高度）已经不低于 i 底面的 j 无论如何落定都无法支撑 i，直接排除。
+    """
+    kx, kz = _grid_keys(x, z, cell_size)
+    kx, kz = kx - kx.min() + 1, kz - kz.min() + 1
+    span = int(kz.max()) + 2
+    keys = kx * span + kz
+    order = np.argsort(keys, kind='stable')
+    cells, cell_start, cell_count = np.unique(keys[order], return_index=True, return_counts=True)
+
+    first, second = [], []
+    for begin in range(0, len(x), PAIR_CHUNK):
+        a_chunk = order[begin:begin + PAIR_CHUNK]
+        for dx, dz in ((0, 0), (0, 1), (1, -1), (1, 0), (1, 1)):
+            target = keys[a_chunk] + dx * span + dz
+            index = np.minimum(np.searchsorted(cells, target), len(cells) - 1)
+            counts = np.where(cells[index] == target, cell_count[index], 0)
+            a = np.repeat(a_chunk, counts)
+            b = order[np.repeat(cell_start[index] - (np.cumsum(counts) - counts), counts) + np.arange(counts.sum())]
+            close = ((np.abs(x[a] - x[b]) < (half_w[a] + half_w[b]) * OVERLAP_FACTOR) &
+                     (np.abs(z[a] - z[b]) < (half_d[a] + half_d[b]) * OVERLAP_FACTOR))
+            a, b = a[close], b[close]
+            later = rank[a] > rank[b]
+            i, j = np.where(later, a, b), np.where(later, b, a)
+            # 同一格内的每对货物出现两次，只保留 a 后结算的一次
+            keep = (lower[j] < limit[i]) & (later if dx == 0 and dz == 0 else a != b)
+            first.append(i[keep])
+            second.append(j[keep])
+    return np.concatenate(first), np.concatenate(second)
+
+
+def settle(x, z, bottom, width, depth, height, shelves, layer_count):
+    """计算所有货物的落定底面高度
+
+    参数均为等长数组：x/z 为中心坐标，bottom 为当前底面高度，width 沿 X、depth 沿 Z。
+    返回新的底面高度数组。
+
+    货物按原始底面高度依次结算，可能支撑它的只有先结算的货物。先一次性求出所有可能的支撑对，
+    再按结算顺序切分批次：同一批内的货物互不支撑，整批向量化结算。批次数取决于支撑关系，
+    底面高度相同的货物（例如地面上或各货架同一层上的货物）通常落在同一批中。
+    """
+    x, z, bottom = (np.asarray(a, dtype=float) for a in (x, z, bottom))
+    half_w = np.asarray(width, dtype=float) / 2
+    half_d = np.asarray(depth, dtype=float) / 2
+    height = np.asarray(height, dtype=float)
+
+    support = shelf_support(x, z, bottom, shelves, layer_count)
+    count = len(x)
+    if count == 0:
+        return support
+
+    order = np.argsort(bottom, kind='stable')
+    rank = np.empty(count, dtype=np.int64)
+    rank[order] = np.arange(count)
+    limit = bottom + SUPPORT_TOLERANCE
+    cell_size = max(2 * max(float(half_w.max()), float(half_d.max())), 0.1)
+    i, j = _support_pairs(x, z, half_w, half_d, limit, support + height, rank, cell_size)
+
+    # 按结算顺序切分批次：批内的货物互不支撑，货物所依赖的最晚结算的货物在本批之前时可并入当前批
+    latest = np.full(count, -1, dtype=np.int64)
+    np.maximum.at(latest, rank[i], rank[j])
+    starts = [0]
+    for position, dependency in enumerate(latest.tolist()):
+        if dependency >= starts[-1]:
+            starts.append(position)
+    starts.append(count)
+
+    pair_order = np.argsort(rank[i], kind='stable')
+    i, j = i[pair_order], j[pair_order]
+    pair_bounds = np.searchsorted(rank[i], starts)
+
+    top = np.zeros(count)
+    for batch in range(len(starts) - 1):
+        pi = i[pair_bounds[batch]:pair_bounds[batch + 1]]
+        below = top[j[pair_bounds[batch]:pair_bounds[batch + 1]]]
+        valid = below < limit[pi]
+        np.maximum.at(support, pi[valid], below[valid])
+        members = order[starts[batch]:starts[batch + 1]]
+        top[members] = support[members] + height[members]
+
+    return support
+
+
+def settle_cargo_rows(rows, shelves, layer_count):
+    """对数据库中的货物行（含 SKU 尺寸）做落定计算，返回 [(货物ID, 新的底面高度)]，只包含高度有变化的货物"""
+    if not rows:
+        return []
+
+    def size(row, key):
+        value = row[key]
+        return value if value else DEFAULT_CARGO_SIZE[key]
+
+    x = np.array([row['x'] or 0 for row in rows], dtype=float)
+    y = np.array([row['y'] or 0 for row in rows], dtype=float)
+    z = np.array([row['z'] or 0 for row in rows], dtype=float)
+    width = np.array([size(row, 'width') for row in rows], dtype=float)
+    depth = np.array([size(row, 'length') for row in rows], dtype=float)
+    height = np.array([size(row, 'height') for row in rows], dtype=float)
+
+    settled = settle(x, z, y, width, depth, height, shelf_arrays(shelves), layer_count)
+    moved = np.nonzero(np.abs(settled - y) > 1e-6)[0]
+    return [(rows[i]['id'], float(settled[i])) for i in moved]
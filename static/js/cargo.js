@@ -10,6 +10,13 @@ window.cargos = [];
 const GRAVITY = 9.8;
 const GRAVITY_UPDATE_INTERVAL = 16;
 
+/**
+ * 重力落定后的位置更新先进入队列，延迟一段时间后合并为一次批量请求
+ */
+const CARGO_BATCH_DELAY = 200;
+const pendingCargoUpdates = new Map();
+let cargoUpdateTimer = null;
+
 /**
  * 放置模式状态
  */
@@ -17,12 +24,124 @@ let cargoPlacementMode = false;
 let selectedSkuForPlacement = null;
 let previewCargo = null;
 
+/**
+ * 已加载的货物贴图，按地址共享：同一贴图只下载、上传 GPU 一次
+ */
+const cargoTextureCache = new Map();
+
+/**
+ * 贴图图集的 UV 查找表（/api/textures/atlas），未加载时为 null
+ */
+let textureAtlas = null;
+
+/**
+ * BoxGeometry 各面（+X, -X, +Y, -Y, +Z, -Z）对应的 SKU 贴图字段
+ */
+const CARGO_FACE_TEXTURES = ['texture_right', 'texture_left', 'texture_top', 'texture_bottom', 'texture_front', 'texture_back'];
+
+/**
+ * 按顺序尝试加载 urls 中的贴图，结果按 key 缓存
+ * @returns {Promise<THREE.Texture>}
+ */
+function loadCachedTexture(key, urls) {
+    if (!cargoTextureCache.has(key)) {
+        const textureLoader = new THREE.TextureLoader();
+        const promise = new Promise((resolve, reject) => {
+            const tryLoad = (index) => {
+                textureLoader.load(urls[index], resolve, undefined, (error) => {
+                    if (index + 1 < urls.length) {
+                        tryLoad(index + 1);
+                    } else {
+                        reject(error);
+                    }
+                });
+            };
+            tryLoad(0);
+        });
+        promise.catch(() => cargoTextureCache.delete(key));
+        cargoTextureCache.set(key, promise);
+    }
+    return cargoTextureCache.get(key);
+}
+
+/**
+ * 加载货物贴图
+ * 内容寻址的贴图优先加载 2 的幂尺寸的 WebP 派生图，尚未生成时退回原图
+ * @param {string} textureFile - 贴图文件名
+ * @returns {Promise<THREE.Texture>}
+ */
+function loadCargoTexture(textureFile) {
+    const urls = [`/static/uploads/sku_images/${textureFile}`];
+    const hashed = /^([0-9a-f]{32})\.[a-z0-9]+$/.exec(textureFile);
+    if (hashed) {
+        urls.unshift(`/static/uploads/sku_thumbnails/${hashed[1]}_tex.webp`);
+    }
+    return loadCachedTexture(textureFile, urls);
+}
+
+/**
+ * 加载贴图图集的 UV 查找表，失败时退回逐张加载贴图
+ */
+async function loadTextureAtlas() {
+    try {
+        const response = await fetch('/api/textures/atlas');
+        if (response.ok) {
+            textureAtlas = await response.json();
+        }
+    } catch (error) {
+        console.error('加载贴图图集失败:', error);
+        textureAtlas = null;
+    }
+}
+
+/**
+ * 贴图在图集中的位置 [页, u0, v0, u1, v1]，不在图集中时返回 null
+ */
+function getAtlasEntry(textureFile) {
+    if (!textureAtlas || !textureFile) return null;
+    const entry = textureAtlas.textures[textureFile];
+    return entry && textureAtlas.pages[entry[0]] ? entry : null;
+}
+
+/**
+ * 加载一页图集：格子之间没有留边，关闭 mipmap 避免缩小时混入相邻贴图
+ */
+function loadAtlasPage(page) {
+    const url = textureAtlas.pages[page];
+    return loadCachedTexture(url, [url]).then((texture) => {
+        texture.generateMipmaps = false;
+        texture.minFilter = THREE.LinearFilter;
+        return texture;
+    });
+}
+
+/**
+ * 把使用图集的面的 UV 映射到图集中对应的格子
+ */
+function applyAtlasUVs(geometry, sku) {
+    const uv = geometry.attributes.uv;
+    let changed = false;
+
+    CARGO_FACE_TEXTURES.forEach((key, face) => {
+        const entry = getAtlasEntry(sku[key]);
+        if (!entry) return;
+        const [, u0, v0, u1, v1] = entry;
+        for (let i = face * 4; i < face * 4 + 4; i++) {
+            uv.setXY(i, u0 + uv.getX(i) * (u1 - u0), v0 + uv.getY(i) * (v1 - v0));
+        }
+        changed = true;
+    });
+
+    if (changed) {
+        uv.needsUpdate = true;
+    }
+}
+
 /**
  * 创建货物6面材质
  * BoxGeometry面顺序: +X(右), -X(左), +Y(上), -Y(下), +Z(前), -Z(后)
  */
 function createCargoMaterials(sku, width, height, depth) {
-    const textureLoader = new THREE.TextureLoader();
     const defaultColor = 0xD4A574;
 
     const createDefaultMaterial = () => new THREE.MeshStandardMaterial({
@@ -31,22 +150,20 @@ function createCargoMaterials(sku, width, height, depth) {
         metalness: 0.1
     });
 
-    const createTextureMaterial = (textureFile) => {
+    const createTextureMaterial = (texturePromise, label) => {
         const material = new THREE.MeshStandardMaterial({
             color: 0xffffff,
             roughness: 0.6,
             metalness: 0.1
         });
 
-        textureLoader.load(
-            `/static/uploads/sku_images/${textureFile}`,
+        texturePromise.then(
             (texture) => {
                 material.map = texture;
                 material.needsUpdate = true;
             },
-            undefined,
-            (error) => {
-                console.log('贴图加载失败:', textureFile);
+            () => {
+                console.log('贴图加载失败:', label);
                 material.color.setHex(defaultColor);
             }
         );
@@ -54,14 +171,24 @@ function createCargoMaterials(sku, width, height, depth) {
         return material;
     };
 
-    const materials = [
-        sku.texture_right ? createTextureMaterial(sku.texture_right) : createDefaultMaterial(),
-        sku.texture_left ? createTextureMaterial(sku.texture_left) : createDefaultMaterial(),
-        sku.texture_top ? createTextureMaterial(sku.texture_top) : createDefaultMaterial(),
-        sku.texture_bottom ? createTextureMaterial(sku.texture_bottom) : createDefaultMaterial(),
-        sku.texture_front ? createTextureMaterial(sku.texture_front) : createDefaultMaterial(),
-        sku.texture_back ? createTextureMaterial(sku.texture_back) : createDefaultMaterial()
-    ];
+    // 位于同一页图集的面共用一个材质（UV 由 applyAtlasUVs 映射）
+    const atlasMaterials = {};
+
+    const materials = CARGO_FACE_TEXTURES.map((key) => {
+        const textureFile = sku[key];
+        if (!textureFile) {
+            return createDefaultMaterial();
+        }
+        const entry = getAtlasEntry(textureFile);
+        if (!entry) {
+            return createTextureMaterial(loadCargoTexture(textureFile), textureFile);
+        }
+        const page = entry[0];
+        if (!atlasMaterials[page]) {
+            atlasMaterials[page] = createTextureMaterial(loadAtlasPage(page), textureAtlas.pages[page]);
+        }
+        return atlasMaterials[page];
+    });
 
     return materials;
 }
@@ -84,6 +211,7 @@ function createCargo(sku, x = 0, y = 0, z = 0) {
     const materials = createCargoMaterials(sku, width, height, depth);
 
     const boxGeometry = new THREE.BoxGeometry(width, height, depth);
+    applyAtlasUVs(boxGeometry, sku);
     const box = new THREE.Mesh(boxGeometry, materials);
     box.castShadow = true;
     box.receiveShadow = true;
@@ -155,37 +283,20 @@ async function saveCargoToDb(cargo, skuId, x, y, z) {
 }
 
 /**
- * 从数据库加载所有货物
+ * 从数据库加载所有货物（二进制快照，格式见 cargo_snapshot.py）
  */
 async function loadCargosFromDb() {
     try {
-        const response = await fetch('/api/cargos');
+        await loadTextureAtlas();
+        const response = await fetch('/api/cargos/snapshot');
         if (response.ok) {
-            const cargos = await response.json();
-            console.log('从数据库加载货物:', cargos.length);
-
-            for (const cargoData of cargos) {
-                const sku = {
-                    id: cargoData.sku_id,
-                    name: cargoData.sku.name,
-                    sku_code: cargoData.sku.sku_code,
-                    length: cargoData.sku.length,
-                    width: cargoData.sku.width,
-                    height: cargoData.sku.height,
-                    weight: cargoData.sku.weight,
-                    thumbnail: cargoData.sku.thumbnail,
-                    texture_top: cargoData.sku.texture_top,
-                    texture_bottom: cargoData.sku.texture_bottom,
-                    texture_front: cargoData.sku.texture_front,
-                    texture_back: cargoData.sku.texture_back,
-                    texture_left: cargoData.sku.texture_left,
-                    texture_right: cargoData.sku.texture_right
-                };
+            const snapshot = decodeCargoSnapshot(await response.arrayBuffer());
+            console.log('从数据库加载货物:', snapshot.count);
 
-                const cargo = createCargoFromDb(sku, cargoData.x, cargoData.y, cargoData.z, cargoData.id);
-                if (cargoData.rotation !== undefined && cargoData.rotation !== null) {
-                    cargo.rotation.y = cargoData.rotation;
-                }
+            for (let i = 0; i < snapshot.count; i++) {
+                const sku = snapshot.skus[snapshot.skuIndex[i]];
+                const cargo = createCargoFromDb(sku, snapshot.x[i], snapshot.y[i], snapshot.z[i], snapshot.ids[i]);
+                cargo.rotation.y = snapshot.rotation[i];
             }
         }
     } catch (error) {
@@ -193,6 +304,45 @@ async function loadCargosFromDb() {
     }
 }
 
+/**
+ * 解析货物二进制快照：头部 JSON + float32 坐标列 + uint32 SKU 下标列 + ID 文本
+ */
+function decodeCargoSnapshot(buffer) {
+    const view = new DataView(buffer);
+    const magic = String.fromCharCode(...new Uint8Array(buffer, 0, 4));
+    if (magic !== 'WCS1') {
+        throw new Error('无法识别的货物快照格式');
+    }
+
+    const headerLength = view.getUint32(4, true);
+    const decoder = new TextDecoder();
+    const header = JSON.parse(decoder.decode(new Uint8Array(buffer, 8, headerLength)));
+    const count = header.count;
+
+    let offset = 8 + headerLength;
+    offset += (4 - offset % 4) % 4;
+
+    const column = (ArrayType) => {
+        const values = new ArrayType(buffer, offset, count);
+        offset += count * 4;
+        return values;
+    };
+
+    const x = column(Float32Array);
+    const y = column(Float32Array);
+    const z = column(Float32Array);
+    const rotation = column(Float32Array);
+    const skuIndex = column(Uint32Array);
+    const idsText = decoder.decode(new Uint8Array(buffer, offset, header.ids_bytes));
+
+    return {
+        count,
+        skus: header.skus,
+        x, y, z, rotation, skuIndex,
+        ids: count > 0 ? idsText.split('\n') : []
+    };
+}
+
 /**
  * 从数据库数据创建货物（不再保存到数据库）
  */
@@ -207,6 +357,7 @@ function createCargoFromDb(sku, x, y, z, dbId) {
     const materials = createCargoMaterials(sku, width, height, depth);
 
     const boxGeometry = new THREE.BoxGeometry(width, height, depth);
+    applyAtlasUVs(boxGeometry, sku);
     const box = new THREE.Mesh(boxGeometry, materials);
     box.castShadow = true;
     box.receiveShadow = true;
@@ -351,7 +502,7 @@ function updateCargoGravity(cargo) {
             
             if (cargoData.dbId) {
                 const baseY = cargo.position.y - cargoData.height / 2;
-                updateCargoPosition(cargoData.dbId, cargo.position.x, baseY, cargo.position.z);
+                queueCargoPositionUpdate(cargoData.dbId, cargo.position.x, baseY, cargo.position.z);
             }
         } else {
             requestAnimationFrame(animate);
@@ -522,8 +673,8 @@ async function loadSkuListForCargo() {
     try {
         const response = await fetch('/api/skus');
         if (response.ok) {
-            const skuList = await response.json();
-            renderSkuListForCargo(skuList);
+            const result = await response.json();
+            renderSkuListForCargo(result.items);
         }
     } catch (error) {
         console.error('加载SKU列表失败:', error);
@@ -546,7 +697,7 @@ function renderSkuListForCargo(skuList) {
         <div class="cargo-sku-item" onclick="selectSkuForCargo('${sku.id}')" data-sku-id="${sku.id}">
             <div class="cargo-sku-thumbnail">
                 ${sku.thumbnail
-            ? `<img src="/static/uploads/sku_thumbnails/${sku.thumbnail}" alt="${sku.name}">`
+            ? `<img src="${window.SkuModule.getSkuThumbnailUrl(sku)}" alt="${sku.name}">`
             : '<div class="cargo-sku-no-image">📦</div>'
         }
             </div>
@@ -803,6 +954,90 @@ async function deleteCargo(cargo) {
     }
 }
 
+/**
+ * 从场景中移除指定SKU的货物（SKU删除后数据库中的货物已被级联删除）
+ * @param {Array<string>} skuIds - 已删除的SKU ID
+ */
+function removeCargosBySku(skuIds) {
+    const removed = new Set(skuIds);
+    const deleted = window.cargos.filter(cargo => removed.has(cargo.userData.skuId));
+    if (deleted.length === 0) return;
+
+    const scene = window.CoreModule.getScene();
+    for (const cargo of deleted) {
+        cargo.userData.isBeingDeleted = true;
+    }
+    for (const cargo of deleted) {
+        triggerStackedCargosFall(cargo);
+        scene.remove(cargo);
+    }
+    window.cargos = window.cargos.filter(cargo => !cargo.userData.isBeingDeleted);
+}
+
+/**
+ * 本页面新放置的货物在 POST 返回前还没有 dbId，推送的 insert 延迟处理，避免重复创建
+ */
+const REMOTE_INSERT_DELAY = 1000;
+
+function findCargoByDbId(dbId) {
+    return window.cargos.find(cargo => cargo.userData.dbId === dbId);
+}
+
+/**
+ * 应用变更推送中的货物变更（见 change_feed.py）
+ * @param {Object} change - {op, id, data}，data 为货物行（删除时为 null）
+ */
+async function applyCargoChange(change) {
+    const existing = findCargoByDbId(change.id);
+    const data = change.data;
+
+    if (change.op === 'delete') {
+        if (!existing) return;
+        window.CoreModule.getScene().remove(existing);
+        window.cargos = window.cargos.filter(cargo => cargo !== existing);
+        return;
+    }
+    if (!data) return;
+
+    if (change.op === 'update') {
+        // 正在拖动的货物以本地为准
+        if (!existing || existing.userData.selected) return;
+        existing.position.set(data.x, data.y + existing.userData.height / 2, data.z);
+        existing.rotation.y = data.rotation || 0;
+        return;
+    }
+
+    await new Promise(resolve => setTimeout(resolve, REMOTE_INSERT_DELAY));
+    if (findCargoByDbId(change.id)) return;
+
+    let sku = window.cargos.find(cargo => cargo.userData.skuId === data.sku_id)?.userData.sku;
+    if (!sku) {
+        try {
+            const response = await fetch(`/api/skus/${data.sku_id}`);
+            if (!response.ok) return;
+            sku = await response.json();
+        } catch (error) {
+            console.error('获取SKU失败:', error);
+            return;
+        }
+    }
+    if (findCargoByDbId(change.id)) return;
+    const cargo = createCargoFromDb(sku, data.x, data.y, data.z, change.id);
+    cargo.rotation.y = data.rotation || 0;
+}
+
+/**
+ * 移除场景中的全部货物并重新从数据库加载（变更推送无法续传时使用）
+ */
+async function reloadCargos() {
+    const scene = window.CoreModule.getScene();
+    for (const cargo of window.cargos) {
+        scene.remove(cargo);
+    }
+    window.cargos = [];
+    await loadCargosFromDb();
+}
+
 /**
  * 清除所有货物
  */
@@ -900,6 +1135,41 @@ async function updateCargoPosition(cargoId, x, y, z, rotation = 0) {
     }
 }
 
+/**
+ * 把货物位置更新加入批量队列（同一货物只保留最新位置）
+ */
+function queueCargoPositionUpdate(cargoId, x, y, z) {
+    pendingCargoUpdates.set(cargoId, { id: cargoId, x: x, y: y, z: z });
+    if (!cargoUpdateTimer) {
+        cargoUpdateTimer = setTimeout(flushCargoPositionUpdates, CARGO_BATCH_DELAY);
+    }
+}
+
+/**
+ * 一次请求提交队列中的所有位置更新
+ */
+async function flushCargoPositionUpdates() {
+    cargoUpdateTimer = null;
+    if (pendingCargoUpdates.size === 0) return;
+
+    const updates = Array.from(pendingCargoUpdates.values());
+    pendingCargoUpdates.clear();
+
+    try {
+        const response = await fetch('/api/cargos/batch', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ update: updates })
+        });
+
+        if (response.ok) {
+            console.log('货物位置已批量更新到数据库:', updates.length);
+        }
+    } catch (error) {
+        console.error('批量更新货物位置失败:', error);
+    }
+}
+
 /**
  * 查找点击对象对应的货物
  */
@@ -918,11 +1188,16 @@ window.CargoModule = {
     createCargo,
     deleteCargo,
     clearAllCargos,
+    removeCargosBySku,
+    applyCargoChange,
+    reloadCargos,
     loadCargosFromDb,
     updateCargoGravity,
     updateAllCargosGravity,
     updateCargoAppearance,
     updateCargoPosition,
+    queueCargoPositionUpdate,
+    flushCargoPositionUpdates,
     getSupportHeight,
     openAddCargoModal,
     closeAddCargoModal,
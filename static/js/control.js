@@ -1,4 +1,14 @@
 
+/**
+ * 上次成功保存到服务器的配置状态（用于计算增量补丁）
+ */
+let lastSavedState = null;
+
+/**
+ * 按元素比较的列表字段，其余字段整体比较
+ */
+const PATCH_LIST_KEYS = ['shelves', 'parts', 'aisles'];
+
 /**
  * 加载配置文件
  */
@@ -6,6 +16,7 @@ async function loadConfig() {
     try {
         const response = await fetch('/api/config');
         window.config = await response.json();
+        lastSavedState = snapshotConfigState(window.config);
         updateUIFromConfig();
         renderShelvesFromConfig();
         renderPartsFromConfig();
@@ -17,13 +28,27 @@ async function loadConfig() {
     }
 }
 
+/**
+ * 串行化的保存队列，避免并发保存使用同一个 revision 互相冲突
+ */
+let saveQueue = Promise.resolve();
+
 /**
  * 保存配置到服务器
  */
-async function saveConfig() {
+function saveConfig() {
+    saveQueue = saveQueue.then(persistConfig);
+    return saveQueue;
+}
+
+/**
+ * 计算与上次保存的差异并提交到服务器
+ */
+async function persistConfig() {
     try {
         const shelves = window.ShelfModule.getShelves();
         const shelvesData = window.shelves.map(shelf => ({
+            id: shelf.userData.id,
             position: { x: shelf.position.x, y: shelf.position.y, z: shelf.position.z },
             dimensions: {
                 length: shelf.userData.length,
@@ -55,14 +80,34 @@ async function saveConfig() {
 
         const aislesData = window.AisleModule ? window.AisleModule.getAisleData() : [];
 
-        const response = await fetch('/api/config', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ ...config, shelves: shelvesData, environment: environmentConfig, parts: partsData, aisles: aislesData })
-        });
+        const state = snapshotConfigState({ ...window.config, shelves: shelvesData, environment: environmentConfig, parts: partsData, aisles: aislesData });
+
+        let response;
+        if (lastSavedState) {
+            const patch = buildConfigPatch(lastSavedState, state);
+            if (patch.length === 0) return;
+
+            response = await fetch('/api/config', {
+                method: 'PATCH',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ revision: window.config.revision, patch })
+            });
+        } else {
+            response = await fetch('/api/config', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ ...state, revision: window.config.revision })
+            });
+        }
 
         if (response.ok) {
+            const result = await response.json();
+            window.config.revision = result.revision;
+            lastSavedState = state;
             console.log('配置保存成功');
+        } else if (response.status === 409) {
+            window.InfoModule.showError('配置已被其他用户修改，已重新加载最新配置');
+            await loadConfig();
         }
     } catch (error) {
         console.error('保存配置失败:', error);
@@ -70,6 +115,51 @@ async function saveConfig() {
     }
 }
 
+/**
+ * 生成配置状态的可比较快照（去掉 undefined 字段）
+ */
+function snapshotConfigState(config) {
+    const { revision, ...state } = config;
+    return JSON.parse(JSON.stringify(state));
+}
+
+/**
+ * 计算两份配置状态之间的 JSON Patch（RFC 6902）操作
+ */
+function buildConfigPatch(previous, current) {
+    const ops = [];
+
+    Object.keys(previous).forEach(key => {
+        if (!(key in current)) {
+            ops.push({ op: 'remove', path: `/${key}` });
+        }
+    });
+
+    Object.keys(current).forEach(key => {
+        const prev = previous[key];
+        const cur = current[key];
+
+        if (PATCH_LIST_KEYS.includes(key) && Array.isArray(prev) && Array.isArray(cur)) {
+            const common = Math.min(prev.length, cur.length);
+            for (let i = 0; i < common; i++) {
+                if (JSON.stringify(prev[i]) !== JSON.stringify(cur[i])) {
+                    ops.push({ op: 'replace', path: `/${key}/${i}`, value: cur[i] });
+                }
+            }
+            for (let i = prev.length - 1; i >= cur.length; i--) {
+                ops.push({ op: 'remove', path: `/${key}/${i}` });
+            }
+            for (let i = prev.length; i < cur.length; i++) {
+                ops.push({ op: 'add', path: `/${key}/-`, value: cur[i] });
+            }
+        } else if (JSON.stringify(prev) !== JSON.stringify(cur)) {
+            ops.push({ op: key in previous ? 'replace' : 'add', path: `/${key}`, value: cur });
+        }
+    });
+
+    return ops;
+}
+
 /**
  * 应用全局配置
  */
@@ -90,7 +180,12 @@ async function applyGlobalConfig() {
         });
 
         if (response.ok) {
+            const result = await response.json();
             window.config.global_params = globalConfig;
+            window.config.revision = result.revision;
+            if (lastSavedState) {
+                lastSavedState.global_params = JSON.parse(JSON.stringify(globalConfig));
+            }
             window.InfoModule.showSuccess('全局配置应用成功');
             initializeShelves();
         }
@@ -215,6 +310,7 @@ function applyDimensions() {
         scene.remove(selectedShelf);
 
         const newShelf = window.ShelfModule.createShelf(width, height, depth, position.x, position.z);
+        newShelf.userData.id = selectedShelf.userData.id;
         newShelf.userData.selected = true;
         window.ShelfModule.updateShelfAppearance(newShelf);
         window.EventsModule.setSelectedShelf(newShelf);
@@ -476,6 +572,9 @@ function renderShelvesFromConfig() {
                 0
             );
             shelf.position.set(position.x, position.y, position.z);
+            if (shelfData.id) {
+                shelf.userData.id = shelfData.id;
+            }
         });
     }
 }
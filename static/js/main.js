@@ -33,15 +33,113 @@ function initializeApp() {
 }
 
 /**
- * 设置定时任务
+ * 设置定时任务：支持 SSE 时订阅变更推送，否则定时刷新统计
  */
 function setupTimers() {
+    if (window.EventSource) {
+        subscribeChanges();
+        return;
+    }
 
     setInterval(() => {
         window.ControlModule.updateStatistics();
     }, 10000);
 }
 
+/**
+ * 合并短时间内的多次调用，只执行最后一次
+ */
+function debounce(fn, delay) {
+    let timer = null;
+    return () => {
+        clearTimeout(timer);
+        timer = setTimeout(fn, delay);
+    };
+}
+
+const refreshStatistics = debounce(() => window.ControlModule.updateStatistics(), 500);
+const reloadConfig = debounce(() => window.ControlModule.loadConfig(), 300);
+
+const CHANGE_POLL_INTERVAL = 5000;
+
+/**
+ * 应用一条服务器变更
+ */
+function applyChange(change) {
+    if (change.kind === 'cargo') {
+        window.CargoModule.applyCargoChange(change);
+    } else if (change.kind === 'sku' && change.op === 'delete') {
+        window.CargoModule.removeCargosBySku([change.id]);
+    } else if (change.kind === 'config') {
+        // 本页面保存产生的变更 revision 已是最新，不重复加载
+        if (change.data && change.data.revision > (window.config.revision || 0)) {
+            reloadConfig();
+        }
+    }
+    refreshStatistics();
+}
+
+/**
+ * 无法续传增量时重新全量加载
+ */
+function reloadAll() {
+    window.ControlModule.loadConfig();
+    window.CargoModule.reloadCargos();
+}
+
+/**
+ * 订阅服务器变更推送（/api/changes/stream），只应用其他客户端或后台任务产生的增量；
+ * 断线后浏览器按 Last-Event-ID 自动续传，无法续传时收到 reset 并重新全量加载。
+ * 服务器连接数已满（503）时 EventSource 不再重连，改为从最后收到的 revision 开始轮询
+ */
+function subscribeChanges() {
+    const source = new EventSource('/api/changes/stream');
+    let revision = null;
+
+    source.addEventListener('ready', (event) => {
+        revision = JSON.parse(event.data).revision;
+    });
+
+    source.addEventListener('change', (event) => {
+        const change = JSON.parse(event.data);
+        revision = change.revision;
+        applyChange(change);
+    });
+
+    source.addEventListener('reset', (event) => {
+        revision = JSON.parse(event.data).revision;
+        reloadAll();
+    });
+
+    source.onerror = () => {
+        if (source.readyState === EventSource.CLOSED) {
+            pollChanges(revision);
+        }
+    };
+}
+
+/**
+ * 轮询 /api/changes，since 为 null 时从服务器当前的 revision 开始
+ */
+async function pollChanges(since) {
+    let revision = since;
+    try {
+        const response = await fetch(revision === null ? '/api/changes' : `/api/changes?since=${revision}`);
+        if (response.ok) {
+            const result = await response.json();
+            if (result.reset) {
+                reloadAll();
+            } else {
+                result.changes.forEach(applyChange);
+            }
+            revision = result.revision;
+        }
+    } catch (error) {
+        console.error('获取变更失败:', error);
+    }
+    setTimeout(() => pollChanges(revision), CHANGE_POLL_INTERVAL);
+}
+
 /**
  * 全局API访问函数
  */
@@ -8,6 +8,7 @@ function createShelf(width = 2, height = 3, depth = 1, x = 0, y = 0) {
     const shelfGroup = new THREE.Group();
     const shelfName = `货架-${window.shelves.length + 1}`;
     shelfGroup.userData = {
+        id: generateShelfId(),
         isShelf: true,
         selected: false,
         hovered: false,
@@ -136,6 +137,19 @@ function createShelf(width = 2, height = 3, depth = 1, x = 0, y = 0) {
     return shelfGroup;
 }
 
+/**
+ * 生成货架的稳定ID（与服务端的 UUID 格式一致）
+ */
+function generateShelfId() {
+    if (window.crypto && window.crypto.randomUUID) {
+        return window.crypto.randomUUID();
+    }
+    return 'xxxxxxxx-xxxx-4xxx-yxxx-xxxxxxxxxxxx'.replace(/[xy]/g, c => {
+        const r = Math.random() * 16 | 0;
+        return (c === 'x' ? r : (r & 0x3 | 0x8)).toString(16);
+    });
+}
+
 /**
  * 添加立柱孔洞装饰
  */
@@ -59,7 +59,8 @@ async function loadSkuList() {
     try {
         const response = await fetch('/api/skus');
         if (response.ok) {
-            skuList = await response.json();
+            const result = await response.json();
+            skuList = result.items;
             renderSkuList();
         }
     } catch (error) {
@@ -67,6 +68,16 @@ async function loadSkuList() {
     }
 }
 
+/**
+ * SKU缩略图地址：缩略图仍在后台生成或生成失败时显示原图
+ */
+function getSkuThumbnailUrl(sku) {
+    if (sku.image_status !== 'ready' && sku.image) {
+        return `/static/uploads/sku_images/${sku.image}`;
+    }
+    return `/static/uploads/sku_thumbnails/${sku.thumbnail}`;
+}
+
 /**
  * 渲染SKU列表
  */
@@ -83,7 +94,7 @@ function renderSkuList() {
         <div class="sku-item" data-id="${sku.id}">
             <div class="sku-thumbnail">
                 ${sku.thumbnail
-            ? `<img src="/static/uploads/sku_thumbnails/${sku.thumbnail}" alt="${sku.name}">`
+            ? `<img src="${getSkuThumbnailUrl(sku)}" alt="${sku.name}">`
             : '<div class="sku-no-image">📦</div>'
         }
             </div>
@@ -189,7 +200,7 @@ function editSku(skuId) {
     const preview = document.getElementById('skuImagePreview');
     if (preview) {
         if (sku.thumbnail) {
-            preview.innerHTML = `<img src="/static/uploads/sku_thumbnails/${sku.thumbnail}" alt="${sku.name}">`;
+            preview.innerHTML = `<img src="${getSkuThumbnailUrl(sku)}" alt="${sku.name}">`;
         } else {
             preview.innerHTML = '<div class="upload-placeholder">点击上传图片</div>';
         }
@@ -238,6 +249,9 @@ async function deleteSku(skuId) {
         });
 
         if (response.ok) {
+            if (window.CargoModule) {
+                window.CargoModule.removeCargosBySku([skuId]);
+            }
             await loadSkuList();
             if (editingSkuId === skuId) {
                 clearSkuForm();
@@ -355,7 +369,8 @@ async function handleImageUpload(event) {
             };
 
             if (preview) {
-                preview.innerHTML = `<img src="${result.thumbnail_url}" alt="预览">`;
+                // 缩略图在后台生成，预览直接使用原图
+                preview.innerHTML = `<img src="${result.image_url}" alt="预览">`;
             }
         } else {
             const error = await response.json();
@@ -494,7 +509,8 @@ window.SkuModule = {
     triggerImageUpload,
     handleImageUpload,
     getSkuList,
-    getSkuById
+    getSkuById,
+    getSkuThumbnailUrl
 };
 
 window.openSkuModal = openSkuModal;
@@ -0,0 +1,126 @@
+import importlib
+import os
+
+import pytest
+
+from json_patch import JsonPatchError, apply_patch
+
+
+def make_doc():
+    return {"revision": 3, "shelves": [{"id": "a", "x": 1}], "global_params": {"layer_count": 5}}
+
+
+def test_add_replace_remove():
+    doc = make_doc()
+    apply_patch(doc, [
+        {"op": "add", "path": "/shelves/-", "value": {"id": "b"}},
+        {"op": "replace", "path": "/shelves/0/x", "value": 2},
+        {"op": "remove", "path": "/global_params/layer_count"},
+    ])
+    assert doc["shelves"] == [{"id": "a", "x": 2}, {"id": "b"}]
+    assert doc["global_params"] == {}
+
+
+def test_escaped_pointer_tokens():
+    doc = {"a/b": {"c~d": 1}}
+    apply_patch(doc, [{"op": "replace", "path": "/a~1b/c~0d", "value": 2}])
+    assert doc == {"a/b": {"c~d": 2}}
+
+
+@pytest.mark.parametrize("operation", [
+    {"op": "add", "path": 5, "value": 1},
+    {"op": "remove", "path": None},
+    {"op": "replace", "path": ["shelves"], "value": 1},
+    {"op": "test", "path": {"a": 1}, "value": 1},
+    {"op": "move", "from": 1, "path": "/x"},
+    {"op": "move", "from": "/global_params", "path": 1},
+    {"op": "copy", "from": ["a"], "path": "/x"},
+    {"op": "add", "path": "shelves", "value": 1},
+    {"op": "copy", "from": "global_params", "path": "/x"},
+    {"op": "replace", "path": "", "value": {}},
+])
+def test_invalid_pointers_raise_patch_error(operation):
+    doc = make_doc()
+    with pytest.raises(JsonPatchError):
+        apply_patch(doc, [operation])
+    assert doc == make_doc()
+
+
+@pytest.mark.parametrize("operations", [
+    {"op": "add"},
+    "not a list",
+    [["op", "add"]],
+    [{"path": "/x"}],
+    [{"op": "add", "path": "/x"}],
+    [{"op": "move", "path": "/x"}],
+    [{"op": "frobnicate", "path": "/x"}],
+])
+def test_malformed_operations(operations):
+    with pytest.raises(JsonPatchError):
+        apply_patch(make_doc(), operations)
+
+
+def test_failed_operation_rolls_back_earlier_ones():
+    doc = make_doc()
+    with pytest.raises(JsonPatchError):
+        apply_patch(doc, [
+            {"op": "add", "path": "/shelves/-", "value": {"id": "b"}},
+            {"op": "remove", "path": "/global_params/missing"},
+        ])
+    assert doc == make_doc()
+
+
+def test_move_into_own_child_is_rejected():
+    doc = make_doc()
+    with pytest.raises(JsonPatchError):
+        apply_patch(doc, [{"op": "move", "from": "/global_params", "path": "/global_params/inner"}])
+    assert doc == make_doc()
+
+
+def test_validate_failure_rolls_back():
+    def validate(doc):
+        if not all(isinstance(shelf, dict) for shelf in doc["shelves"]):
+            raise ValueError("shelves 必须是由对象组成的数组")
+
+    doc = make_doc()
+    with pytest.raises(JsonPatchError):
+        apply_patch(doc, [{"op": "add", "path": "/shelves/-", "value": "oops"}], validate=validate)
+    assert doc == make_doc()
+
+
+@pytest.fixture(scope='module')
+def client(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('patch')
+    os.environ['WAREHOUSE_CONFIG_FILE'] = str(directory / 'warehouse_config.json')
+    os.environ['WAREHOUSE_DB_FILE'] = str(directory / 'sku_data.db')
+    app_module = importlib.import_module('app')
+    yield app_module.create_app().test_client()
+    app_module.config_store.flush()
+
+
+@pytest.mark.parametrize("body", [[1, 2], "patch", 3, None])
+def test_patch_endpoint_rejects_non_object_body(client, body):
+    response = client.patch('/api/config', json=body)
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("operation", [
+    {"op": "add", "path": 5, "value": 1},
+    {"op": "move", "from": ["x"], "path": "/a"},
+    {"op": "add", "path": "/shelves/-", "value": "oops"},
+])
+def test_patch_endpoint_rejects_invalid_operations(client, operation):
+    revision = client.get('/api/config').get_json()['revision']
+    response = client.patch('/api/config', json={"patch": [operation]})
+    assert response.status_code == 400
+    assert client.get('/api/config').get_json()['revision'] == revision
+
+
+def test_patch_endpoint_applies_valid_patch(client):
+    revision = client.get('/api/config').get_json()['revision']
+    response = client.patch('/api/config', json={"revision": revision, "patch": [
+        {"op": "add", "path": "/shelves/-", "value": {"id": "patched"}},
+    ]})
+    assert response.status_code == 200
+    assert response.get_json()['revision'] == revision + 1
+    assert client.get('/api/shelves/patched').status_code == 200
@@ -0,0 +1,265 @@
+"""SKU 贴图图集
+
+把所有 SKU 用到的面贴图（texture_top ... texture_right）缩放为统一大小的格子，
+拼进若干张共享的图集页，前端只需加载少量图集页，按 UV 查找表把各面映射到对应格子。
+
+每张贴图占用的（页, 格子）保存在 atlas_slots 表中，一旦分配就不再移动：
+SKU 变化后只为新出现的贴图分配空闲格子，并只重绘有新贴图的页；
+不再使用的贴图释放格子，旧内容留在页中直到格子被复用时重绘。
+图集页以内容摘要命名（atlas_<摘要>.webp），可以被浏览器永久缓存。
+
+格子分配和图集页切换都在 BEGIN IMMEDIATE 事务中完成，多个进程同时更新也不会分配冲突；
+图集页在图片进程池中绘制，请求不等待绘制完成。atlas_pages 只记录已绘制完成的页及其包含的格子，
+查找表由它生成，因此绘制期间继续返回上一张完整的查找表。被替换的旧页记入 atlas_retired，
+超过宽限期后才删除，仍在使用旧查找表的客户端可以继续加载。
+"""
+import json
+import os
+import threading
+import time
+
+from image_jobs import QueueFull, make_atlas_page
+from image_store import content_hash
+
+ATLAS_PAGE_SIZE = 2048
+ATLAS_TILE_SIZE = 256
+# UV 向格子内收缩的像素数，避免线性过滤时采样到相邻格子
+ATLAS_UV_INSET = 1.0
+# 被替换的图集页保留的秒数
+ATLAS_RETIRE_GRACE = 3600
+
+TEXTURE_COLUMNS = ('texture_top', 'texture_bottom', 'texture_front',
+                   'texture_back', 'texture_left', 'texture_right')
+
+
+def init_atlas_schema(cursor):
+    """创建图集格子分配表、图集页表和待删除的旧页表"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS atlas_slots (
+            filename TEXT PRIMARY KEY,
+            page INTEGER NOT NULL,
+            slot INTEGER NOT NULL,
+            UNIQUE (page, slot)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS atlas_pages (
+            page INTEGER PRIMARY KEY,
+            filename TEXT NOT NULL,
+            tiles TEXT
+        )
+    ''')
+    # 旧版本的 atlas_pages 没有 tiles 列，这些页在下次更新时重绘
+    existing = {row[1] for row in cursor.execute('PRAGMA table_info(atlas_pages)').fetchall()}
+    if 'tiles' not in existing:
+        cursor.execute('ALTER TABLE atlas_pages ADD COLUMN tiles TEXT')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS atlas_retired (
+            filename TEXT PRIMARY KEY,
+            retired_at REAL NOT NULL
+        )
+    ''')
+
+
+def page_filename(tiles):
+    """图集页文件名由格子分配 [(格子序号, 贴图文件名)] 决定，相同内容不会重复绘制"""
+    key = ';'.join(f'{slot}={filename}' for slot, filename in tiles)
+    return f"atlas_{content_hash(key.encode('utf-8'))}.webp"
+
+
+class TextureAtlas:
+    """按需增量维护的贴图图集，version 为 SKU 表的修改计数，图集页交给 jobs（ImageJobQueue）绘制"""
+
+    def __init__(self, connect, jobs, image_dir, output_dir, url_prefix,
+                 page_size=ATLAS_PAGE_SIZE, tile_size=ATLAS_TILE_SIZE, retire_grace=ATLAS_RETIRE_GRACE):
+        self.connect = connect
+        self.jobs = jobs
+        self.image_dir = image_dir
+        self.output_dir = output_dir
+        self.url_prefix = url_prefix
+        self.page_size = page_size
+        self.tile_size = tile_size
+        self.retire_grace = retire_grace
+        self.columns = page_size // tile_size
+        self.slots_per_page = self.columns * self.columns
+        # 任务可能在提交时就已完成，回调在持有锁的线程中执行，因此使用可重入锁
+        self._lock = threading.RLock()
+        self._version = None
+        self._pages = None
+        self._lookup = None
+        self._rendering = set()
+
+    def lookup(self, version):
+        """返回 (ETag, UV 查找表)
+
+        SKU 有变化（version 不同）时先分配格子并提交需要重绘的页，不等待绘制完成；
+        查找表只包含已绘制完成的页，complete 为假表示还有页在绘制。
+        """
+        with self._lock:
+            if version != self._version:
+                self._version = version
+                try:
+                    self._update()
+                except BaseException as e:
+                    # 下次请求时重试；队列已满时先返回上一张查找表
+                    self._version = None
+                    if not isinstance(e, QueueFull):
+                        raise
+
+            conn = self.connect()
+            try:
+                cursor = conn.cursor()
+                cursor.execute('SELECT page, filename, tiles FROM atlas_pages WHERE tiles IS NOT NULL')
+                pages = {row['page']: (row['filename'], row['tiles']) for row in cursor.fetchall()}
+            finally:
+                conn.close()
+            if pages != self._pages:
+                self._lookup = self._build_lookup(pages)
+                self._pages = pages
+            etag = 'atlas-' + content_hash(';'.join(filename for filename, _ in pages.values()).encode('utf-8'))
+            return etag, {**self._lookup, "version": version, "complete": not self._rendering}
+
+    def _update(self):
+        """分配格子并提交需要重绘的页，删除超过宽限期的旧页"""
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute(' UNION '.join(
+                f"SELECT {column} AS filename FROM skus WHERE {column} != ''" for column in TEXTURE_COLUMNS))
+            wanted = {row['filename'] for row in cursor.fetchall()
+                      if os.path.exists(os.path.join(self.image_dir, row['filename']))}
+
+            cursor.execute('SELECT filename, page, slot FROM atlas_slots')
+            slots = {row['filename']: (row['page'], row['slot']) for row in cursor.fetchall()}
+            cursor.execute('SELECT page, filename, tiles FROM atlas_pages')
+            pages = {row['page']: (row['filename'], row['tiles']) for row in cursor.fetchall()}
+
+            removed = [filename for filename in slots if filename not in wanted]
+            cursor.executemany('DELETE FROM atlas_slots WHERE filename = ?', [(name,) for name in removed])
+            for filename in removed:
+                del slots[filename]
+
+            used = {}
+            for page, slot in slots.values():
+                used.setdefault(page, set()).add(slot)
+            page = 0
+            for filename in sorted(wanted - slots.keys()):
+                while len(used.get(page, ())) >= self.slots_per_page:
+                    page += 1
+                taken = used.setdefault(page, set())
+                slot = next(i for i in range(self.slots_per_page) if i not in taken)
+                taken.add(slot)
+                slots[filename] = (page, slot)
+                cursor.execute('INSERT INTO atlas_slots (filename, page, slot) VALUES (?, ?, ?)',
+                               (filename, page, slot))
+
+            stale = [page for page in pages if page not in used]
+            cursor.executemany('DELETE FROM atlas_pages WHERE page = ?', [(page,) for page in stale])
+            self._retire(cursor, [pages[page][0] for page in stale])
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+        self._purge_retired()
+        for page in sorted(used):
+            tiles = sorted((slot, filename) for filename, (p, slot) in slots.items() if p == page)
+            filename, rendered = pages.get(page, (None, None))
+            if rendered != json.dumps(tiles) or not os.path.exists(os.path.join(self.output_dir, filename)):
+                self._render(page, tiles)
+
+    def _render(self, page, tiles):
+        """在图片进程池中绘制一页，完成后切换；同一文件已存在时直接切换"""
+        filename = page_filename(tiles)
+        if os.path.exists(os.path.join(self.output_dir, filename)):
+            self._publish(page, tiles, filename)
+            return
+        if filename in self._rendering:
+            return
+        self._rendering.add(filename)
+        try:
+            self.jobs.submit('atlas', make_atlas_page,
+                             [(slot, os.path.join(self.image_dir, name)) for slot, name in tiles],
+                             os.path.join(self.output_dir, filename), self.page_size, self.tile_size,
+                             outputs=[filename],
+                             on_finish=lambda job: self._finished(page, tiles, filename, job))
+        except QueueFull:
+            self._rendering.discard(filename)
+            raise
+
+    def _finished(self, page, tiles, filename, job):
+        with self._lock:
+            self._rendering.discard(filename)
+            if job['status'] == 'done':
+                self._publish(page, tiles, filename)
+            else:
+                # 绘制失败：下次请求时重新分配并重绘
+                self._version = None
+
+    def _publish(self, page, tiles, filename):
+        """切换到已绘制完成的页；该页的格子分配在绘制期间被其他更新改变时放弃，由后来的绘制切换"""
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute('SELECT slot, filename FROM atlas_slots WHERE page = ? ORDER BY slot', (page,))
+            if [tuple(row) for row in cursor.fetchall()] != [tuple(tile) for tile in tiles]:
+                conn.rollback()
+                return
+            cursor.execute('SELECT filename FROM atlas_pages WHERE page = ?', (page,))
+            row = cursor.fetchone()
+            if row is not None and row['filename'] != filename:
+                self._retire(cursor, [row['filename']])
+            cursor.execute('DELETE FROM atlas_retired WHERE filename = ?', (filename,))
+            cursor.execute('INSERT OR REPLACE INTO atlas_pages (page, filename, tiles) VALUES (?, ?, ?)',
+                           (page, filename, json.dumps(tiles)))
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def _retire(self, cursor, filenames):
+        now = time.time()
+        cursor.executemany('INSERT OR REPLACE INTO atlas_retired (filename, retired_at) VALUES (?, ?)',
+                           [(filename, now) for filename in filenames])
+
+    def _purge_retired(self):
+        """删除替换时间早于宽限期的旧页"""
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('SELECT filename FROM atlas_retired WHERE retired_at < ?',
+                           (time.time() - self.retire_grace,))
+            expired = [row['filename'] for row in cursor.fetchall()]
+            cursor.executemany('DELETE FROM atlas_retired WHERE filename = ?', [(name,) for name in expired])
+            conn.commit()
+        finally:
+            conn.close()
+
+        for filename in expired:
+            path = os.path.join(self.output_dir, filename)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _build_lookup(self, pages):
+        """UV 查找表：textures 中每项为 [页, u0, v0, u1, v1]（Three.js 约定，v 轴自下而上）"""
+        size = float(self.page_size)
+        textures = {}
+        for page, (_, tiles) in pages.items():
+            for slot, filename in json.loads(tiles):
+                left = (slot % self.columns) * self.tile_size + ATLAS_UV_INSET
+                top = (slot // self.columns) * self.tile_size + ATLAS_UV_INSET
+                right = left + self.tile_size - 2 * ATLAS_UV_INSET
+                bottom = top + self.tile_size - 2 * ATLAS_UV_INSET
+                textures[filename] = [page, left / size, 1 - bottom / size, right / size, 1 - top / size]
+        return {
+            "page_size": self.page_size,
+            "tile_size": self.tile_size,
+            "pages": {str(page): self.url_prefix + filename for page, (filename, _) in sorted(pages.items())},
+            "textures": textures,
+        }
@@ -0,0 +1,155 @@
+"""上传文件的标记-清除回收
+
+删除 SKU 时只会删除部分文件，替换掉的图片、上传后未保存的 SKU、多面贴图的合成缩略图
+都会一直留在 static/uploads 中。回收分两步：
+
+- 标记：分批扫描 skus 表，收集所有被引用的文件（图片、缩略图、六个面贴图，
+  内容寻址图片的全部派生图），以及当前使用中的贴图图集页；
+- 清除：逐个扫描上传目录，删除未被引用且修改时间早于宽限期的文件，
+  宽限期用于保护刚上传、还没来得及保存到 SKU 的文件。
+
+可通过管理接口 POST /api/admin/uploads/gc 或命令行运行：
+
+    python upload_gc.py [--dry-run] [--grace-period 秒] [--db sku_data.db]
+"""
+import argparse
+import os
+import sqlite3
+import time
+
+from image_store import DERIVATIVES, content_digest, derivative_name
+
+GC_GRACE_PERIOD = 24 * 3600
+GC_BATCH = 1000
+
+SKU_FILE_COLUMNS = ('image', 'thumbnail', 'texture_top', 'texture_bottom', 'texture_front',
+                    'texture_back', 'texture_left', 'texture_right')
+
+
+def _table_exists(cursor, name):
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,))
+    return cursor.fetchone() is not None
+
+
+def _keep(keep, filename):
+    if not filename:
+        return
+    keep.add(filename)
+    digest = content_digest(filename)
+    if digest:
+        keep.update(derivative_name(digest, suffix) for suffix in DERIVATIVES)
+
+
+def mark(conn, batch_size=GC_BATCH):
+    """标记阶段：返回所有仍被引用的文件名"""
+    keep = set()
+    cursor = conn.cursor()
+
+    cursor.execute(f"SELECT {', '.join(SKU_FILE_COLUMNS)} FROM skus")
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        for row in rows:
+            for filename in row:
+                _keep(keep, filename)
+
+    if _table_exists(cursor, 'image_files'):
+        cursor.execute('SELECT filename FROM image_files WHERE refcount > 0')
+        for row in cursor.fetchall():
+            _keep(keep, row['filename'])
+    if _table_exists(cursor, 'atlas_pages'):
+        cursor.execute('SELECT filename FROM atlas_pages')
+        keep.update(row['filename'] for row in cursor.fetchall())
+    # 被替换的图集页在宽限期内仍可能被使用旧查找表的客户端加载，由 texture_atlas 到期删除
+    if _table_exists(cursor, 'atlas_retired'):
+        cursor.execute('SELECT filename FROM atlas_retired')
+        keep.update(row['filename'] for row in cursor.fetchall())
+    return keep
+
+
+def sweep(directories, keep, grace_period=GC_GRACE_PERIOD, dry_run=False):
+    """清除阶段：删除各目录中未被引用且超过宽限期的文件，返回统计信息和删除的文件名"""
+    cutoff = time.time() - grace_period
+    report = {
+        "scanned_files": 0,
+        "scanned_bytes": 0,
+        "deleted_files": 0,
+        "reclaimed_bytes": 0,
+        "directories": {},
+    }
+    deleted = []
+
+    for directory in directories:
+        stats = {"files": 0, "bytes": 0, "deleted_files": 0, "reclaimed_bytes": 0}
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                st = entry.stat(follow_symlinks=False)
+                stats["files"] += 1
+                stats["bytes"] += st.st_size
+                if entry.name in keep or st.st_mtime >= cutoff:
+                    continue
+                if not dry_run:
+                    try:
+                        os.remove(entry.path)
+                    except FileNotFoundError:
+                        continue
+                stats["deleted_files"] += 1
+                stats["reclaimed_bytes"] += st.st_size
+                deleted.append(entry.name)
+
+        report["directories"][os.path.basename(os.path.normpath(directory))] = stats
+        report["scanned_files"] += stats["files"]
+        report["scanned_bytes"] += stats["bytes"]
+        report["deleted_files"] += stats["deleted_files"]
+        report["reclaimed_bytes"] += stats["reclaimed_bytes"]
+
+    return report, deleted
+
+
+def collect_garbage(conn, directories, grace_period=GC_GRACE_PERIOD, dry_run=False):
+    """执行一次完整的标记-清除，返回统计信息（dry_run 时只统计不删除）"""
+    keep = mark(conn)
+    report, deleted = sweep(directories, keep, grace_period, dry_run)
+
+    cursor = conn.cursor()
+    if deleted and not dry_run and _table_exists(cursor, 'image_files'):
+        cursor.executemany('DELETE FROM image_files WHERE filename = ? AND refcount <= 0',
+                           [(filename,) for filename in deleted])
+        conn.commit()
+
+    report["dry_run"] = dry_run
+    report["grace_period"] = grace_period
+    return report
+
+
+def main(argv=None):
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    uploads = os.path.join(base_dir, 'static', 'uploads')
+
+    parser = argparse.ArgumentParser(description='回收 static/uploads 中未被引用的上传文件')
+    parser.add_argument('--db', default=os.path.join(base_dir, 'sku_data.db'), help='SKU 数据库路径')
+    parser.add_argument('--grace-period', type=int, default=GC_GRACE_PERIOD,
+                        help='只删除修改时间早于该秒数的文件（默认 %(default)s）')
+    parser.add_argument('--dry-run', action='store_true', help='只统计，不删除')
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(args.db)
+    conn.row_factory = sqlite3.Row
+    try:
+        report = collect_garbage(conn, [os.path.join(uploads, 'sku_images'), os.path.join(uploads, 'sku_thumbnails')],
+                                 grace_period=args.grace_period, dry_run=args.dry_run)
+    finally:
+        conn.close()
+
+    action = '可回收' if args.dry_run else '已删除'
+    for name, stats in report["directories"].items():
+        print(f"{name}: {stats['files']} 个文件 {stats['bytes']} 字节，"
+              f"{action} {stats['deleted_files']} 个文件 {stats['reclaimed_bytes']} 字节")
+    print(f"合计{action} {report['deleted_files']} 个文件，{report['reclaimed_bytes']} 字节")
+
+
+if __name__ == '__main__':
+    main()
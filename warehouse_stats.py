@@ -0,0 +1,166 @@
+"""仓库统计
+
+SKU 数量、货物数量、货物总体积与总重量保存在 warehouse_stats 表的一行中，
+由 skus/cargos 表上的触发器随每次增删改同步更新，读取统计只需读一行，不再扫描整表。
+
+删除 SKU 时级联删除的货物在触发器中已看不到其 SKU，它们的体积和重量
+由 SKU 的 BEFORE DELETE 触发器统一扣除（此时货物仍在）。
+
+按货架汇总（货物中心落在哪个货架的占地范围内，规则同 stacking.py）需要扫描全部货物，
+结果由 VersionedCache 按（配置 revision, SKU/货物修改计数）缓存，数据没有变化时直接复用。
+"""
+import threading
+
+import numpy as np
+
+from stacking import containing_shelf, shelf_arrays
+
+STATS_COLUMNS = ('sku_count', 'cargo_count', 'cargo_volume', 'cargo_weight')
+
+SKU_VOLUME = 'COALESCE({s}.length * {s}.width * {s}.height, 0)'
+SKU_WEIGHT = 'COALESCE({s}.weight, 0)'
+# SKU 触发器中该 SKU 的货物数
+SKU_CARGO_COUNT = '(SELECT COUNT(*) FROM cargos WHERE sku_id = old.id)'
+
+
+def _sku_measure(sku_id):
+    """货物所属 SKU 的 (单件体积, 单件重量) 子查询，SKU 不存在时为 0"""
+    return (f"COALESCE((SELECT {SKU_VOLUME.format(s='skus')} FROM skus WHERE id = {sku_id}), 0)",
+            f"COALESCE((SELECT {SKU_WEIGHT.format(s='skus')} FROM skus WHERE id = {sku_id}), 0)")
+
+
+def init_stats_schema(cursor):
+    """创建统计表及维护它的触发器，首次创建时按现有数据计算初值"""
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'warehouse_stats'")
+    exists = cursor.fetchone() is not None
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS warehouse_stats (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            sku_count INTEGER NOT NULL DEFAULT 0,
+            cargo_count INTEGER NOT NULL DEFAULT 0,
+            cargo_volume REAL NOT NULL DEFAULT 0,
+            cargo_weight REAL NOT NULL DEFAULT 0
+        )
+    ''')
+
+    new_volume, new_weight = _sku_measure('new.sku_id')
+    old_volume, old_weight = _sku_measure('old.sku_id')
+    triggers = {
+        'stats_sku_insert': ('AFTER INSERT ON skus', 'sku_count = sku_count + 1'),
+        'stats_sku_delete': (
+            'BEFORE DELETE ON skus',
+            f'''sku_count = sku_count - 1,
+                cargo_volume = cargo_volume - {SKU_VOLUME.format(s='old')} * {SKU_CARGO_COUNT},
+                cargo_weight = cargo_weight - {SKU_WEIGHT.format(s='old')} * {SKU_CARGO_COUNT}''',
+        ),
+        'stats_sku_update': (
+            'AFTER UPDATE OF length, width, height, weight ON skus',
+            f'''cargo_volume = cargo_volume + ({SKU_VOLUME.format(s='new')} - {SKU_VOLUME.format(s='old')}) * {SKU_CARGO_COUNT},
+                cargo_weight = cargo_weight + ({SKU_WEIGHT.format(s='new')} - {SKU_WEIGHT.format(s='old')}) * {SKU_CARGO_COUNT}''',
+        ),
+        'stats_cargo_insert': (
+            'AFTER INSERT ON cargos',
+            f'''cargo_count = cargo_count + 1,
+                cargo_volume = cargo_volume + {new_volume},
+                cargo_weight = cargo_weight + {new_weight}''',
+        ),
+        'stats_cargo_delete': (
+            'AFTER DELETE ON cargos',
+            f'''cargo_count = cargo_count - 1,
+                cargo_volume = cargo_volume - {old_volume},
+                cargo_weight = cargo_weight - {old_weight}''',
+        ),
+        'stats_cargo_update': (
+            'AFTER UPDATE OF sku_id ON cargos',
+            f'''cargo_volume = cargo_volume + {new_volume} - {old_volume},
+                cargo_weight = cargo_weight + {new_weight} - {old_weight}''',
+        ),
+    }
+    for name, (event, assignments) in triggers.items():
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN
+                UPDATE warehouse_stats SET {assignments} WHERE id = 1;
+            END
+        ''')
+
+    if not exists:
+        rebuild_stats(cursor)
+
+
+def rebuild_stats(cursor):
+    """按现有数据重新计算统计值"""
+    cursor.execute(f'''
+        INSERT OR REPLACE INTO warehouse_stats (id, {', '.join(STATS_COLUMNS)})
+        SELECT 1,
+            (SELECT COUNT(*) FROM skus),
+            (SELECT COUNT(*) FROM cargos),
+            (SELECT COALESCE(SUM({SKU_VOLUME.format(s='s')}), 0) FROM cargos c JOIN skus s ON s.id = c.sku_id),
+            (SELECT COALESCE(SUM({SKU_WEIGHT.format(s='s')}), 0) FROM cargos c JOIN skus s ON s.id = c.sku_id)
+    ''')
+
+
+def read_stats(cursor):
+    cursor.execute(f"SELECT {', '.join(STATS_COLUMNS)} FROM warehouse_stats WHERE id = 1")
+    row = cursor.fetchone()
+    if row is None:
+        return dict.fromkeys(STATS_COLUMNS, 0)
+    return {
+        "sku_count": row['sku_count'],
+        "cargo_count": row['cargo_count'],
+        # 触发器反复加减会累积浮点误差，输出时取整到 6 位小数
+        "cargo_volume": round(row['cargo_volume'], 6),
+        "cargo_weight": round(row['cargo_weight'], 6),
+    }
+
+
+def cargo_measure_rows(cursor):
+    """按货架汇总所需的货物行：(x, z, 单件体积, 单件重量)"""
+    cursor.execute(f'''
+        SELECT c.x, c.z, {SKU_VOLUME.format(s='s')} AS volume, {SKU_WEIGHT.format(s='s')} AS weight
+        FROM cargos c
+        LEFT JOIN skus s ON s.id = c.sku_id
+    ''')
+    return cursor.fetchall()
+
+
+def shelf_breakdown(rows, shelves):
+    """按货架汇总货物数量、体积和重量，不在任何货架上的货物计入 floor"""
+    data = np.array([tuple(row) for row in rows], dtype=float).reshape(-1, 4)
+    data = np.nan_to_num(data)
+    count = len(shelves)
+    owner = containing_shelf(data[:, 0], data[:, 1], shelf_arrays(shelves))
+
+    # 下标整体加 1，0 号桶为不在货架上的货物
+    buckets = owner + 1
+    cargo_counts = np.bincount(buckets, minlength=count + 1)
+    volumes = np.bincount(buckets, weights=data[:, 2], minlength=count + 1)
+    weights = np.bincount(buckets, weights=data[:, 3], minlength=count + 1)
+
+    def entry(i):
+        return {
+            "cargo_count": int(cargo_counts[i]),
+            "cargo_volume": round(float(volumes[i]), 6),
+            "cargo_weight": round(float(weights[i]), 6),
+        }
+
+    return {
+        "shelves": [{"id": shelf.get('id'), **entry(i + 1)} for i, shelf in enumerate(shelves)],
+        "floor": entry(0),
+    }
+
+
+class VersionedCache:
+    """只保存最近一个版本的计算结果，版本变化时重新计算"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._value = None
+
+    def get(self, version, compute):
+        with self._lock:
+            if self._version != version:
+                self._value = compute()
+                self._version = version
+            return self._value